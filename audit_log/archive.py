@@ -0,0 +1,301 @@
+"""
+Streaming export of audit log entries to compressed segment files.
+
+``export`` walks the entries of a log entry model in ``action_id`` order,
+one keyset page at a time, and writes them to JSON lines or CSV segment
+files of at most ``segment_size`` rows, so memory use doesn't depend on
+the size of the table. A manifest with the row counts, the action id and
+date ranges and a checksum of every segment is written next to them.
+The files of an export are named after the table and the time of the
+export, ``<table>-<time>-00001.jsonl.gz`` and ``<table>-<time>.manifest.json``,
+and are never overwritten.
+``verify`` checks the files against the manifest and ``delete_exported``
+removes the exported entries from the database once they are verified.
+"""
+
+import base64
+import csv
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS
+
+from audit_log import retention
+
+
+FORMATS = ('jsonl', 'csv')
+
+COMPRESSIONS = (None, 'gzip', 'zstd')
+
+EXTENSIONS = {
+    None : '',
+    'gzip' : '.gz',
+    'zstd' : '.zst',
+}
+
+
+class ArchiveError(Exception):
+    pass
+
+
+class ArchiveJSONEncoder(DjangoJSONEncoder):
+    """
+    Keeps the microseconds that ``DjangoJSONEncoder`` cuts off times and
+    writes binary values in base64, as ``BinaryField`` reads them.
+    """
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        if isinstance(o, (bytes, memoryview)):
+            return base64.b64encode(o).decode('ascii')
+        return super(ArchiveJSONEncoder, self).default(o)
+
+
+def _open_zstd(path, mode):
+    try:
+        from compression import zstd
+    except ImportError:
+        try:
+            import zstandard
+        except ImportError:
+            raise ImproperlyConfigured("zstd compression needs Python 3.14 or the zstandard package")
+        raw = open(path, mode.replace('t', 'b'))
+        if 'r' not in mode:
+            stream = zstandard.ZstdCompressor().stream_writer(raw, closefd = True)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, closefd = True)
+        return io.TextIOWrapper(stream, encoding = 'utf-8', newline = '')
+    return zstd.open(path, mode, encoding = 'utf-8', newline = '')
+
+
+def open_segment(path, mode, compression):
+    """
+    Opens a segment file in text ``mode`` with the given ``compression``.
+    """
+    if compression == 'gzip':
+        return gzip.open(path, mode, encoding = 'utf-8', newline = '')
+    if compression == 'zstd':
+        return _open_zstd(path, mode)
+    return open(path, mode, encoding = 'utf-8', newline = '')
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (bytes, memoryview)):
+        return base64.b64encode(value).decode('ascii')
+    return value
+
+
+class SegmentWriter(object):
+    """
+    Writes rows to numbered segment files, starting a new file every
+    ``segment_size`` rows, and keeps the statistics of every segment.
+    """
+
+    def __init__(self, directory, prefix, columns, format = 'jsonl', compression = 'gzip',
+                 segment_size = 100000):
+        if format not in FORMATS:
+            raise ValueError("format must be one of %s, not %r"%(', '.join(FORMATS), format))
+        if compression not in COMPRESSIONS:
+            raise ValueError("compression must be one of gzip, zstd or None, not %r"%compression)
+        self.directory = directory
+        self.prefix = prefix
+        self.columns = columns
+        self.format = format
+        self.compression = compression
+        self.segment_size = segment_size
+        self.segments = []
+        self._file = None
+        self._csv = None
+        self._id_index = columns.index('action_id')
+        self._date_index = columns.index('action_date')
+
+    def _start_segment(self):
+        name = '%s-%05d.%s%s'%(self.prefix, len(self.segments) + 1, self.format,
+                               EXTENSIONS[self.compression])
+        #'x' fails instead of overwriting the files of another export
+        self._file = open_segment(os.path.join(self.directory, name), 'xt', self.compression)
+        if self.format == 'csv':
+            self._csv = csv.writer(self._file)
+            self._csv.writerow(self.columns)
+        self.segments.append({
+            'file' : name,
+            'rows' : 0,
+            'min_action_id' : None,
+            'max_action_id' : None,
+            'min_action_date' : None,
+            'max_action_date' : None,
+        })
+
+    def write(self, row):
+        if self._file is None:
+            self._start_segment()
+        if self.format == 'csv':
+            self._csv.writerow([_csv_value(value) for value in row])
+        else:
+            self._file.write(json.dumps(dict(zip(self.columns, row)), cls = ArchiveJSONEncoder))
+            self._file.write('\n')
+        segment = self.segments[-1]
+        action_id, action_date = row[self._id_index], row[self._date_index]
+        if segment['rows'] == 0:
+            segment['min_action_id'] = action_id
+            segment['min_action_date'] = segment['max_action_date'] = action_date
+        segment['max_action_id'] = action_id
+        segment['min_action_date'] = min(segment['min_action_date'], action_date)
+        segment['max_action_date'] = max(segment['max_action_date'], action_date)
+        segment['rows'] += 1
+        if segment['rows'] >= self.segment_size:
+            self.close()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._csv = None
+            segment = self.segments[-1]
+            segment['sha256'] = file_checksum(os.path.join(self.directory, segment['file']))
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def iter_rows(queryset, columns, chunk_size = 2000):
+    """
+    Yields the ``columns`` of the entries of ``queryset`` in ``action_id``
+    order, fetching one keyset page of ``chunk_size`` rows at a time.
+    """
+    id_index = columns.index('action_id')
+    queryset = queryset.order_by('action_id').values_list(*columns)
+    last = None
+    while True:
+        page = queryset if last is None else queryset.filter(action_id__gt = last)
+        count = 0
+        for row in page[:chunk_size].iterator(chunk_size = chunk_size):
+            count += 1
+            last = row[id_index]
+            yield row
+        if count < chunk_size:
+            return
+
+
+def get_export_name(model, exported_at):
+    return '%s-%s'%(model._meta.db_table, exported_at.strftime('%Y%m%dT%H%M%S%fZ'))
+
+
+def get_manifest_path(directory, name):
+    return os.path.join(directory, '%s.manifest.json'%name)
+
+
+def get_manifest_paths(directory, model):
+    """
+    Returns the paths of the manifests of the exports of the log entry
+    ``model`` in ``directory``, oldest first.
+    """
+    prefix = '%s-'%model._meta.db_table
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if name.startswith(prefix) and name.endswith('.manifest.json')]
+
+
+def export(model, directory, before = None, format = 'jsonl', compression = 'gzip',
+           segment_size = 100000, chunk_size = 2000, using = DEFAULT_DB_ALIAS):
+    """
+    Exports the entries of the log entry ``model`` written before the
+    datetime ``before`` (all of them if ``None``) to segment files in
+    ``directory`` and writes the manifest. Returns the manifest.
+    """
+    columns = [field.attname for field in model._meta.concrete_fields]
+    exported_at = datetime.datetime.now(datetime.timezone.utc)
+    name = get_export_name(model, exported_at)
+    writer = SegmentWriter(directory, name, columns, format, compression, segment_size)
+    queryset = model._base_manager.using(using).all()
+    if before is not None:
+        queryset = queryset.filter(action_date__lt = before)
+    try:
+        for row in iter_rows(queryset, columns, chunk_size):
+            writer.write(row)
+    finally:
+        writer.close()
+    segments = writer.segments
+    manifest = {
+        'name' : name,
+        'model' : model._meta.label,
+        'table' : model._meta.db_table,
+        'format' : format,
+        'compression' : compression,
+        'columns' : columns,
+        'before' : before,
+        'exported_at' : exported_at,
+        'rows' : sum(segment['rows'] for segment in segments),
+        'min_action_id' : segments[0]['min_action_id'] if segments else None,
+        'max_action_id' : segments[-1]['max_action_id'] if segments else None,
+        'min_action_date' : min(segment['min_action_date'] for segment in segments) if segments else None,
+        'max_action_date' : max(segment['max_action_date'] for segment in segments) if segments else None,
+        'segments' : segments,
+    }
+    with open(get_manifest_path(directory, name), 'x') as f:
+        json.dump(manifest, f, cls = ArchiveJSONEncoder, indent = 2)
+    return json.loads(json.dumps(manifest, cls = ArchiveJSONEncoder))
+
+
+def load_manifest(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def verify(directory, manifest):
+    """
+    Checks the checksums and row counts of the segment files listed in
+    ``manifest``. Raises ``ArchiveError`` if they don't match.
+    """
+    for segment in manifest['segments']:
+        path = os.path.join(directory, segment['file'])
+        if not os.path.exists(path):
+            raise ArchiveError("%s is missing"%segment['file'])
+        if file_checksum(path) != segment['sha256']:
+            raise ArchiveError("%s doesn't match its checksum"%segment['file'])
+        with open_segment(path, 'rt', manifest['compression']) as f:
+            if manifest['format'] == 'csv':
+                #values can span lines
+                rows = sum(1 for row in csv.reader(f)) - 1
+            else:
+                rows = sum(1 for line in f)
+        if rows != segment['rows']:
+            raise ArchiveError("%s has %s rows instead of %s"%(segment['file'], rows, segment['rows']))
+
+
+def get_exported_queryset(model, manifest, using = DEFAULT_DB_ALIAS):
+    queryset = model._base_manager.using(using).filter(action_id__gte = manifest['min_action_id'],
+                                                        action_id__lte = manifest['max_action_id'])
+    if manifest['before'] is not None:
+        queryset = queryset.filter(action_date__lt = manifest['before'])
+    return queryset
+
+
+def delete_exported(model, directory, manifest, chunk_size = 1000, sleep = 0, using = DEFAULT_DB_ALIAS):
+    """
+    Verifies the export described by ``manifest`` and deletes the exported
+    entries in chunks. Returns the number of deleted entries.
+    """
+    if not manifest['rows']:
+        return 0
+    verify(directory, manifest)
+    queryset = get_exported_queryset(model, manifest, using)
+    count = queryset.count()
+    if count != manifest['rows']:
+        raise ArchiveError("%s entries match the exported range but %s were exported"%(count, manifest['rows']))
+    return sum(deleted for deleted, last in retention.delete_chunks(queryset, chunk_size, sleep, using))
@@ -0,0 +1,141 @@
+"""
+Transaction scoped buffering of audit log entries.
+
+Inside ``buffered_atomic`` the log entries of tracked saves and deletes are
+collected instead of being inserted one by one, and are written with a
+single ``bulk_create`` per log entry model right before the block commits.
+Entries recorded inside a savepoint that is rolled back are dropped.
+
+With ``coalesce = True`` only one entry per object is written, holding its
+final state.
+"""
+
+from contextlib import ContextDecorator
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from audit_log import context
+
+
+class LogEntryBuffer(object):
+    """
+    Collects unsaved log entries for one database connection.
+
+    Entries are grouped by the savepoints that were active when they were
+    recorded. Every group registers a no-op ``on_commit`` callback; Django
+    discards the callbacks registered inside a savepoint when it is rolled
+    back, so a group whose marker is gone at flush time is dropped.
+    """
+
+    def __init__(self, connection, coalesce = False):
+        self.connection = connection
+        self.coalesce = coalesce
+        self.depth = 0
+        self.groups = []
+        #AuditLog of each log entry model, used to coalesce its entries
+        self.logs = {}
+        self._savepoint_ids = None
+
+    def _current_group(self):
+        savepoint_ids = tuple(self.connection.savepoint_ids)
+        if not self.groups or savepoint_ids != self._savepoint_ids:
+            marker = lambda: None
+            transaction.on_commit(marker, using = self.connection.alias)
+            self.groups.append((marker, {}))
+            self._savepoint_ids = savepoint_ids
+        return self.groups[-1][1]
+
+    def add(self, entry, audit_log = None):
+        #bulk_create doesn't send pre_save so the entry is stamped here
+        context.stamp(entry.__class__, entry)
+        if audit_log is not None:
+            self.logs[entry.__class__] = audit_log
+        self._current_group().setdefault(entry.__class__, []).append(entry)
+
+    def get_entries(self):
+        """
+        Returns a dictionary mapping log entry models to the entries that
+        survived savepoint rollbacks, in the order they were recorded.
+        """
+        alive = set(id(callback[1]) for callback in self.connection.run_on_commit)
+        result = {}
+        for marker, entries in self.groups:
+            if id(marker) in alive:
+                for model, model_entries in entries.items():
+                    result.setdefault(model, []).extend(model_entries)
+        return result
+
+    def flush(self):
+        for model, entries in self.get_entries().items():
+            audit_log = self.logs.get(model)
+            if audit_log is None:
+                model._default_manager.bulk_create(entries)
+                continue
+            if self.coalesce:
+                entries = audit_log.coalesce_entries(entries)
+            audit_log.save_entries(entries, self.connection.alias)
+        self.groups = []
+        self._savepoint_ids = None
+
+
+def get_buffer(using = None):
+    """
+    Returns the ``LogEntryBuffer`` active on the connection for ``using``
+    or ``None`` if no buffered block is open.
+    """
+    connection = transaction.get_connection(using)
+    return getattr(connection, 'audit_log_buffer', None)
+
+
+class BufferedAtomic(ContextDecorator):
+    """
+    Works like ``transaction.atomic`` and buffers the audit log entries
+    written inside the block. The outermost buffered block flushes them
+    just before it exits.
+    """
+
+    def __init__(self, using, savepoint, durable, coalesce = False):
+        self.using = using
+        self.coalesce = coalesce
+        self.atomic = transaction.Atomic(using, savepoint, durable)
+
+    def __enter__(self):
+        self.atomic.__enter__()
+        connection = transaction.get_connection(self.using)
+        if getattr(connection, 'audit_log_buffer', None) is None:
+            connection.audit_log_buffer = LogEntryBuffer(connection, self.coalesce)
+        connection.audit_log_buffer.depth += 1
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        connection = transaction.get_connection(self.using)
+        buffer = connection.audit_log_buffer
+        buffer.depth -= 1
+        if buffer.depth == 0:
+            connection.audit_log_buffer = None
+            if exc_type is None and not connection.needs_rollback:
+                try:
+                    buffer.flush()
+                except Exception as e:
+                    self.atomic.__exit__(type(e), e, e.__traceback__)
+                    raise
+        return self.atomic.__exit__(exc_type, exc_value, traceback)
+
+
+def buffered_atomic(using = None, savepoint = True, durable = False, coalesce = False):
+    """
+    Opens an atomic block in which audit log entries are buffered and
+    written with one ``bulk_create`` per log entry model before commit::
+
+        with buffered_atomic():
+            for product in products:
+                product.save()
+
+    With ``coalesce = True`` the entries of an object saved several times
+    are merged into one entry holding its final state. Nested blocks use
+    the buffer of the outermost one, which decides whether to coalesce.
+
+    Can be used as a decorator as well.
+    """
+    if callable(using):
+        return BufferedAtomic(DEFAULT_DB_ALIAS, savepoint, durable, coalesce)(using)
+    return BufferedAtomic(using, savepoint, durable, coalesce)
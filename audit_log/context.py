@@ -0,0 +1,62 @@
+"""
+Request context used to stamp the acting user and session key on the
+model instances saved while handling a request.
+
+The context lives in a ``contextvars.ContextVar`` so every thread and every
+asyncio task sees its own value, without locks and without touching the
+signal receivers list.
+"""
+
+import contextvars
+from collections import namedtuple
+
+from audit_log import registration
+
+
+AuditContext = namedtuple('AuditContext', ('user', 'session'))
+
+_current = contextvars.ContextVar('audit_log_context', default=None)
+
+
+def get_context():
+    """
+    Returns the ``AuditContext`` of the current request or ``None``
+    if no request is being tracked.
+    """
+    return _current.get()
+
+
+def set_context(user, session):
+    """
+    Makes ``user`` and ``session`` the acting user and session key for the
+    current thread or task. Returns a token that can be passed to
+    ``reset_context``.
+    """
+    return _current.set(AuditContext(user, session))
+
+
+def reset_context(token):
+    """
+    Restores the context that was active before the matching ``set_context``.
+    """
+    _current.reset(token)
+
+
+def clear_context():
+    """
+    Stops tracking the current request.
+    """
+    _current.set(None)
+
+
+def stamp(sender, instance):
+    """
+    Sets the stamp fields of ``instance`` from the current context. Called by
+    the ``pre_save`` receiver and for instances that are written without
+    sending ``pre_save``, like bulk inserts.
+    """
+    current = _current.get()
+    if current is not None:
+        plan = registration.get_plan(sender)
+        if plan is not None:
+            plan.stamp(instance, current.user, current.session)
@@ -0,0 +1,63 @@
+import datetime
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from audit_log import archive, partitioning, registration, settings as local_settings
+
+
+class Command(BaseCommand):
+    help = ("Exports audit log entries to compressed JSON lines or CSV segment files with a "
+            "manifest, and optionally deletes the exported entries.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs = '+', metavar = 'app_label.ModelName',
+                            help = "Models whose audit log is exported.")
+        parser.add_argument('--output', required = True,
+                            help = "Directory the segment files and manifests are written to.")
+        parser.add_argument('--days', type = int, default = None,
+                            help = "Only export entries older than this many days.")
+        parser.add_argument('--format', choices = archive.FORMATS, default = 'jsonl')
+        parser.add_argument('--compression', choices = ('gzip', 'zstd', 'none'), default = 'gzip')
+        parser.add_argument('--segment-size', type = int, default = 100000,
+                            help = "Maximum number of entries per segment file.")
+        parser.add_argument('--chunk-size', type = int, default = 2000,
+                            help = "Number of entries fetched per query.")
+        parser.add_argument('--delete', action = 'store_true',
+                            help = "Delete the exported entries after checking the files against the manifest.")
+        parser.add_argument('--sleep', type = float, default = 0.1,
+                            help = "Seconds to wait between deleted chunks.")
+        parser.add_argument('--database', default = local_settings.DATABASE or DEFAULT_DB_ALIAS,
+                            help = "Database to export from.")
+
+    def handle(self, *args, **options):
+        by_label = dict((audit_log.model._meta.label_lower, audit_log)
+                        for audit_log in registration.get_audit_logs())
+        try:
+            audit_logs = [by_label[label.lower()] for label in options['models']]
+        except KeyError as e:
+            raise CommandError("%s has no audit log"%e.args[0])
+        for audit_log in audit_logs:
+            if not audit_log.storage.model_table:
+                raise CommandError("%s keeps its audit log outside the database"%audit_log.model._meta.label)
+        before = None
+        if options['days'] is not None:
+            before = partitioning.get_now() - datetime.timedelta(days = options['days'])
+        compression = None if options['compression'] == 'none' else options['compression']
+        directory = options['output']
+        os.makedirs(directory, exist_ok = True)
+        using = options['database']
+        for audit_log in audit_logs:
+            model = audit_log.log_entry_model
+            manifest = archive.export(model, directory, before, options['format'], compression,
+                                      options['segment_size'], options['chunk_size'], using)
+            self.stdout.write("%s: exported %s entries to %s segments"%(
+                model._meta.label, manifest['rows'], len(manifest['segments'])))
+            if options['delete']:
+                try:
+                    deleted = archive.delete_exported(model, directory, manifest,
+                                                      sleep = options['sleep'], using = using)
+                except archive.ArchiveError as e:
+                    raise CommandError("%s: not deleting, %s"%(model._meta.label, e))
+                self.stdout.write("%s: deleted %s exported entries"%(model._meta.label, deleted))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, router
+
+from audit_log import partitioning, registration, settings as local_settings
+
+
+class Command(BaseCommand):
+    help = ("Creates upcoming partitions of the partitioned audit logs, or rotates their "
+            "tables on SQLite, and drops the expired ones.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type = int, default = 3,
+                            help = "Number of future periods to create partitions for.")
+        parser.add_argument('--keep', type = int, default = None,
+                            help = "Number of past periods to keep. Older partitions are dropped. "
+                                   "Nothing is dropped if omitted.")
+        parser.add_argument('--database', default = local_settings.DATABASE or DEFAULT_DB_ALIAS,
+                            help = "Database to work on.")
+
+    def handle(self, *args, **options):
+        using = options['database']
+        for audit_log in registration.get_audit_logs():
+            if audit_log.partition_by is None:
+                continue
+            model = audit_log.log_entry_model
+            if not router.allow_migrate_model(using, model):
+                continue
+            period = audit_log.partition_by
+            for name in partitioning.create_partitions(model, period, options['ahead'], using):
+                self.stdout.write("Created %s"%name)
+            if options['keep'] is not None:
+                for name in partitioning.drop_partitions(model, period, options['keep'], using):
+                    self.stdout.write("Dropped %s"%name)
@@ -0,0 +1,65 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, router
+
+from audit_log import partitioning, registration, retention, settings as local_settings
+
+
+class Command(BaseCommand):
+    help = ("Deletes audit log entries older than the retention of their model, in small "
+            "chunks ordered by action id. Safe to interrupt and run again.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type = int, default = None,
+                            help = "Retention in days for the audit logs that don't set one.")
+        parser.add_argument('--model', action = 'append', dest = 'models', default = [],
+                            help = "Only prune the audit log of this model (app_label.ModelName). "
+                                   "Can be given several times.")
+        parser.add_argument('--chunk-size', type = int, default = 1000,
+                            help = "Number of entries deleted per statement.")
+        parser.add_argument('--sleep', type = float, default = 0.1,
+                            help = "Seconds to wait between chunks.")
+        parser.add_argument('--dry-run', action = 'store_true',
+                            help = "Only count the entries that would be deleted.")
+        parser.add_argument('--database', default = local_settings.DATABASE or DEFAULT_DB_ALIAS,
+                            help = "Database to prune.")
+
+    def get_audit_logs(self, labels):
+        audit_logs = registration.get_audit_logs()
+        if not labels:
+            return audit_logs
+        by_label = dict((audit_log.model._meta.label_lower, audit_log) for audit_log in audit_logs)
+        try:
+            return [by_label[label.lower()] for label in labels]
+        except KeyError as e:
+            raise CommandError("%s has no audit log"%e.args[0])
+
+    def handle(self, *args, **options):
+        using = options['database']
+        now = partitioning.get_now()
+        for audit_log in self.get_audit_logs(options['models']):
+            model = audit_log.log_entry_model
+            keep = audit_log.retention
+            if keep is None and options['days'] is not None:
+                keep = datetime.timedelta(days = options['days'])
+            if keep is None or not router.allow_migrate_model(using, model):
+                continue
+            before = now - keep
+            label = model._meta.label
+            if options['dry_run']:
+                count = model._base_manager.using(using).filter(action_date__lt = before).count()
+                self.stdout.write("%s: %s entries older than %s"%(label, count, before))
+                continue
+            queryset = model._base_manager.filter(action_date__lt = before)
+            total = 0
+            started = time.monotonic()
+            for deleted, last in retention.delete_chunks(queryset, options['chunk_size'],
+                                                         options['sleep'], using):
+                total += deleted
+                if options['verbosity'] > 1:
+                    self.stdout.write("%s: deleted %s entries up to action id %s"%(label, total, last))
+            elapsed = time.monotonic() - started
+            self.stdout.write("%s: deleted %s entries older than %s in %.1fs (%.0f rows/s)"%(
+                label, total, before, elapsed, total / elapsed if elapsed else 0))
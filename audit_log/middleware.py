@@ -1,12 +1,9 @@
-from functools import partial
 from django.db.models import signals
 
 # Django 4.0+ uses modern middleware patterns
 from django.utils.deprecation import MiddlewareMixin
 
-from audit_log import registration, settings
-from audit_log.models import fields
-from audit_log.models.managers import AuditLogManager
+from audit_log import context, registration, settings
 
 # ASGI support
 try:
@@ -16,143 +13,29 @@ except ImportError:
     ASGI_AVAILABLE = False
 
 
-def _disable_audit_log_managers(instance):
-    for attr in dir(instance):
-        try:
-            if isinstance(getattr(instance, attr), AuditLogManager):
-                getattr(instance, attr).disable_tracking()
-        except AttributeError:
-            pass
-
-
-def _enable_audit_log_managers(instance):
-    for attr in dir(instance):
-        try:
-            if isinstance(getattr(instance, attr), AuditLogManager):
-                getattr(instance, attr).enable_tracking()
-        except AttributeError:
-            pass
-
-
 def _update_pre_save_info_common(user, session, sender, instance, **kwargs):
-    """Common logic for updating pre-save info (user and session fields)."""
-    registry = registration.FieldRegistry(fields.LastUserField)
-    if sender in registry:
-        for field in registry.get_fields(sender):
-            setattr(instance, field.name, user)
-
-    registry = registration.FieldRegistry(fields.LastSessionKeyField)
-    if sender in registry:
-        for field in registry.get_fields(sender):
-            setattr(instance, field.name, session)
-
-
-async def _perform_post_save_update_async(instance, field_name, value):
-    """Async helper to update an instance field and save it with audit managers disabled."""
-    setattr(instance, field_name, value)
-    _disable_audit_log_managers(instance)
-    await sync_to_async(instance.save, thread_sensitive=True)()
-    _enable_audit_log_managers(instance)
-
-
-def _perform_post_save_update(instance, field_name, value):
-    """Sync helper to update an instance field and save it with audit managers disabled."""
-    setattr(instance, field_name, value)
-    _disable_audit_log_managers(instance)
-    instance.save()
-    _enable_audit_log_managers(instance)
-
-
-def _perform_post_save_update_unified(instance, field_name, value, is_async=False):
     """
-    Unified helper to update an instance field and save it with audit managers disabled.
-    
-    Args:
-        instance: The model instance to update
-        field_name: The field name to set
-        value: The value to set
-        is_async: If True, uses async save method; if False, uses sync save method
-    """
-    if is_async:
-        return _perform_post_save_update_async(instance, field_name, value)
-    else:
-        return _perform_post_save_update(instance, field_name, value)
-
+    Common logic for updating pre-save info (user and session fields).
 
-def _make_async_signal_handler(sync_handler):
+    Creating user and session fields are filled in as well when the instance
+    is about to be inserted, so a create is a single INSERT.
     """
-    Wraps a synchronous signal handler to run in a thread pool for ASGI contexts.
-    
-    Django signals are synchronous, so they will call handlers synchronously even in
-    ASGI contexts. This wrapper ensures the handler runs in a thread pool to avoid
-    blocking the event loop.
-    """
-    def wrapper(*args, **kwargs):
-        # Import here to avoid issues if not in async context
-        import asyncio
-        try:
-            loop = asyncio.get_running_loop()
-            # We're in an async context, schedule the sync handler in thread pool
-            asyncio.create_task(
-                sync_to_async(sync_handler, thread_sensitive=True)(*args, **kwargs)
-            )
-        except RuntimeError:
-            # No running event loop, just call synchronously
-            sync_handler(*args, **kwargs)
-    return wrapper
-
-
-async def _update_post_save_info_common_async(user, session, sender, instance, created, **kwargs):
-    """Async common logic for updating post-save info (creating user and session fields)."""
-    if created:
-        registry = registration.FieldRegistry(fields.CreatingUserField)
-        if sender in registry:
-            for field in registry.get_fields(sender):
-                await _perform_post_save_update_async(instance, field.name, user)
-
-        registry = registration.FieldRegistry(fields.CreatingSessionKeyField)
-        if sender in registry:
-            for field in registry.get_fields(sender):
-                await _perform_post_save_update_async(instance, field.name, session)
-
-
-def _update_post_save_info_common(user, session, sender, instance, created, **kwargs):
-    """Common logic for updating post-save info (creating user and session fields)."""
-    if created:
-        registry = registration.FieldRegistry(fields.CreatingUserField)
-        if sender in registry:
-            for field in registry.get_fields(sender):
-                _perform_post_save_update(instance, field.name, user)
-
-        registry = registration.FieldRegistry(fields.CreatingSessionKeyField)
-        if sender in registry:
-            for field in registry.get_fields(sender):
-                _perform_post_save_update(instance, field.name, session)
+    plan = registration.get_plan(sender)
+    if plan is not None:
+        plan.stamp(instance, user, session)
 
 
-def _update_post_save_info_unified(user, session, sender, instance, created, is_async=False, **kwargs):
+def _update_pre_save_info(sender, instance, **kwargs):
     """
-    Unified logic for updating post-save info (creating user and session fields).
-    
-    Args:
-        user: The user to set in creating user fields
-        session: The session key to set in creating session fields
-        sender: The model class that sent the signal
-        instance: The model instance being saved
-        created: Whether this is a new instance
-        is_async: If True, uses async save methods; if False, uses sync save methods
-        **kwargs: Additional signal arguments
+    Permanent ``pre_save`` receiver that stamps the user and session of the
+    request being tracked in the current context, if any.
     """
-    if created:
-        registry = registration.FieldRegistry(fields.CreatingUserField)
-        if sender in registry:
-            for field in registry.get_fields(sender):
-                _perform_post_save_update_unified(instance, field.name, user, is_async=is_async)
+    context.stamp(sender, instance)
+
 
-        registry = registration.FieldRegistry(fields.CreatingSessionKeyField)
-        if sender in registry:
-            for field in registry.get_fields(sender):
-                _perform_post_save_update_unified(instance, field.name, session, is_async=is_async)
+# The receiver is connected once; the middleware only sets the context.
+signals.pre_save.connect(_update_pre_save_info,
+                         dispatch_uid='audit_log.middleware.update_pre_save_info')
 
 
 def _get_user_jwt(request):
@@ -197,29 +80,14 @@ class UserLoggingMiddleware(MiddlewareMixin):
         else:
             user = None
         session = request.session.session_key
-        update_pre_save_info = partial(_update_pre_save_info_common, user,
-                                       session)
-        update_post_save_info = partial(_update_post_save_info_common, user,
-                                        session)
-        signals.pre_save.connect(update_pre_save_info,
-                                 dispatch_uid=(self.__class__, request,),
-                                 weak=False)
-        signals.post_save.connect(update_post_save_info,
-                                  dispatch_uid=(self.__class__, request,),
-                                  weak=False)
+        context.set_context(user, session)
 
     def process_response(self, request, response):
-        if settings.DISABLE_AUDIT_LOG:
-            return
-        signals.pre_save.disconnect(dispatch_uid=(self.__class__, request,))
-        signals.post_save.disconnect(dispatch_uid=(self.__class__, request,))
+        context.clear_context()
         return response
 
     def process_exception(self, request, exception):
-        if settings.DISABLE_AUDIT_LOG:
-            return None
-        signals.pre_save.disconnect(dispatch_uid=(self.__class__, request,))
-        signals.post_save.disconnect(dispatch_uid=(self.__class__, request,))
+        context.clear_context()
         return None
 
 
@@ -269,16 +137,12 @@ if ASGI_AVAILABLE:
             request = ASGIRequest(scope, receive)
             
             # Process the request with our audit logging logic
-            await self._process_request(request)
-            
-            # Create a response wrapper to handle cleanup
-            response_wrapper = ASGIResponseWrapper(send, self._cleanup_signals, request)
+            token = await self._process_request(request)
             
             try:
-                await self.app(scope, receive, response_wrapper.send)
-            except Exception as e:
-                await self._cleanup_signals(request)
-                raise
+                await self.app(scope, receive, send)
+            finally:
+                self._cleanup_context(token)
         
         async def _process_request(self, request):
             if settings.DISABLE_AUDIT_LOG:
@@ -302,49 +166,13 @@ if ASGI_AVAILABLE:
             else:
                 session = None
             
-            # Django signals are synchronous and can't directly call async handlers.
-            # We wrap the handlers to run in a thread pool when called from async context.
-            update_pre_save_info = partial(_update_pre_save_info_common, user, session)
-            update_post_save_info = partial(_update_post_save_info_common_async, user, session)
-            
-            # Wrap handlers to execute in thread pool for ASGI
-            async_pre_save_handler = _make_async_signal_handler(update_pre_save_info)
-            async_post_save_handler = _make_async_signal_handler(update_post_save_info)
-            
-            signals.pre_save.connect(async_pre_save_handler,
-                                   dispatch_uid=(self.__class__, request,),
-                                   weak=False)
-            signals.post_save.connect(async_post_save_handler,
-                                    dispatch_uid=(self.__class__, request,),
-                                    weak=False)
-        
-        async def _cleanup_signals(self, request):
-            if settings.DISABLE_AUDIT_LOG:
-                return
-            signals.pre_save.disconnect(dispatch_uid=(self.__class__, request,))
-            signals.post_save.disconnect(dispatch_uid=(self.__class__, request,))
+            # Saves run in sync_to_async threads, which copy the current
+            # context, so the permanent signal receivers see these values.
+            return context.set_context(user, session)
         
-
-
-    class ASGIResponseWrapper:
-        """
-        Wrapper for ASGI send callable to handle response cleanup.
-        """
-        
-        def __init__(self, send, cleanup_func, request):
-            self._wrapped_send = send
-            self.cleanup_func = cleanup_func
-            self.request = request
-            self.started = False
-        
-        async def send(self, message):
-            if not self.started and message["type"] == "http.response.start":
-                self.started = True
-            elif self.started and message["type"] == "http.response.body":
-                # Response is complete, cleanup signals
-                await self.cleanup_func(self.request)
-            
-            await self._wrapped_send(message)
+        def _cleanup_context(self, token):
+            if token is not None:
+                context.reset_context(token)
 
 
     class ASGIJWTAuthMiddleware:
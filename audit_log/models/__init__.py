@@ -1,5 +1,10 @@
+from django.db import models
 from django.db.models import Model
+from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
+
+from audit_log import settings as local_settings
+from audit_log.archive import ArchiveJSONEncoder
 from audit_log.models.fields import CreatingUserField, CreatingSessionKeyField, \
     LastUserField, LastSessionKeyField
 
@@ -22,3 +27,45 @@ class AuthStampedModel(Model):
 
     class Meta:
         abstract = True
+
+
+class AbstractLogEntry(Model):
+    """
+    An abstract base class for the single log entry table of the models
+    tracked with ``AuditLog(storage = 'unified')``. Subclass it in one of
+    your apps and point the ``AUDIT_LOG_ENTRY_MODEL`` setting at it.
+    """
+    action_id = models.BigAutoField(primary_key = True)
+    #content types and users are on another database with AUDIT_LOG_DATABASE
+    content_type = models.ForeignKey('contenttypes.ContentType', on_delete = models.PROTECT,
+                                     related_name = '+', db_constraint = local_settings.DATABASE is None)
+    #the primary key of the tracked object as a string
+    object_id = models.CharField(max_length = 255)
+    action_date = models.DateTimeField(default = now, editable = False)
+    action_user = LastUserField(related_name = '+', editable = False,
+                                db_constraint = local_settings.DATABASE is None,
+                                on_delete = models.SET_NULL if local_settings.DATABASE is None else models.DO_NOTHING)
+    action_type = models.CharField(max_length = 1, editable = False, choices = (
+        ('I', _('Created')),
+        ('U', _('Changed')),
+        ('D', _('Deleted')),
+    ))
+    #the tracked fields by attname
+    snapshot = models.JSONField(encoder = ArchiveJSONEncoder)
+
+    class Meta:
+        abstract = True
+        ordering = ('-action_date',)
+        indexes = [
+            models.Index(fields = ['content_type', 'object_id', '-action_date']),
+            models.Index(fields = ['action_user', 'action_date']),
+        ]
+
+    @property
+    def object_state(self):
+        from audit_log.storage import decode_snapshot
+        return decode_snapshot(self.content_type.model_class(), self.snapshot)
+
+    def __str__(self):
+        return '%s %s %s at %s'%(self.content_type.model, self.object_id,
+                                 self.get_action_type_display().lower(), self.action_date)
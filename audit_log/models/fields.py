@@ -9,6 +9,7 @@ class LastUserField(models.ForeignKey):
     A field that keeps the last user that saved an instance
     of a model. None will be the value for AnonymousUser.
     """
+    stamp_kind = 'last_user'
 
     def __init__(self, to=getattr(settings, 'AUTH_USER_MODEL', 'auth.User'), on_delete=models.SET_NULL, null=True, editable=False,  **kwargs):
         super(LastUserField, self).__init__(to=to, on_delete=on_delete, null=null, editable=editable, **kwargs)
@@ -17,11 +18,13 @@ class LastUserField(models.ForeignKey):
         super(LastUserField, self).contribute_to_class(cls, name)
         registry = registration.FieldRegistry(self.__class__)
         registry.add_field(cls, self)
+        registration.plan_for(cls).add_stamp_field(self)
 
 class LastSessionKeyField(models.CharField):
     """
     A field that keeps a reference to the last session key that was used to access the model.
     """
+    stamp_kind = 'last_session'
 
     def __init__(self, max_length =40, null=True, editable=False,  **kwargs):
         super(LastSessionKeyField, self).__init__(max_length=40, null=null, editable=editable, **kwargs)
@@ -30,24 +33,25 @@ class LastSessionKeyField(models.CharField):
         super(LastSessionKeyField, self).contribute_to_class(cls, name)
         registry = registration.FieldRegistry(self.__class__)
         registry.add_field(cls, self)
+        registration.plan_for(cls).add_stamp_field(self)
 
 class CreatingUserField(LastUserField):
     """
     A field that keeps track of the user that created a model instance.
     This will only be set once upon an INSERT in the database.
     """
-    #dont actually need to do anything, everything is handled by the parent class
-    #the different logic goes in the middleware
-    pass
+    #everything else is handled by the parent class
+    #the different logic goes in the audit plan
+    stamp_kind = 'creating_user'
 
 class CreatingSessionKeyField(LastSessionKeyField):
     """
     A field that keeps track of the last session key with which a model instance was created.
     This will only be set once upon an INSERT in the database.
     """
-    #dont actually need to do anything, everything is handled by the parent class
-    #the different logic goes in the middleware
-    pass
+    #everything else is handled by the parent class
+    #the different logic goes in the audit plan
+    stamp_kind = 'creating_session'
 
 
 # Note: South migrations support removed in Django 4.0+ as Django has built-in migrations
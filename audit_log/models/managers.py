@@ -1,15 +1,27 @@
 from __future__ import unicode_literals
 
+import contextvars
 import copy
 import datetime
-from django.db import models
+import itertools
+import operator
+import threading
+from collections import namedtuple
+from functools import partial, reduce
+import django
+from django.db import NotSupportedError, connections, models, transaction
+from django.db.backends.utils import names_digest
+from django.db.models.functions import Lag, RowNumber
+from django.db.models.lookups import Exact, IsNull
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
+from django.core import checks
 
 # Note: curry was removed in Django 4.0, but it's not used in this code anyway
 
 from audit_log.models.fields import LastUserField
-from audit_log import settings as local_settings
+from audit_log.storage import ModelStorage, UnifiedStorage, pack_snapshot, unpack_snapshot
+from audit_log import buffering, context, partitioning, registration, triggers, writer, settings as local_settings
 
 
 try:
@@ -20,24 +32,123 @@ except ImportError:
     datetime_now = datetime.datetime.now
 
 
+#marks field values that were not loaded from the database
+MISSING = object()
+
+#primary keys per AuditLog of the rows a queryset delete already logged
+_bulk_deleted = contextvars.ContextVar('audit_log_bulk_deleted', default = None)
+
+
+def get_changed_bit(bit):
+    #the bit is a literal, not a parameter, so the expression matches its index
+    return models.F('changed_fields').bitand(
+        models.expressions.RawSQL('%d'%bit, (), output_field = models.BigIntegerField()))
+
+
+#start of the help text of changed_fields, followed by the attnames in bit order
+BIT_ORDER_PREFIX = 'Bits of the tracked fields: '
+
+
+@checks.register(checks.Tags.models)
+def check_bit_order(app_configs = None, **kwargs):
+    """
+    Checks that the bits of ``changed_fields`` still belong to the fields
+    they were given to in the migrations of the log entry models.
+    """
+    from django.db.migrations.loader import MigrationLoader
+    audit_logs = [audit_log for audit_log in registration.get_audit_logs() if audit_log._changed_fields and
+                  (app_configs is None or audit_log.model._meta.app_config in app_configs)]
+    if not audit_logs:
+        return []
+    state = MigrationLoader(None, ignore_no_migrations = True).project_state()
+    return [error for audit_log in audit_logs for error in audit_log.check_bit_order(state)]
+
+
+def first_entries(entries, key, ordering):
+    """
+    Returns the first entry of every object in ``entries`` by ``ordering``,
+    the objects told apart by the column ``key``, as a queryset of action
+    ids.
+    """
+    if connections[entries.db].features.can_distinct_on_fields:
+        return entries.order_by(key, *ordering).distinct(key).values('action_id')
+    if django.VERSION >= (4, 2):
+        #filtering on a window function needs Django 4.2
+        order_by = [models.F(name[1:]).desc() if name.startswith('-') else models.F(name).asc()
+                    for name in ordering]
+        return entries.annotate(audit_log_row_number = models.Window(
+            RowNumber(), partition_by = [models.F(key)], order_by = order_by,
+        )).filter(audit_log_row_number = 1).values('action_id')
+    first = entries.filter(**{key: models.OuterRef(key)}).order_by(*ordering).values('action_id')[:1]
+    return entries.filter(action_id = models.Subquery(first)).values('action_id')
+
+
+class CommitMarker(object):
+    """
+    ``on_commit`` callback telling whether the write it was registered for
+    was committed or rolled back. Django drops the callbacks of rolled back
+    transactions and savepoints.
+    """
+
+    committed = False
+
+    def __init__(self, using):
+        self.using = using
+        transaction.on_commit(self, using = using)
+        #rollbacks replace the callback list, an unchanged list still holds the marker
+        self.callbacks = connections[using].run_on_commit
+
+    def __call__(self):
+        self.committed = True
+
+    def is_rolled_back(self):
+        if self.committed:
+            return False
+        callbacks = connections[self.using].run_on_commit
+        if callbacks is self.callbacks:
+            return False
+        return not any(item[1] is self for item in callbacks)
+
+
 class LogEntryObjectDescriptor(object):
-    def __init__(self, model):
+    def __init__(self, model, audit_log = None):
         self.model = model
+        self.audit_log = audit_log
 
 
     def __get__(self, instance, owner):
         kwargs = dict((f.attname, getattr(instance, f.attname))
                     for f in self.model._meta.fields
                     if hasattr(instance, f.attname))
+        if self.audit_log is not None and self.audit_log.is_partial_entry(instance):
+            kwargs.update(self.audit_log.rebuild_state(instance, instance._state.db))
+        if self.audit_log is not None and self.audit_log.packed_attnames:
+            #decoded on access only
+            kwargs.update(self.audit_log.unpack_values(instance.packed_fields))
         return self.model(**kwargs)
 
 
-class AuditLogManager(models.Manager):
-    def __init__(self, model, attname, instance = None, ):
+class AuditLogQuerySet(models.QuerySet):
+    def records(self, chunk_size = 2000):
+        """
+        Streams the log entries as lightweight read-only records instead of
+        model instances. The rows are fetched with ``values_list`` in chunks
+        of ``chunk_size`` and the tracked object is only built when the
+        ``object_state`` of a record is accessed.
+        """
+        record_class = self.model.record_class
+        rows = self.values_list(*record_class._fields).iterator(chunk_size = chunk_size)
+        for row in rows:
+            yield record_class._make(row)
+
+
+class AuditLogManager(models.Manager.from_queryset(AuditLogQuerySet)):
+    def __init__(self, model, attname, instance = None, audit_log = None):
         super(AuditLogManager, self).__init__()
         self.model = model
         self.instance = instance
         self.attname = attname
+        self.audit_log = audit_log
         #set a hidden attribute on the  instance to control wether we should track changes
         if instance is not None and not hasattr(instance, '__is_%s_enabled'%attname):
             setattr(instance, '__is_%s_enabled'%attname, True)
@@ -64,7 +175,87 @@ class AuditLogManager(models.Manager):
                                     "per model instance, not on a model class")
         return getattr(self.instance, '__is_%s_enabled'%self.attname)
 
+    def skipped_writes(self):
+        """
+        Returns how many saves were not logged because no tracked field changed.
+        """
+        return self.audit_log.skipped_writes
+
+    def as_of(self, when):
+        """
+        Returns the tracked object as it was at ``when``, rebuilt from the
+        latest log entry written at or before that time, or ``None`` if the
+        object didn't exist yet or had been deleted.
+        """
+        if self.instance is None:
+            raise ValueError("as_of() works on a model instance, not on a model class")
+        return self.audit_log.state_as_of(self.instance.pk, when, self._db)
+
+    def with_changes(self):
+        """
+        Annotates every entry with ``changes``, a bitmask of the tracked
+        fields that differ from the previous entry of the same object in the
+        queryset, computed in the database. ``get_changed_attnames()``
+        turns it into field names.
+        """
+        queryset = self.get_queryset()
+        self.check_columns('with_changes')
+        return queryset.annotate(changes = self.audit_log.get_changes_expression())
+
+    def check_columns(self, method):
+        #the unified table keeps the tracked fields in a JSON snapshot
+        if not self.audit_log.storage.model_table:
+            raise NotSupportedError("%s() needs a column per field, the audit log of %s is kept by %s"%(
+                method, self.audit_log.model.__name__, self.audit_log.storage.__class__.__name__))
+
+    def get_changed_attnames(self, mask):
+        return self.audit_log.get_changed_attnames(mask)
+
+    def records(self, chunk_size = 2000):
+        storage = self.audit_log.storage if self.audit_log is not None else None
+        if storage is None or storage.model_table:
+            return super(AuditLogManager, self).records(chunk_size)
+        #read from the storage backend, newest first
+        return storage.records(self.instance.pk if self.instance is not None else None, self._db)
+
+    def changed(self, *names):
+        """
+        Returns the entries that changed any of the fields ``names``, using
+        the ``changed_fields`` column.
+        """
+        queryset = self.get_queryset()
+        self.check_columns('changed')
+        if not self.audit_log._changed_fields:
+            raise ValueError("changed() needs AuditLog(changed_fields = ...) or mode = 'delta'")
+        condition = models.Q()
+        for name in names:
+            bit = self.audit_log.get_changed_mask_for([name])
+            condition |= models.Q(Exact(get_changed_bit(bit), bit))
+        return queryset.filter(condition)
+
+    def snapshot_as_of(self, when):
+        """
+        Returns a lazy queryset of the latest log entry of every object
+        written at or before ``when``, leaving out the objects that had been
+        deleted by then. The ``object_state`` of the entries is the state of
+        the objects at that time.
+        """
+        pk_attname = self.audit_log.storage.object_key or self.audit_log.pk_attname
+        entries = self.get_queryset().filter(action_date__lte = when)
+        latest = first_entries(entries, pk_attname, ['-action_date', '-action_id'])
+        #deletes are excluded after picking the latest entries so deleted objects drop out
+        return self.get_queryset().filter(action_id__in = latest).exclude(action_type = 'D')
+
     def get_queryset(self):
+        storage = self.audit_log.storage if self.audit_log is not None else None
+        if storage is not None and not storage.model_table:
+            queryset = storage.get_queryset(self.instance.pk if self.instance is not None else None, self._db)
+            if queryset is None:
+                raise NotSupportedError("The audit log of %s is kept by %s and can't be queried, read it "
+                                        "with records() or as_of()"%(self.audit_log.model.__name__,
+                                                                     storage.__class__.__name__))
+            return queryset
+
         if self.instance is None:
             return super(AuditLogManager, self).get_queryset()
 
@@ -72,60 +263,822 @@ class AuditLogManager(models.Manager):
         return super(AuditLogManager, self).get_queryset().filter(**f)
 
 
+def disable_tracking(instance):
+    """
+    Disables tracking on ``instance`` for every ``AuditLog`` attached to its model.
+    """
+    plan = registration.get_plan(instance.__class__)
+    if plan is not None:
+        for audit_log in plan.logs:
+            getattr(instance, audit_log.manager_name).disable_tracking()
+
+
+def enable_tracking(instance):
+    """
+    Enables tracking on ``instance`` for every ``AuditLog`` attached to its model.
+    """
+    plan = registration.get_plan(instance.__class__)
+    if plan is not None:
+        for audit_log in plan.logs:
+            getattr(instance, audit_log.manager_name).enable_tracking()
+
+
 class AuditLogDescriptor(object):
-    def __init__(self, model, manager_class, attname):
+    def __init__(self, model, manager_class, attname, audit_log = None):
         self.model = model
         self.manager_class = manager_class
         self.attname = attname
+        self.audit_log = audit_log
 
     def __get__(self, instance, owner):
         if instance is None:
-            return  self.manager_class(self.model, self.attname)
-        return self.manager_class(self.model, self.attname, instance)
+            return  self.manager_class(self.model, self.attname, audit_log = self.audit_log)
+        return self.manager_class(self.model, self.attname, instance, audit_log = self.audit_log)
+
+
+class AuditedQuerySet(models.QuerySet):
+    """
+    QuerySet that logs ``bulk_create``, ``bulk_update`` and ``update()`` in
+    the ``AuditLog`` managers of its model, which don't see these operations
+    because no signals are sent for them. ``update()`` and ``delete()`` log
+    all matched rows with a single ``INSERT INTO ... SELECT``.
+    """
+
+    def get_audit_logs(self):
+        plan = registration.get_plan(self.model)
+        return plan.logs if plan is not None else ()
+
+    def bulk_create(self, objs, batch_size = None, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            context.stamp(self.model, obj)
+        if kwargs.get('ignore_conflicts') or kwargs.get('update_conflicts'):
+            with transaction.atomic(using = self.db, savepoint = False):
+                return self.bulk_create_conflicts(objs, batch_size, kwargs)
+        objs = super(AuditedQuerySet, self).bulk_create(objs, batch_size = batch_size, **kwargs)
+        #the primary keys are unknown on backends that can't return them
+        created = [obj for obj in objs if obj.pk is not None]
+        for audit_log in self.get_audit_logs():
+            audit_log.log_instances(created, 'I', self.db, batch_size)
+        return objs
+
+    def get_key_condition(self, attnames, keys):
+        if len(attnames) == 1:
+            return models.Q(**{'%s__in'%attnames[0] : [key[0] for key in keys]})
+        return reduce(operator.or_, (models.Q(**dict(zip(attnames, key))) for key in keys))
+
+    def bulk_create_conflicts(self, objs, batch_size, kwargs):
+        """
+        Runs a ``bulk_create`` that may skip or update conflicting rows and
+        logs the rows as they are in the table afterwards: ``I`` for the keys
+        that didn't exist before and ``U`` for the updated ones. Conflicts are
+        matched on ``unique_fields``, or on the primary key when ignoring
+        them, so objects without a primary key can't be logged then.
+        """
+        opts = self.model._meta
+        if kwargs.get('update_conflicts'):
+            names = kwargs.get('unique_fields') or ['pk']
+        else:
+            names = ['pk']
+        attnames = [opts.pk.attname if name == 'pk' else opts.get_field(name).attname for name in names]
+        by_key = {}
+        for obj in objs:
+            key = tuple(getattr(obj, attname) for attname in attnames)
+            if None not in key:
+                by_key[key] = obj
+        table = self.model._base_manager.db_manager(self.db)
+        existing = set()
+        if by_key:
+            existing = set(table.filter(self.get_key_condition(attnames, by_key)).values_list(*attnames))
+        objs = super(AuditedQuerySet, self).bulk_create(objs, batch_size = batch_size, **kwargs)
+        if not by_key:
+            return objs
+        rows = table.filter(self.get_key_condition(attnames, by_key)).values_list('pk', *attnames)
+        pks = dict((tuple(row[1:]), row[0]) for row in rows)
+        values = {}
+        if kwargs.get('update_conflicts'):
+            #the bits of the updated fields in changed_fields
+            for name in kwargs.get('update_fields') or ():
+                attname = opts.get_field(name).attname
+                values[attname] = models.F(attname)
+        for audit_log in self.get_audit_logs():
+            inserted, updated = [], []
+            for key, pk in pks.items():
+                if not audit_log.is_tracking_enabled(by_key[key]):
+                    continue
+                if key not in existing:
+                    inserted.append(pk)
+                elif kwargs.get('update_conflicts'):
+                    updated.append(pk)
+            if inserted:
+                audit_log.log_queryset(table.filter(pk__in = inserted), 'I')
+            if updated:
+                audit_log.log_queryset(table.filter(pk__in = updated), 'U', values)
+        return objs
+
+    def bulk_update(self, objs, fields, batch_size = None):
+        objs = list(objs)
+        plan = registration.get_plan(self.model)
+        if plan is not None and context.get_context() is not None:
+            fields = list(fields)
+            for name in plan.last_user + plan.last_session:
+                if name not in fields:
+                    fields.append(name)
+            for obj in objs:
+                context.stamp(self.model, obj)
+        #bulk_update runs its UPDATEs through update(), they are logged per instance below instead
+        plain = models.QuerySet(self.model, query = self.query.chain(), using = self._db, hints = self._hints)
+        rows = plain.bulk_update(objs, fields, batch_size = batch_size)
+        for audit_log in self.get_audit_logs():
+            audit_log.log_instances(objs, 'U', self.db, batch_size)
+        return rows
+
+    def get_update_values(self, kwargs):
+        """
+        Returns the new values of an ``update()`` as expressions keyed by
+        attname.
+        """
+        values = {}
+        for name, value in kwargs.items():
+            field = self.model._meta.get_field(name)
+            if hasattr(value, 'resolve_expression'):
+                value = models.ExpressionWrapper(value, output_field = field)
+            else:
+                if field.remote_field and hasattr(value, 'prepare_database_save'):
+                    value = value.prepare_database_save(field)
+                value = models.Value(value, output_field = field)
+            values[field.attname] = value
+        return values
+
+    def lock_rows(self):
+        """
+        Locks the rows matched by the queryset until the transaction ends,
+        so they can't change between their log entries and the write.
+        Databases without ``SELECT ... FOR UPDATE``, like SQLite, lock the
+        whole database for the first write instead.
+        """
+        connection = connections[self.db]
+        if not connection.features.has_select_for_update:
+            return
+        of = ('self',) if connection.features.has_select_for_update_of else ()
+        locked = self.order_by().select_for_update(of = of).values('pk')
+        #the locking SELECT runs as a subquery, the primary keys stay in the database
+        self.model._base_manager.db_manager(self.db).filter(pk__in = locked).count()
+
+    def update(self, **kwargs):
+        plan = registration.get_plan(self.model)
+        current = context.get_context()
+        if plan is not None and current is not None:
+            for name in plan.last_user:
+                kwargs.setdefault(name, current.user)
+            for name in plan.last_session:
+                kwargs.setdefault(name, current.session)
+        #the new state is selected before the UPDATE, when the filters still match
+        with transaction.atomic(using = self.db, savepoint = False):
+            audit_logs = [audit_log for audit_log in self.get_audit_logs() if audit_log.logs_querysets()]
+            if audit_logs:
+                self.lock_rows()
+            values = self.get_update_values(kwargs)
+            for audit_log in audit_logs:
+                audit_log.log_queryset(self, 'U', values)
+            return super(AuditedQuerySet, self).update(**kwargs)
+    update.alters_data = True
+
+    def delete(self):
+        with transaction.atomic(using = self.db, savepoint = False):
+            logged = dict(_bulk_deleted.get() or {})
+            audit_logs = [audit_log for audit_log in self.get_audit_logs() if audit_log.logs_querysets()]
+            if audit_logs:
+                self.lock_rows()
+                #post_delete skips these rows, but not the rows deleted by a cascade.
+                #Django's delete() loads the matched objects to send post_delete anyway
+                pks = frozenset(self.values_list('pk', flat = True))
+            for audit_log in audit_logs:
+                audit_log.log_queryset(self, 'D')
+                logged[audit_log] = pks
+            token = _bulk_deleted.set(logged)
+            try:
+                return super(AuditedQuerySet, self).delete()
+            finally:
+                _bulk_deleted.reset(token)
+    delete.alters_data = True
+
+
+AuditedManager = models.Manager.from_queryset(AuditedQuerySet, 'AuditedManager')
 
 
 class AuditLog(object):
 
     manager_class = AuditLogManager
 
-    def __init__(self, exclude = []):
+    MODES = ('full', 'delta')
+
+    CAPTURES = ('signals', 'triggers')
+
+    def __init__(self, exclude = [], background = False, mode = 'full', skip_unchanged = False,
+                 capture = 'signals', partition_by = None, retention = None, indexes = (),
+                 changed_fields = False, storage = None, pack = False):
+        if mode not in self.MODES:
+            raise ValueError("mode must be one of %s, not %r"%(', '.join(self.MODES), mode))
+        if capture not in self.CAPTURES:
+            raise ValueError("capture must be one of %s, not %r"%(', '.join(self.CAPTURES), capture))
+        if partition_by is not None and partition_by not in partitioning.PERIODS:
+            raise ValueError("partition_by must be one of %s, not %r"%(', '.join(partitioning.PERIODS), partition_by))
+        if capture == 'triggers' and (background or mode != 'full' or skip_unchanged or changed_fields or pack):
+            raise ValueError("AuditLog(capture = 'triggers') can not be combined with "
+                             "background, mode = 'delta', skip_unchanged, changed_fields or pack")
+        if partition_by is not None and mode != 'full':
+            #dropped or rotated partitions would take the full entries the delta entries need
+            raise ValueError("AuditLog(partition_by = ...) can not be combined with mode = 'delta'")
+        if pack and mode != 'full':
+            raise ValueError("AuditLog(pack = ...) can not be combined with mode = 'delta'")
+        if storage == 'unified':
+            storage = UnifiedStorage()
+        if storage is not None and not storage.model_table and (
+                mode != 'full' or capture != 'signals' or background or partition_by or changed_fields or pack):
+            raise ValueError("AuditLog(storage = ...) without a table can not be combined with "
+                             "mode = 'delta', capture = 'triggers', background, partition_by, "
+                             "changed_fields or pack")
+        if capture == 'triggers' and local_settings.DATABASE is not None:
+            raise ValueError("AuditLog(capture = 'triggers') writes to the database of the "
+                             "tracked table and can not be used with AUDIT_LOG_DATABASE")
         self._exclude = exclude
+        self._background = background
+        self._mode = mode
+        self._skip_unchanged = skip_unchanged
+        self._capture = capture
+        self.partition_by = partition_by
+        #how long entries are kept by the prune_audit_log command, a timedelta
+        self.retention = retention
+        self._indexes = indexes
+        #delta entries always have the changed_fields column
+        self._changed_fields = mode == 'delta' or bool(changed_fields)
+        #fields with an index on their bit
+        self._changed_indexes = () if isinstance(changed_fields, bool) else tuple(changed_fields)
+        self.storage = storage if storage is not None else ModelStorage()
+        #True for every plain field or the names of the fields kept in packed_fields
+        self._pack = pack
+        self.skipped_writes = 0
+        self._skipped_writes_lock = threading.Lock()
 
 
     def contribute_to_class(self, cls, name):
         self.manager_name = name
+        self.tracking_attname = '__is_%s_enabled'%name
+        registration.plan_for(cls).add_log(self)
         models.signals.class_prepared.connect(self.finalize, sender = cls)
 
 
+    def is_tracking_enabled(self, instance):
+        if local_settings.DISABLE_AUDIT_LOG:
+            return False
+        return getattr(instance, self.tracking_attname, True)
+
+    def get_loaded_values(self, instance):
+        """
+        Returns the tracked values of ``instance`` without loading deferred
+        fields, which are returned as ``MISSING``.
+        """
+        values = instance.__dict__
+        return tuple(values.get(attname, MISSING) for attname in self.attnames)
+
+    def remember_originals(self, instance, values = None, using = None):
+        """
+        Remembers the tracked ``values`` of ``instance`` as its originals.
+        Values written by a save on the database ``using`` only count once
+        the save commits, the previous originals are used again if it is
+        rolled back.
+        """
+        if values is None:
+            values = self.get_loaded_values(instance)
+        marker = previous = None
+        if using is not None:
+            marker = CommitMarker(using)
+            previous = instance.__dict__.get(self.originals_attname)
+            if previous is not None and (previous[1] is None or previous[1].committed):
+                previous = (previous[0], None, None)
+        instance.__dict__[self.originals_attname] = (values, marker, previous)
+
+    def get_originals(self, instance):
+        """
+        Returns the tracked values ``instance`` was loaded with or last
+        saved with in a write that wasn't rolled back, ``None`` if unknown.
+        """
+        state = instance.__dict__.get(self.originals_attname)
+        while state is not None and state[1] is not None and state[1].is_rolled_back():
+            state = state[2]
+        return state[0] if state is not None else None
+
+    def get_changed_mask(self, originals, values):
+        """
+        Returns a bitmask of the tracked fields whose values differ, bit ``i``
+        standing for ``self.attnames[i]``.
+        """
+        mask = 0
+        for i, (original, value) in enumerate(zip(originals, values)):
+            if value is not MISSING and (original is MISSING or original != value):
+                mask |= 1 << i
+        return mask
+
+    def get_changed_mask_for(self, names):
+        """
+        Returns the bitmask of the tracked fields called ``names``.
+        """
+        mask = 0
+        for name in names:
+            attname = self.model._meta.get_field(name).attname
+            if attname not in self.attnames:
+                raise ValueError("%s.%s is not tracked"%(self.model.__name__, name))
+            mask |= 1 << self.attnames.index(attname)
+        return mask
+
+    def get_changed_attnames(self, mask):
+        """
+        Returns the attnames of the tracked fields whose bits are set in ``mask``.
+        """
+        return tuple(attname for i, attname in enumerate(self.attnames) if mask & (1 << i))
+
+    def get_changes_expression(self):
+        """
+        Returns an expression for the bitmask of the tracked fields that
+        differ from the previous entry of the same object, computed with
+        ``LAG()`` window functions. The first entry of an object has every
+        bit set and deletes have none. Entries with a ``changed_fields``
+        column already store it.
+        """
+        if self._changed_fields:
+            return models.F('changed_fields')
+        if self.packed_attnames:
+            raise ValueError("Changes of packed fields need AuditLog(changed_fields = ...)")
+        if len(self.attnames) > 63:
+            raise ValueError("Changes can be computed for at most 63 fields, "
+                             "%s has %s"%(self.model.__name__, len(self.attnames)))
+        window = partial(models.Window, partition_by = [models.F(self.pk_attname)],
+                         order_by = [models.F('action_date').asc(), models.F('action_id').asc()])
+        bits = []
+        for i, attname in enumerate(self.attnames):
+            if attname == self.pk_attname:
+                continue
+            previous = window(Lag(attname))
+            #NULL safe comparison, "IS DISTINCT FROM" isn't available everywhere
+            bits.append(models.Case(
+                models.When(Exact(models.F(attname), previous), then = 0),
+                models.When(IsNull(models.F(attname), True), then = models.Case(
+                    models.When(IsNull(previous, True), then = 0),
+                    default = 1 << i)),
+                default = 1 << i,
+                output_field = models.BigIntegerField(),
+            ))
+        return models.Case(
+            models.When(action_type = 'D', then = 0),
+            models.When(IsNull(window(Lag('action_id')), True), then = self.full_mask),
+            default = reduce(operator.add, bits) if bits else 0,
+            output_field = models.BigIntegerField(),
+        )
+
+    def build_log_entry(self, instance, action_type):
+        """
+        Returns an unsaved log entry holding the current state of ``instance``.
+        """
+        if self._mode == 'delta':
+            return self.build_delta_log_entry(instance, action_type)
+        values = self.get_snapshot(instance)
+        attrs = dict(zip(self.attnames, values))
+        if self._changed_fields:
+            originals = self.get_originals(instance)
+            if action_type == 'D':
+                attrs['changed_fields'] = 0
+            elif action_type == 'I' or originals is None:
+                attrs['changed_fields'] = self.full_mask
+            else:
+                attrs['changed_fields'] = self.get_changed_mask(originals, values)
+        if (self._skip_unchanged or self._changed_fields) and action_type != 'D':
+            self.remember_originals(instance, values, instance._state.db)
+        return self.log_entry_model(action_type = action_type, **self.pack_values(attrs))
+
+    def build_delta_log_entry(self, instance, action_type):
+        """
+        Returns an unsaved log entry that only holds the fields changed since
+        ``instance`` was loaded or last logged. Inserts and deletes, and
+        updates of instances whose original values are unknown, are logged
+        in full.
+        """
+        originals = self.get_originals(instance)
+        if action_type != 'U' or originals is None:
+            values = self.get_snapshot(instance)
+            mask = self.full_mask if action_type != 'D' else 0
+            attrs = dict(zip(self.attnames, values))
+        else:
+            values = self.get_loaded_values(instance)
+            mask = self.get_changed_mask(originals, values)
+            attrs = dict((attname, value) for i, (attname, value) in enumerate(zip(self.attnames, values))
+                         if mask & (1 << i))
+            attrs[self.pk_attname] = instance.pk
+        if action_type != 'D':
+            self.remember_originals(instance, values, instance._state.db)
+        return self.log_entry_model(action_type = action_type, changed_fields = mask, **attrs)
+
+    def pack_values(self, attrs):
+        """
+        Moves the values of the packed fields in the ``attrs`` of a log
+        entry to its compressed ``packed_fields`` column.
+        """
+        if not self.packed_attnames:
+            return attrs
+        attrs['packed_fields'] = pack_snapshot(dict((attname, attrs.pop(attname))
+                                                    for attname in self.packed_attnames))
+        return attrs
+
+    def unpack_values(self, data):
+        """
+        Returns the values of the packed fields stored in ``data``, by attname.
+        """
+        if data is None:
+            return {}
+        get_field = self.model._meta.get_field
+        return dict((attname, get_field(attname).to_python(value))
+                    for attname, value in unpack_snapshot(data).items())
+
+    def is_partial_entry(self, entry):
+        return (self._mode == 'delta' and entry.action_type == 'U' and not entry.full_state and
+                entry.changed_fields != self.full_mask)
+
+    def rebuild_state(self, entry, using = None):
+        """
+        Returns a dictionary with the full tracked state of the object as of
+        the delta log ``entry``, folding in values from older entries read
+        from the database ``using``.
+        """
+        state = {}
+        missing = set()
+        for i, attname in enumerate(self.attnames):
+            if entry.changed_fields & (1 << i) or attname == self.pk_attname:
+                state[attname] = getattr(entry, attname)
+            else:
+                missing.add(attname)
+        older = self.log_entry_model._default_manager.db_manager(using).filter(
+            models.Q(action_date__lt = entry.action_date) |
+            models.Q(action_date = entry.action_date, action_id__lt = entry.action_id),
+            **{self.pk_attname: getattr(entry, self.pk_attname)}
+        ).order_by('-action_date', '-action_id').values_list(
+            'action_type', 'changed_fields', 'full_state', *self.attnames)
+        state.update(self.fold_state(older.iterator(), missing))
+        return state
+
+    def fold_state(self, rows, missing):
+        """
+        Collects the values of the ``missing`` attnames from ``rows`` of
+        ``(action_type, changed_fields, full_state, *values)``, newest first.
+        Stops reading rows at the first full entry or once nothing is
+        missing.
+        """
+        state = {}
+        missing = set(missing)
+        for row in rows:
+            action_type, mask, values = row[0], row[1], row[3:]
+            full = action_type != 'U' or row[2]
+            for i, attname in enumerate(self.attnames):
+                if attname in missing and (full or mask & (1 << i)):
+                    state[attname] = values[i]
+                    missing.discard(attname)
+            if not missing or full:
+                break
+        return state
+
+    def state_as_of(self, pk, when, using = None):
+        """
+        Returns the tracked object with primary key ``pk`` as it was at
+        ``when``, or ``None`` if it didn't exist or was deleted by then.
+        """
+        if not self.storage.model_table:
+            for record in self.storage.records(pk, using):
+                if record.action_date <= when:
+                    return record.object_state if record.action_type != 'D' else None
+            return None
+        entries = self.log_entry_model._default_manager.db_manager(using).filter(
+            action_date__lte = when, **{self.pk_attname: pk}).order_by('-action_date', '-action_id')
+        if self._mode != 'delta':
+            entry = entries.first()
+            if entry is None or entry.action_type == 'D':
+                return None
+            return entry.object_state
+        #one query for the entry and the older ones it needs, read until the state is complete
+        rows = entries.values_list('action_type', 'changed_fields', 'full_state', *self.attnames).iterator()
+        latest = next(rows, None)
+        if latest is None or latest[0] == 'D':
+            return None
+        missing = [attname for attname in self.attnames if attname != self.pk_attname]
+        state = self.fold_state(itertools.chain([latest], rows), missing)
+        state[self.pk_attname] = pk
+        return self.model(**state)
+
     def create_log_entry(self, instance, action_type):
-        manager = getattr(instance, self.manager_name)
-        attrs = {}
-        for field in instance._meta.fields:
-            if field.attname not in self._exclude:
-                attrs[field.attname] = getattr(instance, field.attname)
-        manager.create(action_type = action_type, **attrs)
+        entry = self.build_log_entry(instance, action_type)
+        buffer = buffering.get_buffer(instance._state.db)
+        if buffer is not None:
+            buffer.add(entry, self)
+        elif self._background:
+            #the writer thread has no request context
+            context.stamp(entry.__class__, entry)
+            transaction.on_commit(partial(writer.get_writer().put, entry,
+                                          self.get_log_database(instance._state.db)),
+                                  using = instance._state.db)
+        else:
+            self.save_entries([entry], instance._state.db)
+
+    def get_log_database(self, using):
+        """
+        Returns the alias log entries of changes made on ``using`` are written to.
+        """
+        return local_settings.DATABASE or using
+
+    def save_entries(self, entries, using, batch_size = None):
+        """
+        Hands ``entries``, recorded for changes made on the database
+        ``using``, to the storage backend. With ``AUDIT_LOG_DEFER_WRITES``,
+        or a backend that doesn't write in the transaction, they are stored
+        once the transaction on ``using`` commits.
+        """
+        insert = partial(self.storage.save, entries, using, batch_size)
+        if local_settings.DEFER_WRITES or not self.storage.transactional:
+            #the request context may be gone by then
+            for entry in entries:
+                context.stamp(entry.__class__, entry)
+            transaction.on_commit(insert, using = using)
+        else:
+            insert()
+
+    def log_instances(self, instances, action_type, using, batch_size = None):
+        """
+        Logs ``instances`` written by a bulk operation, inserting the log
+        entries with one ``bulk_create`` instead of one INSERT per instance.
+        """
+        if self._capture != 'signals':
+            return
+        entries = []
+        for instance in instances:
+            if not self.is_tracking_enabled(instance):
+                continue
+            if action_type == 'U' and self._skip_unchanged and self.is_unchanged(instance):
+                with self._skipped_writes_lock:
+                    self.skipped_writes += 1
+                continue
+            entries.append(self.build_log_entry(instance, action_type))
+        if not entries:
+            return
+        buffer = buffering.get_buffer(using)
+        if buffer is not None:
+            for entry in entries:
+                buffer.add(entry, self)
+            return
+        #bulk_create doesn't send pre_save and the writer thread has no request context
+        for entry in entries:
+            context.stamp(self.log_entry_model, entry)
+        if self._background:
+            put = writer.get_writer().put
+            for entry in entries:
+                transaction.on_commit(partial(put, entry, self.get_log_database(using)), using = using)
+        else:
+            self.save_entries(entries, using, batch_size)
+
+    def coalesce_entries(self, entries):
+        """
+        Merges ``entries``, given in the order they were recorded, into one
+        entry per object holding its final state. An insert followed by
+        updates stays an insert. An object inserted and deleted again is
+        not logged at all, it never existed outside the transaction, while
+        an insert reusing the primary key of a deleted object is kept apart
+        from the delete.
+        """
+        result = {}
+        for entry in entries:
+            key = getattr(entry, self.pk_attname)
+            kept = result.pop(key, [])
+            older = kept[-1] if kept else None
+            if older is None or older.action_type == 'D':
+                kept.append(entry)
+            elif older.action_type == 'I' and entry.action_type == 'D':
+                kept.pop()
+            else:
+                self.merge_entry(older, entry)
+                kept[-1] = entry
+            if kept:
+                result[key] = kept
+        return [entry for kept in result.values() for entry in kept]
+
+    def merge_entry(self, older, newer):
+        if older.action_type == 'I' and newer.action_type == 'U':
+            newer.action_type = 'I'
+        if self._changed_fields and newer.action_type != 'D':
+            if self._mode == 'delta':
+                #keep the fields only the older entry stored
+                missing = older.changed_fields & ~newer.changed_fields
+                for i, attname in enumerate(self.attnames):
+                    if missing & (1 << i):
+                        setattr(newer, attname, getattr(older, attname))
+            newer.changed_fields |= older.changed_fields
+
+    def logs_querysets(self):
+        return self._capture == 'signals' and not local_settings.DISABLE_AUDIT_LOG
+
+    def log_queryset(self, queryset, action_type, values = None):
+        """
+        Logs the rows matched by ``queryset`` with a single
+        ``INSERT INTO ... SELECT``. ``values`` maps the attnames set by an
+        update to expressions of their new value. Returns ``False`` if
+        nothing was logged because logging is off or done by triggers.
+        """
+        if not self.logs_querysets():
+            return False
+        values = values or {}
+        log_meta = self.log_entry_model._meta
+        current = context.get_context()
+        logged = dict((attname, values.get(attname, models.F(attname))) for attname in self.attnames)
+        logged['action_date'] = datetime_now()
+        logged['action_type'] = action_type
+        logged['action_user_id'] = getattr(current and current.user, 'pk', None)
+        if self._mode == 'delta':
+            logged['full_state'] = False
+        if self._mode == 'delta' or (self._changed_fields and action_type != 'U'):
+            logged['changed_fields'] = self.full_mask if action_type != 'D' else 0
+        elif self._changed_fields:
+            #the fields set by the update, whether or not their value differs
+            logged['changed_fields'] = sum(1 << i for i, attname in enumerate(self.attnames)
+                                           if attname in values)
+        annotations = {}
+        for i, (attname, value) in enumerate(logged.items()):
+            if not hasattr(value, 'resolve_expression'):
+                value = models.Value(value, output_field = log_meta.get_field(attname))
+            annotations['audit_log_%s'%i] = value
+        select = queryset.order_by().annotate(**annotations).values_list(*annotations)
+        if (not self.storage.model_table or self.packed_attnames or
+                self.get_log_database(queryset.db) != queryset.db):
+            #INSERT ... SELECT can't reach another database or storage, nor pack
+            entries = [self.log_entry_model(**self.pack_values(dict(zip(logged, row))))
+                       for row in select.iterator()]
+            if entries:
+                self.save_entries(entries, queryset.db)
+            return True
+        connection = connections[queryset.db]
+        sql, params = select.query.get_compiler(connection = connection).as_sql()
+        qn = connection.ops.quote_name
+        columns = ', '.join(qn(log_meta.get_field(attname).column) for attname in logged)
+        with connection.cursor() as cursor:
+            cursor.execute('INSERT INTO %s (%s) %s'%(qn(log_meta.db_table), columns, sql), params)
+        return True
+
+    def is_unchanged(self, instance):
+        """
+        Returns ``True`` if no tracked field of ``instance`` differs from its
+        original values. Instances with unknown originals count as changed.
+        """
+        originals = self.get_originals(instance)
+        if originals is None:
+            return False
+        return not self.get_changed_mask(originals, self.get_loaded_values(instance))
 
     def post_save(self, instance, created, **kwargs):
         #ignore if it is disabled
-        if getattr(instance, self.manager_name).is_tracking_enabled():
+        if self.is_tracking_enabled(instance):
+            if not created and self._skip_unchanged and self.is_unchanged(instance):
+                with self._skipped_writes_lock:
+                    self.skipped_writes += 1
+                return
             self.create_log_entry(instance, created and 'I' or 'U')
 
 
     def post_delete(self, instance, **kwargs):
-        #ignore if it is disabled
-        if getattr(instance, self.manager_name).is_tracking_enabled():
+        #ignore if it is disabled or already logged by a queryset delete
+        logged = _bulk_deleted.get()
+        if logged and instance.pk in logged.get(self, ()):
+            return
+        if self.is_tracking_enabled(instance):
             self.create_log_entry(instance,  'D')
 
 
     def finalize(self, sender, **kwargs):
+        self.packed_attnames = self.get_packed_attnames(sender)
         log_entry_model = self.create_log_entry_model(sender)
 
-        models.signals.post_save.connect(self.post_save, sender = sender, weak = False)
-        models.signals.post_delete.connect(self.post_delete, sender = sender, weak = False)
+        #everything the handlers need is worked out once here
+        self.model = sender
+        self.log_entry_model = log_entry_model
+        self.attnames = self.get_tracked_attnames(sender)
+        getter = operator.attrgetter(*self.attnames)
+        if len(self.attnames) == 1:
+            self.get_snapshot = lambda instance: (getter(instance),)
+        else:
+            self.get_snapshot = getter
+        self.pk_attname = sender._meta.pk.attname
+        self.full_mask = (1 << len(self.attnames)) - 1
+        self.originals_attname = '_%s_originals'%self.manager_name
+        if self._changed_fields and len(self.attnames) > 63:
+            raise ValueError("AuditLog(mode = 'delta') and AuditLog(changed_fields = ...) can track "
+                             "at most 63 fields, %s has %s"%(sender.__name__, len(self.attnames)))
+        if self._changed_fields or self._skip_unchanged:
+            self.track_originals(sender)
+        log_entry_model.record_class = self.create_record_class(sender, log_entry_model)
+        registration.register_log_entry_model(log_entry_model)
+        self.storage.bind(self)
+
+        if self._capture == 'triggers':
+            triggers.enable()
+        if self._capture == 'signals':
+            models.signals.post_save.connect(self.post_save, sender = sender, weak = False)
+            models.signals.post_delete.connect(self.post_delete, sender = sender, weak = False)
 
-        descriptor = AuditLogDescriptor(log_entry_model, self.manager_class, self.manager_name)
+        descriptor = AuditLogDescriptor(log_entry_model, self.manager_class, self.manager_name, self)
         setattr(sender, self.manager_name, descriptor)
 
+    def get_tracked_attnames(self, model):
+        return tuple(field.attname for field in model._meta.fields if field.name not in self._exclude)
+
+    def check_bit_order(self, state):
+        """
+        Returns a system check error if the tracked fields no longer start
+        with the ones the bits of ``changed_fields`` were given to in the
+        migration ``state``.
+        """
+        if not self._changed_fields or not self.storage.model_table:
+            return []
+        meta = self.log_entry_model._meta
+        model_state = state.models.get((meta.app_label, meta.model_name))
+        field = model_state.fields.get('changed_fields') if model_state is not None else None
+        help_text = str(getattr(field, 'help_text', ''))
+        if not help_text.startswith(BIT_ORDER_PREFIX):
+            return []
+        recorded = help_text[len(BIT_ORDER_PREFIX):].split(', ')
+        if list(self.attnames[:len(recorded)]) == recorded:
+            return []
+        return [checks.Error(
+            "The changed_fields bits of %s were given to %s, the tracked fields are now %s"%(
+                meta.label, ', '.join(recorded), ', '.join(self.attnames)),
+            hint = "Existing entries would report the wrong fields. Keep the tracked fields in the "
+                   "recorded order and add new fields after them.",
+            obj = self.log_entry_model, id = 'audit_log.E001')]
+
+    def get_packed_attnames(self, model):
+        """
+        Returns the attnames of the tracked fields kept in the compressed
+        ``packed_fields`` column instead of columns of their own. With
+        ``pack = True`` these are all fields but the primary key, relations
+        and indexed fields.
+        """
+        if not self._pack:
+            return ()
+        tracked = self.get_tracked_attnames(model)
+        if self._pack is True:
+            return tuple(field.attname for field in model._meta.fields if field.attname in tracked and
+                         not (field.primary_key or field.is_relation or field.unique or field.db_index))
+        attnames = []
+        for name in self._pack:
+            field = model._meta.get_field(name)
+            if field.primary_key or field.attname not in tracked:
+                raise ValueError("%s.%s can not be packed"%(model.__name__, name))
+            attnames.append(field.attname)
+        return tuple(attnames)
+
+    def create_record_class(self, model, log_entry_model):
+        """
+        Returns the namedtuple class used by ``records()`` for the entries
+        of ``log_entry_model``, with one slot per column.
+        """
+        audit_log = self
+        names = tuple(field.attname for field in log_entry_model._meta.fields)
+        base = namedtuple('%sAuditLogRecord'%model._meta.object_name, names)
+
+        class LogRecord(base):
+            __slots__ = ()
+
+            @property
+            def object_state(self):
+                kwargs = dict((attname, getattr(self, attname)) for attname in audit_log.attnames
+                              if attname not in audit_log.packed_attnames)
+                if audit_log.is_partial_entry(self):
+                    kwargs.update(audit_log.rebuild_state(self))
+                if audit_log.packed_attnames:
+                    kwargs.update(audit_log.unpack_values(self.packed_fields))
+                return model(**kwargs)
+
+        LogRecord.__name__ = base.__name__
+        LogRecord.__qualname__ = base.__name__
+        return LogRecord
+
+    def track_originals(self, model):
+        """
+        Wraps ``model.from_db`` so instances loaded from the database remember
+        their original tracked values as a tuple.
+        """
+        from_db = model.from_db.__func__
+        audit_log = self
+
+        def tracking_from_db(cls, db, field_names, values):
+            instance = from_db(cls, db, field_names, values)
+            audit_log.remember_originals(instance)
+            return instance
+
+        model.from_db = classmethod(tracking_from_db)
+
     def copy_fields(self, model):
         """
         Creates copies of the fields we are keeping
@@ -136,14 +1089,18 @@ class AuditLog(object):
 
         for field in model._meta.fields:
 
-            if not field.name in self._exclude:
+            if not field.name in self._exclude and not field.attname in self.packed_attnames:
 
                 # Handle foreign key fields specially to avoid related_name conflicts
                 if isinstance(field, (models.ForeignKey, models.OneToOneField)):
                     # Create a new field with unique related_name
+                    #the related rows are on another database with AUDIT_LOG_DATABASE,
+                    #or there is no log table to cascade to
+                    separate = local_settings.DATABASE is not None or not self.storage.model_table
                     new_field = models.ForeignKey(
                         to=field.remote_field.model,
-                        on_delete=field.remote_field.on_delete,
+                        on_delete=models.DO_NOTHING if separate else field.remote_field.on_delete,
+                        db_constraint=field.db_constraint and not separate,
                         null=field.null,
                         blank=field.blank,
                         db_index=field.db_index,
@@ -154,6 +1111,7 @@ class AuditLog(object):
                         verbose_name=field.verbose_name,
                         help_text=field.help_text,
                     )
+                    new_field.name = field.name
                     field = new_field
                 else:
                     field = copy.deepcopy(field)
@@ -174,15 +1132,21 @@ class AuditLog(object):
                     field.__class__ = models.ForeignKey
 
 
+                if self._mode == 'delta' and not field.primary_key:
+                    #delta entries only fill in the changed fields
+                    field.null = True
+
                 if field.primary_key or field.unique:
                     #unique fields of the original model
                     #can not be guaranteed to be unique
                     #in the audit log entry but they
                     #should still be indexed for faster lookups.
+                    #The former primary key is the first column
+                    #of the history index.
 
+                    field.db_index = not field.primary_key
                     field.primary_key = False
                     field._unique = False
-                    field.db_index = True
 
                 fields[field.name] = field
 
@@ -214,13 +1178,17 @@ class AuditLog(object):
                                                 )
             return result
 
-        action_user_field = LastUserField(related_name = rel_name, editable = False)
+        kwargs = {}
+        if local_settings.DATABASE is not None or not self.storage.model_table:
+            #users are on another database, or there is no log table
+            kwargs = {'db_constraint' : False, 'on_delete' : models.DO_NOTHING}
+        action_user_field = LastUserField(related_name = rel_name, editable = False, **kwargs)
 
         #check if the manager has been attached to auth user model
         if [model._meta.app_label, model.__name__] == getattr(settings, 'AUTH_USER_MODEL', 'auth.User').split("."):
-            action_user_field = LastUserField(related_name = rel_name, editable = False, to = 'self')
+            action_user_field = LastUserField(related_name = rel_name, editable = False, to = 'self', **kwargs)
 
-        return {
+        fields = {
             'action_id' : models.AutoField(primary_key = True),
             'action_date' : models.DateTimeField(default = datetime_now, editable = False, blank=False),
             'action_user' : action_user_field,
@@ -229,9 +1197,19 @@ class AuditLog(object):
                 ('U', _('Changed')),
                 ('D', _('Deleted')),
             )),
-            'object_state' : LogEntryObjectDescriptor(model),
+            'object_state' : LogEntryObjectDescriptor(model, self),
             '__unicode__' : entry_instance_to_unicode,
         }
+        if self._changed_fields:
+            #the bit order is recorded in the migrations, check_bit_order compares it
+            fields['changed_fields'] = models.BigIntegerField(null = True, editable = False,
+                help_text = BIT_ORDER_PREFIX + ', '.join(self.get_tracked_attnames(model)))
+        if self._mode == 'delta':
+            #set on entries completed by prune_audit_log, their changed_fields stay as they were
+            fields['full_state'] = models.BooleanField(default = False, editable = False)
+        if self.packed_attnames:
+            fields['packed_fields'] = models.BinaryField(null = True, editable = False)
+        return fields
 
 
     def get_meta_options(self, model):
@@ -242,12 +1220,33 @@ class AuditLog(object):
         result = {
             'ordering' : ('-action_date',),
             'app_label' : model._meta.app_label,
+            #the latest entries of an object are read without sorting
+            'indexes' : [models.Index(fields = [model._meta.pk.name, '-action_date'])] +
+                        [index.clone() for index in self._indexes] +
+                        self.get_changed_indexes(model),
         }
+        if not self.storage.model_table:
+            #the entries are kept by the storage backend
+            result['managed'] = False
         from django.db.models.options import DEFAULT_NAMES
         if 'default_permissions' in DEFAULT_NAMES:
             result.update({'default_permissions': ()})
         return result
 
+    def get_changed_indexes(self, model):
+        """
+        Returns an index on the bit of every field in ``changed_fields``,
+        matching the expression ``changed()`` filters on.
+        """
+        attnames = self.get_tracked_attnames(model)
+        table = '%s_%sauditlogentry'%(model._meta.app_label, model._meta.model_name)
+        indexes = []
+        for name in self._changed_indexes:
+            bit = 1 << attnames.index(model._meta.get_field(name).attname)
+            indexes.append(models.Index(get_changed_bit(bit),
+                                        name = '%s_%s_chg'%(table[:12], names_digest(table, name, length = 8))))
+        return indexes
+
     def create_log_entry_model(self, model):
         """
         Creates a log entry model that will be associated with
@@ -0,0 +1,106 @@
+"""
+Migration operations installing the database triggers of models tracked
+with ``AuditLog(capture = 'triggers')`` and partitioning the log tables of
+models tracked with ``AuditLog(partition_by = ...)``::
+
+    from django.db import migrations
+    from audit_log.operations import InstallAuditTriggers
+
+    class Migration(migrations.Migration):
+        dependencies = [('store', '0002_productauditlogentry')]
+        operations = [InstallAuditTriggers('Product')]
+"""
+
+from django.db.migrations.operations.base import Operation
+
+from audit_log import partitioning, triggers
+
+
+class AuditTriggersOperation(Operation):
+    reduces_to_sql = True
+    reversible = True
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def deconstruct(self):
+        return (self.__class__.__name__, [self.model_name], {})
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def install(self, app_label, schema_editor, state):
+        model = state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            log_entry_model = triggers.get_log_entry_model(model, state.apps)
+            for sql in triggers.create_trigger_sql(schema_editor.connection, model, log_entry_model):
+                schema_editor.execute(sql)
+
+    def remove(self, app_label, schema_editor, state):
+        model = state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            for sql in triggers.drop_trigger_sql(schema_editor.connection, model):
+                schema_editor.execute(sql)
+
+
+class InstallAuditTriggers(AuditTriggersOperation):
+    """
+    Creates the audit triggers of a model. Runs after the migrations that
+    create the model and its log entry model.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        self.install(app_label, schema_editor, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        self.remove(app_label, schema_editor, from_state)
+
+    def describe(self):
+        return "Install audit log triggers for %s"%self.model_name
+
+
+class RemoveAuditTriggers(AuditTriggersOperation):
+    """
+    Drops the audit triggers of a model, for instance before switching it
+    back to signal capture or before altering its columns.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        self.remove(app_label, schema_editor, from_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        self.install(app_label, schema_editor, to_state)
+
+    def describe(self):
+        return "Remove audit log triggers for %s"%self.model_name
+
+
+class PartitionAuditLog(Operation):
+    """
+    Turns the log entry table of a model into a table partitioned by
+    ``action_date`` on PostgreSQL. Existing entries are kept in the default
+    partition until ``audit_log_partitions`` moves them. Does nothing on
+    SQLite, where the tables are rotated instead.
+    """
+
+    reduces_to_sql = True
+    reversible = False
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def deconstruct(self):
+        return (self.__class__.__name__, [self.model_name], {})
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        log_entry_model = triggers.get_log_entry_model(model, to_state.apps)
+        if self.allow_migrate_model(schema_editor.connection.alias, log_entry_model):
+            for sql in partitioning.partition_table_sql(schema_editor, log_entry_model):
+                schema_editor.execute(sql, params = None)
+
+    def describe(self):
+        return "Partition the audit log of %s by action date"%self.model_name
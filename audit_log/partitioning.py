@@ -0,0 +1,254 @@
+"""
+Time partitioned audit log tables.
+
+Log entry tables of models tracked with ``AuditLog(partition_by = 'month')``
+are split by ``action_date`` so expired entries are removed by dropping a
+whole table instead of deleting them row by row.
+
+* On PostgreSQL the table is converted into a declarative range partitioned
+  table by the ``PartitionAuditLog`` migration operation. Rows outside of
+  the existing partitions land in a default partition, and
+  ``create_partitions`` moves them into their own partition when it creates
+  it.
+* On SQLite, which has no partitioning, ``create_partitions`` rotates the
+  table: the entries of each past period are moved to an archive table
+  named after the period. The archive tables are not visible through the
+  ORM.
+
+Partitions and archive tables are named ``<table>_p<period>``, for example
+``store_productauditlogentry_p2024_05``.
+"""
+
+import datetime
+
+from django.conf import settings
+from django.db import NotSupportedError, connections, DEFAULT_DB_ALIAS
+from django.db.backends.utils import truncate_name
+from django.db.models import Max
+from django.utils import timezone
+
+
+PERIODS = ('day', 'month', 'year')
+
+SUFFIX_FORMATS = {
+    'day' : '%Y_%m_%d',
+    'month' : '%Y_%m',
+    'year' : '%Y',
+}
+
+
+def get_now():
+    if settings.USE_TZ:
+        return timezone.now()
+    return datetime.datetime.now()
+
+
+def period_start(value, period):
+    """
+    Returns the start of the ``period`` containing the datetime ``value``.
+    """
+    value = value.replace(hour = 0, minute = 0, second = 0, microsecond = 0)
+    if period in ('month', 'year'):
+        value = value.replace(day = 1)
+    if period == 'year':
+        value = value.replace(month = 1)
+    return value
+
+
+def add_periods(start, period, count):
+    """
+    Returns the start of the period ``count`` periods after the one
+    starting at ``start``.
+    """
+    if period == 'day':
+        return start + datetime.timedelta(days = count)
+    if period == 'year':
+        return start.replace(year = start.year + count)
+    month = start.month - 1 + count
+    return start.replace(year = start.year + month // 12, month = month % 12 + 1)
+
+
+def get_partition_name(model, start, period):
+    return '%s_p%s'%(model._meta.db_table, start.strftime(SUFFIX_FORMATS[period]))
+
+
+def parse_partition_name(model, name, period):
+    """
+    Returns the start of the period of the partition called ``name`` or
+    ``None`` if it is not a partition of ``model``.
+    """
+    prefix = '%s_p'%model._meta.db_table
+    if not name.startswith(prefix):
+        return None
+    try:
+        start = datetime.datetime.strptime(name[len(prefix):], SUFFIX_FORMATS[period])
+    except ValueError:
+        return None
+    if settings.USE_TZ:
+        start = start.replace(tzinfo = datetime.timezone.utc)
+    return start
+
+
+def get_default_partition_name(connection, model):
+    return truncate_name('%s_default'%model._meta.db_table, connection.ops.max_name_length())
+
+
+def _postgresql_partition_table_sql(schema_editor, model):
+    qn = schema_editor.quote_name
+    max_length = schema_editor.connection.ops.max_name_length()
+    table = model._meta.db_table
+    old = truncate_name('%s_unpartitioned'%table, max_length)
+    pk_column = model._meta.pk.column
+    date_column = model._meta.get_field('action_date').column
+    statements = [
+        'ALTER TABLE %s RENAME TO %s'%(qn(table), qn(old)),
+        'CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS INCLUDING IDENTITY) PARTITION BY RANGE (%s)'%(
+            qn(table), qn(old), qn(date_column)),
+        'CREATE TABLE %s PARTITION OF %s DEFAULT'%(
+            qn(get_default_partition_name(schema_editor.connection, model)), qn(table)),
+        #a serial sequence is owned by the old table and would be dropped with it
+        "DO $$ BEGIN "
+        "IF (SELECT attidentity FROM pg_attribute WHERE attrelid = '%(old)s'::regclass "
+        "AND attname = '%(pk)s') = '' AND pg_get_serial_sequence('%(old)s', '%(pk)s') IS NOT NULL THEN "
+        "EXECUTE 'ALTER SEQUENCE ' || pg_get_serial_sequence('%(old)s', '%(pk)s') || ' OWNED BY %(table)s.%(pk)s'; "
+        "END IF; END $$"%{'old' : qn(old), 'table' : qn(table), 'pk' : pk_column},
+        'INSERT INTO %s SELECT * FROM %s'%(qn(table), qn(old)),
+        'DROP TABLE %s'%qn(old),
+        #the primary key of a partitioned table has to include the partition key
+        'ALTER TABLE %s ADD PRIMARY KEY (%s, %s)'%(qn(table), qn(pk_column), qn(date_column)),
+        "SELECT setval(pg_get_serial_sequence('%(table)s', '%(pk)s'), COALESCE(MAX(%(pk_q)s), 1), "
+        "MAX(%(pk_q)s) IS NOT NULL) FROM %(table)s"%{'table' : qn(table), 'pk' : pk_column, 'pk_q' : qn(pk_column)},
+    ]
+    statements.extend(str(statement) for statement in schema_editor._model_indexes_sql(model))
+    return statements
+
+
+def partition_table_sql(schema_editor, model):
+    """
+    Returns the statements turning the table of the log entry ``model`` into
+    a partitioned table. There is nothing to do on SQLite.
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        return _postgresql_partition_table_sql(schema_editor, model)
+    if vendor == 'sqlite':
+        return []
+    raise NotSupportedError("Partitioned audit logs are not supported on %s"%vendor)
+
+
+def get_partitions(model, period, using = DEFAULT_DB_ALIAS):
+    """
+    Returns ``(name, start)`` pairs for the partitions or archive tables of
+    the log entry ``model``, ordered by period.
+    """
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+                           'WHERE i.inhparent = %s::regclass',
+                           [connection.ops.quote_name(model._meta.db_table)])
+        elif connection.vendor == 'sqlite':
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE %s",
+                           ['%s_p%%'%model._meta.db_table])
+        else:
+            raise NotSupportedError("Partitioned audit logs are not supported on %s"%connection.vendor)
+        names = [row[0] for row in cursor.fetchall()]
+    partitions = []
+    for name in names:
+        start = parse_partition_name(model, name, period)
+        if start is not None:
+            partitions.append((name, start))
+    return sorted(partitions, key = lambda partition: partition[1])
+
+
+def _postgresql_create_partitions(connection, model, period, starts):
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    default = get_default_partition_name(connection, model)
+    date_column = qn(model._meta.get_field('action_date').column)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT DISTINCT date_trunc('%s', %s) FROM %s"%(period, date_column, qn(default)))
+        starts = set(starts) | set(period_start(row[0], period) for row in cursor.fetchall())
+    existing = set(start for name, start in get_partitions(model, period, connection.alias))
+    created = []
+    for start in sorted(starts - existing):
+        name = get_partition_name(model, start, period)
+        end = add_periods(start, period, 1)
+        with connection.schema_editor() as schema_editor:
+            schema_editor.execute('CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS)'%(qn(name), qn(table)))
+            #rows written while the partition was missing are in the default partition
+            schema_editor.execute('INSERT INTO %s SELECT * FROM %s WHERE %s >= %%s AND %s < %%s'%(
+                qn(name), qn(default), date_column, date_column), [start, end])
+            schema_editor.execute('DELETE FROM %s WHERE %s >= %%s AND %s < %%s'%(
+                qn(default), date_column, date_column), [start, end])
+            schema_editor.execute('ALTER TABLE %s ATTACH PARTITION %s FOR VALUES FROM (%%s) TO (%%s)'%(
+                qn(table), qn(name)), [start, end])
+        created.append(name)
+    return created
+
+
+def _sqlite_rotate(connection, model, period, now):
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    date_column = qn(model._meta.get_field('action_date').column)
+    manager = model._default_manager.db_manager(connection.alias)
+    existing = set(name for name, start in get_partitions(model, period, connection.alias))
+    bound = period_start(now, period)
+    created = []
+    #the table is never renamed, triggers writing to it keep working
+    with connection.schema_editor() as schema_editor:
+        while True:
+            latest = manager.filter(action_date__lt = bound).aggregate(latest = Max('action_date'))['latest']
+            if latest is None:
+                break
+            start = period_start(latest, period)
+            name = get_partition_name(model, start, period)
+            condition = '%s >= %%s AND %s < %%s'%(date_column, date_column)
+            params = [connection.ops.adapt_datetimefield_value(start),
+                      connection.ops.adapt_datetimefield_value(bound)]
+            if name in existing:
+                #late entries of a period that was already archived
+                schema_editor.execute('INSERT INTO %s SELECT * FROM %s WHERE %s'%(
+                    qn(name), qn(table), condition), params)
+            else:
+                schema_editor.execute('CREATE TABLE %s AS SELECT * FROM %s WHERE %s'%(
+                    qn(name), qn(table), condition), params)
+                created.append(name)
+            schema_editor.execute('DELETE FROM %s WHERE %s'%(qn(table), condition), params)
+            bound = start
+    return created[::-1]
+
+
+def create_partitions(model, period, ahead = 3, using = DEFAULT_DB_ALIAS, now = None):
+    """
+    Creates the partitions of the log entry ``model`` for the current
+    period and ``ahead`` periods after it on PostgreSQL, or archives the
+    entries of past periods on SQLite. Returns the names of the created
+    tables.
+    """
+    connection = connections[using]
+    now = now or get_now()
+    if connection.vendor == 'postgresql':
+        current = period_start(now, period)
+        starts = [add_periods(current, period, i) for i in range(ahead + 1)]
+        return _postgresql_create_partitions(connection, model, period, starts)
+    if connection.vendor == 'sqlite':
+        return _sqlite_rotate(connection, model, period, now)
+    raise NotSupportedError("Partitioned audit logs are not supported on %s"%connection.vendor)
+
+
+def drop_partitions(model, period, keep, using = DEFAULT_DB_ALIAS, now = None):
+    """
+    Drops the partitions or archive tables of the log entry ``model`` that
+    end before the last ``keep`` periods. Returns the names of the dropped
+    tables.
+    """
+    connection = connections[using]
+    cutoff = add_periods(period_start(now or get_now(), period), period, -keep)
+    dropped = []
+    for name, start in get_partitions(model, period, using):
+        if add_periods(start, period, 1) <= cutoff:
+            with connection.schema_editor() as schema_editor:
+                schema_editor.execute('DROP TABLE %s'%schema_editor.quote_name(name))
+            dropped.append(name)
+    return dropped
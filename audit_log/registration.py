@@ -1,3 +1,6 @@
+from audit_log import settings as local_settings
+
+
 class FieldRegistry(object):
     _registry = {}
     
@@ -15,3 +18,110 @@ class FieldRegistry(object):
     def __contains__(self, model):
         return model in self.__class__._registry.setdefault(self._fieldcls, {})
 
+
+class AuditPlan(object):
+    """
+    Everything the save and delete handlers need to know about a model,
+    worked out once while the model class is being prepared instead of on
+    every save.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        #names of the stamp fields grouped by kind
+        self.last_user = ()
+        self.last_session = ()
+        self.creating_user = ()
+        self.creating_session = ()
+        #attnames of the stamp fields by name
+        self.attnames = {}
+        #AuditLog instances attached to the model
+        self.logs = ()
+
+    def add_stamp_field(self, field):
+        kind = field.stamp_kind
+        setattr(self, kind, getattr(self, kind) + (field.name,))
+        self.attnames[field.name] = field.attname
+
+    def add_log(self, audit_log):
+        self.logs = self.logs + (audit_log,)
+
+    def stamp(self, instance, user, session):
+        """
+        Sets the user and session stamp fields of ``instance``. Creation
+        stamps are only set when the instance is about to be inserted and
+        they are still empty.
+        """
+        for name in self.last_user:
+            setattr(instance, name, user)
+        for name in self.last_session:
+            setattr(instance, name, session)
+        if instance._state.adding:
+            #an instance built with the pk of an existing row is updated, not
+            #inserted, and its stamps must not be overwritten
+            for name in self.creating_user:
+                if getattr(instance, self.attnames[name]) is None:
+                    setattr(instance, name, user)
+            for name in self.creating_session:
+                if not getattr(instance, self.attnames[name]):
+                    setattr(instance, name, session)
+
+
+_plans = {}
+
+#app_label.model_name of the log entry models, matches historical models too
+_log_entry_labels = set()
+
+
+def get_plan(model):
+    """
+    Returns the ``AuditPlan`` of ``model`` or ``None`` if the model has
+    neither stamp fields nor an audit log.
+    """
+    return _plans.get(model)
+
+
+def plan_for(model):
+    """
+    Returns the ``AuditPlan`` of ``model``, creating it if needed.
+    """
+    plan = _plans.get(model)
+    if plan is None:
+        plan = _plans[model] = AuditPlan(model)
+    return plan
+
+
+def get_audit_logs():
+    """
+    Returns the ``AuditLog`` instances of all prepared models.
+    """
+    return [audit_log for plan in _plans.values() for audit_log in plan.logs
+            if getattr(audit_log, 'log_entry_model', None) is not None]
+
+
+def get_audit_log(log_entry_model):
+    """
+    Returns the ``AuditLog`` that created ``log_entry_model`` or ``None``.
+    """
+    label = log_entry_model._meta.label_lower
+    for audit_log in get_audit_logs():
+        if audit_log.log_entry_model._meta.label_lower == label:
+            return audit_log
+    return None
+
+
+def register_log_entry_model(model):
+    _log_entry_labels.add(model._meta.label_lower)
+
+
+def is_log_entry_model(model):
+    """
+    Returns ``True`` if ``model`` is a log entry model created by an
+    ``AuditLog`` or the unified log entry model.
+    """
+    return is_log_entry_label(model._meta.label_lower)
+
+
+def is_log_entry_label(label):
+    label = label.lower()
+    return label in _log_entry_labels or label == (local_settings.ENTRY_MODEL or '').lower()
@@ -0,0 +1,76 @@
+"""
+Chunked removal of old audit log entries.
+
+Entries are deleted in chunks walked in ``action_id`` order, each chunk in
+its own short transaction with a single ``DELETE`` statement that doesn't
+go through the ORM collector. Deleted rows are simply gone, so an
+interrupted run is resumed by running it again.
+
+Delta entries only hold the changed fields and are completed from older
+entries. Before a chunk of a delta log is deleted, the oldest entry left
+of every object in it is rewritten as a full entry.
+"""
+
+import time
+
+from django.db import transaction, DEFAULT_DB_ALIAS
+
+from audit_log import registration
+
+
+def complete_survivors(queryset, using = DEFAULT_DB_ALIAS):
+    """
+    Rewrites the oldest entry that is not in ``queryset`` of every object
+    with entries in ``queryset`` as a full entry, if it is a delta entry,
+    so it doesn't need the entries of ``queryset`` once they are deleted.
+    The survivors are looked up with one query, their ``changed_fields``
+    are kept and ``full_state`` is set.
+    """
+    #imported here, the managers module imports this one through the storage backends
+    from audit_log.models.managers import first_entries
+    audit_log = registration.get_audit_log(queryset.model)
+    if audit_log is None or audit_log._mode != 'delta':
+        return
+    pk_attname = audit_log.pk_attname
+    manager = queryset.model._base_manager.db_manager(using)
+    remaining = manager.filter(**{'%s__in'%pk_attname: queryset.order_by().values(pk_attname)}).exclude(
+        action_id__in = queryset.values('action_id'))
+    oldest = first_entries(remaining, pk_attname, ['action_date', 'action_id'])
+    #only the delta entries have to be completed
+    survivors = manager.filter(action_id__in = oldest, action_type = 'U', full_state = False).exclude(
+        changed_fields = audit_log.full_mask)
+    for survivor in survivors:
+        state = audit_log.rebuild_state(survivor, using)
+        manager.filter(action_id = survivor.action_id).update(full_state = True, **state)
+
+
+def delete_chunks(queryset, chunk_size = 1000, sleep = 0, using = DEFAULT_DB_ALIAS):
+    """
+    Deletes the log entries matched by ``queryset`` in chunks of
+    ``chunk_size`` rows ordered by ``action_id``, sleeping ``sleep`` seconds
+    between chunks. Yields ``(deleted, last_action_id)`` after every chunk.
+    """
+    queryset = queryset.using(using).order_by('action_id')
+    last = None
+    while True:
+        chunk = queryset if last is None else queryset.filter(action_id__gt = last)
+        ids = list(chunk.values_list('action_id', flat = True)[:chunk_size])
+        if not ids:
+            return
+        with transaction.atomic(using = using):
+            chunk = queryset.filter(action_id__gte = ids[0], action_id__lte = ids[-1])
+            complete_survivors(chunk, using)
+            deleted = chunk._raw_delete(using)
+        last = ids[-1]
+        yield deleted, last
+        if sleep and len(ids) == chunk_size:
+            time.sleep(sleep)
+
+
+def prune(model, before, chunk_size = 1000, sleep = 0, using = DEFAULT_DB_ALIAS):
+    """
+    Deletes the entries of the log entry ``model`` written before the
+    datetime ``before``. Returns the number of deleted entries.
+    """
+    queryset = model._base_manager.filter(action_date__lt = before)
+    return sum(deleted for deleted, last in delete_chunks(queryset, chunk_size, sleep, using))
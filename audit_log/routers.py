@@ -0,0 +1,45 @@
+"""
+Database router placing the log entry models on the ``AUDIT_LOG_DATABASE``
+alias and sending history reads to ``AUDIT_LOG_READ_DATABASE``, a read
+replica for instance::
+
+    AUDIT_LOG_DATABASE = 'audit'
+    AUDIT_LOG_READ_DATABASE = 'audit_replica'
+    DATABASE_ROUTERS = ['audit_log.routers.AuditLogRouter']
+
+Models that aren't log entry models are left to the other routers.
+"""
+
+from django.db import router
+
+from audit_log import registration, settings as local_settings
+
+
+class AuditLogRouter(object):
+
+    def db_for_read(self, model, **hints):
+        if registration.is_log_entry_model(model):
+            return local_settings.READ_DATABASE or local_settings.DATABASE
+        instance = hints.get('instance')
+        if (local_settings.DATABASE is not None and instance is not None and
+                registration.is_log_entry_model(instance.__class__)):
+            #objects referenced by a log entry are not on the log database
+            return router.db_for_read(model)
+        return None
+
+    def db_for_write(self, model, **hints):
+        if registration.is_log_entry_model(model):
+            return local_settings.DATABASE
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if registration.is_log_entry_model(obj1.__class__) or registration.is_log_entry_model(obj2.__class__):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name = None, **hints):
+        if local_settings.DATABASE is None or model_name is None:
+            return None
+        if registration.is_log_entry_label('%s.%s'%(app_label, model_name)):
+            return db == local_settings.DATABASE
+        return None
@@ -1,3 +1,18 @@
 from django.conf import settings as global_settings
 
 DISABLE_AUDIT_LOG = getattr(global_settings, 'DISABLE_AUDIT_LOG', False)
+
+#options for the background writer used by AuditLog(background = True)
+BACKGROUND_WRITER = getattr(global_settings, 'AUDIT_LOG_BACKGROUND_WRITER', {})
+
+#database alias the log entries are written to, the database of the tracked object if None
+DATABASE = getattr(global_settings, 'AUDIT_LOG_DATABASE', None)
+
+#database alias AuditLogRouter sends history reads to, DATABASE if None
+READ_DATABASE = getattr(global_settings, 'AUDIT_LOG_READ_DATABASE', None)
+
+#write the log entries once the transaction of the tracked change commits
+DEFER_WRITES = getattr(global_settings, 'AUDIT_LOG_DEFER_WRITES', False)
+
+#app_label.ModelName of the AbstractLogEntry subclass used by AuditLog(storage = 'unified')
+ENTRY_MODEL = getattr(global_settings, 'AUDIT_LOG_ENTRY_MODEL', None)
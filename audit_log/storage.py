@@ -0,0 +1,431 @@
+"""
+Storage backends of audit log entries.
+
+``ModelStorage``, the default, inserts the entries into the table of the
+log entry model. ``SegmentFileStorage`` appends them to local segment
+files instead and never touches the database::
+
+    from audit_log.storage import SegmentFileStorage
+
+    class Click(models.Model):
+        ...
+
+        audit_log = AuditLog(storage = SegmentFileStorage('/var/lib/audit'))
+
+``UnifiedStorage``, used with ``AuditLog(storage = 'unified')``, writes the
+entries of all models to one table, the ``AbstractLogEntry`` subclass set
+by ``AUDIT_LOG_ENTRY_MODEL``, with the tracked fields in a JSON column.
+
+A backend implements ``save(entries, using, batch_size)`` and
+``records(pk, using)``. The log entry model is still created for every
+backend, it describes the columns of the entries.
+"""
+
+import copy
+import errno
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from django.apps import apps
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.db import models
+from django.db.models.constants import LOOKUP_SEP
+
+from audit_log import context, settings as local_settings
+from audit_log.archive import ArchiveJSONEncoder
+
+
+class BaseStorage(object):
+    #whether the entries are rows of the log entry model's table
+    model_table = True
+
+    #whether save() writes in the transaction of the change, the entries
+    #of other backends are saved once that transaction commits
+    transactional = True
+
+    #column of get_queryset() with the primary key of the tracked object,
+    #the primary key attname of the tracked model if None
+    object_key = None
+
+    def bind(self, audit_log):
+        """
+        Called once the log entry model of ``audit_log`` is created.
+        """
+        self.audit_log = audit_log
+
+    def save(self, entries, using, batch_size = None):
+        """
+        Stores the unsaved log ``entries`` recorded for changes made on the
+        database ``using``.
+        """
+        raise NotImplementedError
+
+    def records(self, pk = None, using = None):
+        """
+        Returns an iterable of the records of the entries, newest first,
+        only those of the object with primary key ``pk`` if given.
+        """
+        raise NotImplementedError
+
+    def get_queryset(self, pk = None, using = None):
+        """
+        Returns a queryset of the stored entries for the log manager, or
+        ``None`` if the storage can't be queried with the ORM.
+        """
+        return None
+
+
+class ModelStorage(BaseStorage):
+    """
+    Inserts the entries into the table of the log entry model.
+    """
+
+    def save(self, entries, using, batch_size = None):
+        log_using = self.audit_log.get_log_database(using)
+        if len(entries) == 1:
+            entries[0].save(force_insert = True, using = log_using)
+        else:
+            manager = self.audit_log.log_entry_model._default_manager.db_manager(log_using)
+            manager.bulk_create(entries, batch_size = batch_size)
+
+    def records(self, pk = None, using = None):
+        queryset = self.audit_log.log_entry_model._default_manager.db_manager(using).all()
+        if pk is not None:
+            queryset = queryset.filter(**{self.audit_log.pk_attname: pk})
+        return queryset.records()
+
+
+#length and CRC32 of the JSON payload that follows
+RECORD_HEADER = struct.Struct('>II')
+
+
+def read_segment(path):
+    """
+    Returns the ``(start, end)`` offsets of the payloads of the complete
+    records in the segment file at ``path``, ignoring a torn record at the
+    end, and the mapped file. The caller closes the map if there are
+    any records.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return [], b''
+        data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+    offsets = []
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        length, checksum = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + RECORD_HEADER.size
+        end = start + length
+        if end > len(data) or zlib.crc32(data[start:end]) != checksum:
+            break
+        offsets.append((start, end))
+        offset = end
+    if not offsets:
+        data.close()
+    return offsets, data
+
+
+class SegmentFileStorage(BaseStorage):
+    """
+    Appends the entries to numbered segment files in a directory per log
+    entry model, as length prefixed JSON records with a checksum. A new
+    segment is started once one grows past ``segment_size`` bytes.
+
+    With ``fsync`` the entries are on disk when ``save`` returns. Threads
+    saving at the same time share the ``fsync`` calls: a thread waiting
+    for its turn finds its records already synced by the previous call.
+
+    The entries are written once the transaction of the change commits.
+    Only one process may write to a directory, ``open`` takes an exclusive
+    lock on it where ``fcntl`` is available.
+    """
+
+    model_table = False
+    transactional = False
+
+    def __init__(self, directory, segment_size = 64 * 1024 * 1024, fsync = True):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._file = None
+        self._lock_fd = None
+        self._segment = None
+        self._last_id = 0
+        #number of writes done and synced, for the group commit
+        self._written = 0
+        self._synced = 0
+
+    def get_path(self):
+        return os.path.join(self.directory, self.audit_log.log_entry_model._meta.db_table)
+
+    def get_segments(self):
+        """
+        Returns the paths of the segment files, oldest first.
+        """
+        path = self.get_path()
+        if not os.path.isdir(path):
+            return []
+        return [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith('.seg')]
+
+    def get_segment_path(self, number):
+        return os.path.join(self.get_path(), '%08d.seg'%number)
+
+    def lock(self):
+        if fcntl is None:
+            return
+        path = os.path.join(self.get_path(), 'lock')
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            os.close(fd)
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            raise ImproperlyConfigured("%s is locked by another writer, only one process may "
+                                       "write to a segment directory"%self.get_path())
+        self._lock_fd = fd
+
+    def open(self):
+        os.makedirs(self.get_path(), exist_ok = True)
+        self.lock()
+        segments = self.get_segments()
+        self._segment = int(os.path.basename(segments[-1])[:-4]) if segments else 1
+        path = self.get_segment_path(self._segment)
+        self._last_id = 0
+        #a rotation leaves an empty newest segment, the last id is in an older one
+        for number, segment in enumerate(reversed(segments)):
+            offsets, data = read_segment(segment)
+            valid = 0
+            if offsets:
+                start, valid = offsets[-1]
+                self._last_id = json.loads(data[start:valid])['action_id']
+                data.close()
+            if number == 0 and os.path.getsize(segment) > valid:
+                #a torn record from a crash is cut off
+                os.truncate(segment, valid)
+            if offsets:
+                break
+        self._file = open(path, 'ab')
+
+    def rotate(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._segment += 1
+        self._file = open(self.get_segment_path(self._segment), 'ab')
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+
+    def encode(self, entry):
+        values = dict((field.attname, getattr(entry, field.attname))
+                      for field in entry._meta.concrete_fields)
+        return json.dumps(values, cls = ArchiveJSONEncoder, separators = (',', ':')).encode('utf-8')
+
+    def save(self, entries, using = None, batch_size = None):
+        for entry in entries:
+            #no pre_save is sent for the entries
+            context.stamp(entry.__class__, entry)
+        with self._lock:
+            if self._file is None:
+                self.open()
+            chunks = []
+            for entry in entries:
+                self._last_id += 1
+                entry.action_id = self._last_id
+                payload = self.encode(entry)
+                chunks.append(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+                chunks.append(payload)
+            self._file.write(b''.join(chunks))
+            self._file.flush()
+            if self._file.tell() >= self.segment_size:
+                self.rotate()
+            self._written += 1
+            ticket = self._written
+        if self.fsync:
+            self.sync(ticket)
+
+    def sync(self, ticket):
+        with self._sync_lock:
+            if self._synced >= ticket:
+                return
+            with self._lock:
+                target = self._written
+                if self._file is None:
+                    #closed since, which flushed it
+                    return
+                #rotate() may close the file while it is synced
+                fd = os.dup(self._file.fileno())
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._synced = target
+
+    def records(self, pk = None, using = None):
+        model = self.audit_log.log_entry_model
+        record_class = model.record_class
+        fields = [model._meta.get_field(name) for name in record_class._fields]
+        if pk is not None:
+            pk = model._meta.get_field(self.audit_log.pk_attname).to_python(pk)
+        for path in reversed(self.get_segments()):
+            offsets, data = read_segment(path)
+            if not offsets:
+                continue
+            try:
+                for start, end in reversed(offsets):
+                    values = json.loads(data[start:end])
+                    record = record_class._make(field.to_python(values[field.attname]) for field in fields)
+                    if pk is None or getattr(record, self.audit_log.pk_attname) == pk:
+                        yield record
+            finally:
+                data.close()
+
+
+def get_entry_model():
+    """
+    Returns the unified log entry model set by ``AUDIT_LOG_ENTRY_MODEL``.
+    """
+    if not local_settings.ENTRY_MODEL:
+        raise ImproperlyConfigured("AuditLog(storage = 'unified') needs the AUDIT_LOG_ENTRY_MODEL setting")
+    try:
+        return apps.get_model(local_settings.ENTRY_MODEL, require_ready = False)
+    except (ValueError, LookupError):
+        raise ImproperlyConfigured("AUDIT_LOG_ENTRY_MODEL refers to model '%s' that has not been "
+                                   "installed"%local_settings.ENTRY_MODEL)
+
+
+def decode_snapshot(model, snapshot):
+    """
+    Returns an instance of ``model`` with the JSON ``snapshot`` values of
+    its fields, by attname.
+    """
+    return model(**dict((attname, model._meta.get_field(attname).to_python(value))
+                        for attname, value in snapshot.items()))
+
+
+def pack_snapshot(values):
+    """
+    Returns the ``values`` dictionary as zlib compressed compact JSON. The
+    keys are sorted, so equal values always pack to the same bytes.
+    """
+    return zlib.compress(json.dumps(values, cls = ArchiveJSONEncoder, sort_keys = True,
+                                    separators = (',', ':')).encode('utf-8'))
+
+
+def unpack_snapshot(data):
+    """
+    Returns the dictionary packed into ``data`` by ``pack_snapshot``.
+    """
+    return json.loads(zlib.decompress(data))
+
+
+class SnapshotQuerySet(models.QuerySet):
+    """
+    Queryset of the unified log entry model that looks up the tracked
+    fields of ``audit_log`` in the snapshot, ``title = 'x'`` standing for
+    ``snapshot__title = 'x'``.
+    """
+
+    audit_log = None
+
+    def _clone(self):
+        clone = super(SnapshotQuerySet, self)._clone()
+        clone.audit_log = self.audit_log
+        return clone
+
+    def translate(self, lookup, value):
+        name, sep, rest = lookup.partition(LOOKUP_SEP)
+        try:
+            self.model._meta.get_field(name)
+            return lookup, value
+        except FieldDoesNotExist:
+            pass
+        try:
+            field = self.audit_log.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return lookup, value
+        if field.attname not in self.audit_log.attnames:
+            return lookup, value
+        if isinstance(value, models.Model):
+            value = value.pk
+        return 'snapshot%s%s%s%s'%(LOOKUP_SEP, field.attname, sep, rest), value
+
+    def translate_q(self, q):
+        q = copy.copy(q)
+        q.children = [self.translate_q(child) if isinstance(child, models.Q) else self.translate(*child)
+                      for child in q.children]
+        return q
+
+    def _filter_or_exclude(self, negate, args, kwargs):
+        args = tuple(self.translate_q(arg) if isinstance(arg, models.Q) else arg for arg in args)
+        kwargs = dict(self.translate(lookup, value) for lookup, value in kwargs.items())
+        return super(SnapshotQuerySet, self)._filter_or_exclude(negate, args, kwargs)
+
+
+class UnifiedStorage(BaseStorage):
+    """
+    Inserts the entries into the table shared by all models tracked with
+    ``AuditLog(storage = 'unified')``, keyed by content type and object id.
+    """
+
+    model_table = False
+    object_key = 'object_id'
+
+    def get_content_type_id(self):
+        from django.contrib.contenttypes.models import ContentType
+        return ContentType.objects.get_for_model(self.audit_log.model, for_concrete_model = False).pk
+
+    def save(self, entries, using, batch_size = None):
+        entry_model = get_entry_model()
+        content_type_id = self.get_content_type_id()
+        rows = []
+        for entry in entries:
+            row = entry_model(
+                content_type_id = content_type_id,
+                object_id = str(getattr(entry, self.audit_log.pk_attname)),
+                action_date = entry.action_date,
+                action_user_id = entry.action_user_id,
+                action_type = entry.action_type,
+                snapshot = dict((attname, getattr(entry, attname)) for attname in self.audit_log.attnames),
+            )
+            #no pre_save is sent for bulk inserts
+            context.stamp(entry_model, row)
+            rows.append(row)
+        manager = entry_model._default_manager.db_manager(self.audit_log.get_log_database(using))
+        manager.bulk_create(rows, batch_size = batch_size)
+
+    def get_queryset(self, pk = None, using = None):
+        queryset = SnapshotQuerySet(get_entry_model(), using = using)
+        queryset.audit_log = self.audit_log
+        queryset = queryset.filter(content_type_id = self.get_content_type_id())
+        if pk is not None:
+            queryset = queryset.filter(object_id = str(pk))
+        return queryset
+
+    def records(self, pk = None, using = None):
+        model = self.audit_log.log_entry_model
+        record_class = model.record_class
+        fields = [model._meta.get_field(name) for name in record_class._fields]
+        rows = self.get_queryset(pk, using).order_by('-action_date', '-action_id').values_list(
+            'action_id', 'action_date', 'action_user_id', 'action_type', 'snapshot')
+        for action_id, action_date, action_user_id, action_type, snapshot in rows.iterator():
+            values = dict(snapshot, action_id = action_id, action_date = action_date,
+                          action_user_id = action_user_id, action_type = action_type)
+            yield record_class._make(field.to_python(values.get(field.attname)) for field in fields)
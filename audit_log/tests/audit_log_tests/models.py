@@ -5,10 +5,13 @@ from django.contrib.auth.models import (
     BaseUserManager, AbstractBaseUser
 )
 
+from audit_log.models import AbstractLogEntry, AuthStampedModel
 from audit_log.models.fields import LastUserField, LastSessionKeyField, CreatingUserField
-from audit_log.models.managers import AuditLog
+from audit_log.models.managers import AuditLog, AuditedManager
+from audit_log.storage import SegmentFileStorage
 
 import datetime
+import tempfile
 
 
 class EmployeeManager(BaseUserManager):
@@ -102,6 +105,129 @@ class ProductRating(models.Model):
     product = models.ForeignKey(Product)
     rating = models.PositiveIntegerField()
 
+class ProductReview(AuthStampedModel):
+    product = models.ForeignKey(Product, on_delete = models.CASCADE)
+    text = models.TextField()
+
+    audit_log = AuditLog(retention = datetime.timedelta(days = 90),
+                         indexes = [models.Index(fields = ['action_user', 'action_date'])])
+
+class Shipment(models.Model):
+    product = models.ForeignKey(Product, on_delete = models.CASCADE)
+    quantity = models.PositiveIntegerField()
+
+    audit_log = AuditLog(background = True)
+
+class Article(models.Model):
+    title = models.CharField(max_length = 100)
+    body = models.TextField()
+    status = models.CharField(max_length = 20, default = 'draft')
+
+    audit_log = AuditLog(mode = 'delta')
+
+    def __str__(self):
+        return self.title
+
+class Tag(models.Model):
+    name = models.CharField(max_length = 50)
+    description = models.TextField(blank = True)
+
+    audit_log = AuditLog(skip_unchanged = True)
+
+    def __str__(self):
+        return self.name
+
+class Coupon(models.Model):
+    code = models.CharField(max_length = 20)
+    discount = models.IntegerField(default = 0)
+    category = models.ForeignKey(ProductCategory, null = True, on_delete = models.SET_NULL)
+
+    audit_log = AuditLog(capture = 'triggers')
+
+    def __str__(self):
+        return self.code
+
+class Supplier(AuthStampedModel):
+    name = models.CharField(max_length = 100)
+    rating = models.IntegerField(default = 0)
+
+    objects = AuditedManager()
+    audit_log = AuditLog()
+
+    def __str__(self):
+        return self.name
+
+class Payment(models.Model):
+    reference = models.CharField(max_length = 20)
+    amount = models.IntegerField(default = 0)
+
+    audit_log = AuditLog(partition_by = 'month')
+
+    def __str__(self):
+        return self.reference
+
+class Offer(models.Model):
+    title = models.CharField(max_length = 100)
+    price = models.IntegerField(default = 0)
+    status = models.CharField(max_length = 20, default = 'open')
+
+    objects = AuditedManager()
+    audit_log = AuditLog(changed_fields = ['price'])
+
+    def __str__(self):
+        return self.title
+
+class Click(models.Model):
+    url = models.CharField(max_length = 200)
+    count = models.IntegerField(default = 0)
+
+    objects = AuditedManager()
+    #the tests point the storage at a temporary directory
+    audit_log = AuditLog(storage = SegmentFileStorage(tempfile.gettempdir()))
+
+    def __str__(self):
+        return self.url
+
+class LogEntry(AbstractLogEntry):
+    pass
+
+class Ticket(models.Model):
+    title = models.CharField(max_length = 100)
+    status = models.CharField(max_length = 20, default = 'open')
+    due = models.DateTimeField(null = True)
+
+    objects = AuditedManager()
+    audit_log = AuditLog(storage = 'unified')
+
+    def __str__(self):
+        return self.title
+
+class TicketComment(models.Model):
+    ticket = models.ForeignKey(Ticket, on_delete = models.CASCADE)
+    text = models.TextField()
+
+    audit_log = AuditLog(storage = 'unified')
+
+class Document(models.Model):
+    title = models.CharField(max_length = 100, db_index = True)
+    category = models.ForeignKey(ProductCategory, null = True, on_delete = models.SET_NULL)
+    body = models.TextField(blank = True)
+    metadata = models.JSONField(default = dict)
+    pages = models.IntegerField(default = 1)
+    published = models.DateTimeField(null = True)
+
+    objects = AuditedManager()
+    audit_log = AuditLog(pack = True, changed_fields = True)
+
+    def __str__(self):
+        return self.title
+
+class Memo(models.Model):
+    subject = models.CharField(max_length = 100)
+    body = models.TextField()
+
+    audit_log = AuditLog(pack = ['body'])
+
 class WarehouseEntry(models.Model):
     product = models.ForeignKey(Product)
     quantity = models.DecimalField(max_digits = 10, decimal_places = 2)
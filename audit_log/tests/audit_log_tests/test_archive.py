@@ -0,0 +1,119 @@
+import csv
+import datetime
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from audit_log import archive
+from .models import Article, Product, ProductCategory
+
+
+class ArchiveTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.category = ProductCategory.objects.create(name = 'gadgets', description = 'multi\nline')
+        self.products = [Product.objects.create(name = 'product %s'%i, description = 'line one\nline two',
+                                                price = 10, category = self.category)
+                         for i in range(5)]
+        self.log_model = Product.audit_log.model
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read_jsonl(self, manifest):
+        rows = []
+        for segment in manifest['segments']:
+            path = os.path.join(self.directory, segment['file'])
+            with archive.open_segment(path, 'rt', manifest['compression']) as f:
+                rows.extend(json.loads(line) for line in f)
+        return rows
+
+    def test_export_segments(self):
+        manifest = archive.export(self.log_model, self.directory, segment_size = 2, chunk_size = 2)
+        self.assertEqual(manifest['rows'], 5)
+        self.assertEqual([segment['rows'] for segment in manifest['segments']], [2, 2, 1])
+        self.assertTrue(manifest['segments'][0]['file'].endswith('-00001.jsonl.gz'))
+        rows = self.read_jsonl(manifest)
+        ids = list(self.log_model.objects.order_by('action_id').values_list('action_id', flat = True))
+        self.assertEqual([row['action_id'] for row in rows], ids)
+        self.assertEqual(rows[0]['description'], 'line one\nline two')
+        self.assertEqual(manifest['min_action_id'], ids[0])
+        self.assertEqual(manifest['max_action_id'], ids[-1])
+        path = archive.get_manifest_path(self.directory, manifest['name'])
+        self.assertEqual(archive.get_manifest_paths(self.directory, self.log_model), [path])
+        self.assertEqual(archive.load_manifest(path), manifest)
+        archive.verify(self.directory, manifest)
+
+    def test_export_csv(self):
+        manifest = archive.export(self.log_model, self.directory, format = 'csv', compression = None)
+        path = os.path.join(self.directory, manifest['segments'][0]['file'])
+        with archive.open_segment(path, 'rt', None) as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0], manifest['columns'])
+        self.assertEqual(len(rows), 6)
+        archive.verify(self.directory, manifest)
+
+    def test_export_twice(self):
+        first = archive.export(self.log_model, self.directory)
+        Product.objects.create(name = 'new', description = 'new', price = 1, category = self.category)
+        second = archive.export(self.log_model, self.directory)
+        self.assertNotEqual(first['segments'][0]['file'], second['segments'][0]['file'])
+        paths = archive.get_manifest_paths(self.directory, self.log_model)
+        self.assertEqual([archive.load_manifest(path)['rows'] for path in paths], [5, 6])
+        #the files of the first export are left as they were
+        archive.verify(self.directory, first)
+        self.assertEqual(len(self.read_jsonl(first)), 5)
+
+    def test_export_before(self):
+        old = timezone.now() - datetime.timedelta(days = 100)
+        self.log_model.objects.filter(id__in = [p.pk for p in self.products[:2]]).update(action_date = old)
+        manifest = archive.export(self.log_model, self.directory,
+                                  before = timezone.now() - datetime.timedelta(days = 30))
+        self.assertEqual(manifest['rows'], 2)
+
+    def test_verify_detects_changes(self):
+        manifest = archive.export(self.log_model, self.directory, compression = None)
+        with open(os.path.join(self.directory, manifest['segments'][0]['file']), 'a') as f:
+            f.write('{}\n')
+        self.assertRaises(archive.ArchiveError, archive.verify, self.directory, manifest)
+        self.assertRaises(archive.ArchiveError, archive.delete_exported, self.log_model, self.directory, manifest)
+        self.assertEqual(self.log_model.objects.count(), 5)
+
+    def test_delete_exported(self):
+        manifest = archive.export(self.log_model, self.directory)
+        #entries written after the export are kept
+        Product.objects.create(name = 'new', description = 'new', price = 1, category = self.category)
+        self.assertEqual(archive.delete_exported(self.log_model, self.directory, manifest, chunk_size = 2), 5)
+        self.assertEqual(list(self.log_model.objects.values_list('name', flat = True)), ['new'])
+
+    def test_delete_exported_delta(self):
+        article = Article.objects.create(title = "Title", body = "Body")
+        article = Article.objects.get(pk = article.pk)
+        manifest = archive.export(Article.audit_log.model, self.directory)
+        article.status = "published"
+        article.save()
+        self.assertEqual(archive.delete_exported(Article.audit_log.model, self.directory, manifest), 1)
+        state = article.audit_log.get().object_state
+        self.assertEqual((state.title, state.body, state.status), ("Title", "Body", "published"))
+
+    def test_empty_export(self):
+        self.log_model.objects.all().delete()
+        manifest = archive.export(self.log_model, self.directory)
+        self.assertEqual(manifest['rows'], 0)
+        self.assertEqual(manifest['segments'], [])
+        self.assertEqual(archive.delete_exported(self.log_model, self.directory, manifest), 0)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('archive_audit_log', Product._meta.label, '--output', self.directory,
+                     '--segment-size', '3', '--delete', '--sleep', '0', stdout = out)
+        self.assertIn('exported 5 entries to 2 segments', out.getvalue())
+        self.assertIn('deleted 5 exported entries', out.getvalue())
+        self.assertEqual(self.log_model.objects.count(), 0)
+        self.assertEqual(len(archive.get_manifest_paths(self.directory, self.log_model)), 1)
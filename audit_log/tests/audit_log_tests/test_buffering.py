@@ -0,0 +1,177 @@
+from django.test import TestCase
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from audit_log import context
+from audit_log.buffering import buffered_atomic, get_buffer
+from .models import Article, Product, ProductCategory
+from .test_logging import _setup_admin
+
+
+class BufferedAtomicTest(TestCase):
+
+    def setUp(self):
+        self.category = ProductCategory.objects.create(name = "gadgets", description = "gadgetry")
+
+    def create_products(self, count):
+        return [self.category.product_set.create(name = "gadget %s"%i, description = "gadget", price = 100)
+                    for i in range(count)]
+
+    def log_inserts(self, queries):
+        table = Product.audit_log.model._meta.db_table
+        return [q for q in queries if q['sql'].startswith('INSERT INTO "%s"'%table)]
+
+    def test_single_insert(self):
+        with CaptureQueriesContext(connection) as queries:
+            with buffered_atomic():
+                products = self.create_products(10)
+                for product in products:
+                    product.price = 200
+                    product.save()
+                self.assertEqual(Product.audit_log.all().count(), 0)
+        self.assertEqual(len(self.log_inserts(queries.captured_queries)), 1)
+        self.assertEqual(Product.audit_log.filter(action_type = 'I').count(), 10)
+        self.assertEqual(Product.audit_log.filter(action_type = 'U').count(), 10)
+        self.assertEqual(products[0].audit_log.all()[0].price, 200)
+
+    def test_stamps_entries(self):
+        from django.contrib.auth import get_user_model
+        _setup_admin()
+        user = get_user_model().objects.all()[0]
+        token = context.set_context(user, None)
+        try:
+            with buffered_atomic():
+                self.create_products(2)
+        finally:
+            context.reset_context(token)
+        self.assertEqual(Product.audit_log.filter(action_user = user).count(), 2)
+
+    def test_rolled_back_savepoint(self):
+        with buffered_atomic():
+            self.create_products(1)
+            try:
+                with transaction.atomic():
+                    self.create_products(2)
+                    raise ValueError
+            except ValueError:
+                pass
+            self.create_products(1)
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(Product.audit_log.all().count(), 2)
+
+    def test_exception(self):
+        try:
+            with buffered_atomic():
+                self.create_products(2)
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(Product.audit_log.all().count(), 0)
+        self.assertIsNone(get_buffer())
+
+    def test_nested(self):
+        with buffered_atomic():
+            with buffered_atomic():
+                self.create_products(2)
+            self.assertEqual(Product.audit_log.all().count(), 0)
+        self.assertEqual(Product.audit_log.all().count(), 2)
+
+    def test_decorator(self):
+        @buffered_atomic
+        def create():
+            self.create_products(3)
+            self.assertIsNotNone(get_buffer())
+        create()
+        self.assertEqual(Product.audit_log.all().count(), 3)
+
+
+class CoalescingTest(TestCase):
+
+    def setUp(self):
+        self.category = ProductCategory.objects.create(name = "gadgets", description = "gadgetry")
+        self.product = self.category.product_set.create(name = "gadget", description = "gadget", price = 100)
+
+    def save_prices(self, product, *prices):
+        for price in prices:
+            product.price = price
+            product.save()
+
+    def test_updates_coalesced(self):
+        with buffered_atomic(coalesce = True):
+            self.save_prices(self.product, 110, 120, 130)
+        entries = self.product.audit_log.all()
+        self.assertEqual([e.action_type for e in entries], ['U', 'I'])
+        self.assertEqual(entries[0].price, 130)
+
+    def test_insert_then_updates(self):
+        with buffered_atomic(coalesce = True):
+            product = self.category.product_set.create(name = "widget", description = "widget", price = 1)
+            self.save_prices(product, 2, 3)
+        entries = product.audit_log.all()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0].action_type, 'I')
+        self.assertEqual(entries[0].price, 3)
+
+    def test_delete_wins(self):
+        pk = self.product.pk
+        with buffered_atomic(coalesce = True):
+            self.save_prices(self.product, 110)
+            self.product.delete()
+        self.assertEqual(list(Product.audit_log.filter(id = pk).values_list('action_type', flat = True)), ['D', 'I'])
+
+    def test_insert_then_delete(self):
+        with buffered_atomic(coalesce = True):
+            product = self.category.product_set.create(name = "widget", description = "widget", price = 1)
+            pk = product.pk
+            self.save_prices(product, 2)
+            product.delete()
+        self.assertFalse(Product.audit_log.filter(id = pk).exists())
+
+    def test_delete_then_insert(self):
+        pk = self.product.pk
+        with buffered_atomic(coalesce = True):
+            self.product.delete()
+            product = self.category.product_set.create(pk = pk, name = "widget", description = "widget", price = 1)
+            self.save_prices(product, 2)
+        entries = Product.audit_log.filter(id = pk).order_by('action_id')
+        self.assertEqual([(entry.action_type, entry.price) for entry in entries],
+                         [('I', 100), ('D', 100), ('I', 2)])
+
+    def test_one_entry_per_object(self):
+        with buffered_atomic(coalesce = True):
+            other = self.category.product_set.create(name = "widget", description = "widget", price = 1)
+            self.save_prices(self.product, 110, 120)
+            self.save_prices(other, 2, 3)
+        self.assertEqual(Product.audit_log.filter(action_type = 'U').count(), 1)
+        self.assertEqual(Product.audit_log.filter(action_type = 'I').count(), 2)
+
+    def test_rolled_back_savepoint(self):
+        with buffered_atomic(coalesce = True):
+            self.save_prices(self.product, 110)
+            try:
+                with transaction.atomic():
+                    self.save_prices(self.product, 120)
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertEqual(self.product.audit_log.all()[0].price, 110)
+
+    def test_delta_fields_merged(self):
+        article = Article.objects.create(title = "Title", body = "Body", status = "draft")
+        article = Article.objects.get(pk = article.pk)
+        with buffered_atomic(coalesce = True):
+            article.title = "New title"
+            article.save()
+            article.status = "published"
+            article.save()
+        entry = article.audit_log.all()[0]
+        self.assertEqual(entry.action_type, 'U')
+        self.assertEqual(entry.title, "New title")
+        self.assertEqual(entry.status, "published")
+        self.assertEqual(entry.body, None)
+        self.assertEqual(entry.object_state.body, "Body")
+
+    def test_not_coalesced_by_default(self):
+        with buffered_atomic():
+            self.save_prices(self.product, 110, 120)
+        self.assertEqual(self.product.audit_log.filter(action_type = 'U').count(), 2)
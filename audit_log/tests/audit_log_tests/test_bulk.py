@@ -0,0 +1,170 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db.models import F
+from django.test import TestCase
+
+from audit_log import context
+from audit_log.buffering import buffered_atomic
+from .models import Supplier
+
+
+class BulkOperationsTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('jane', 'jane@example.com', 'secret')
+
+    def create_suppliers(self, count):
+        return Supplier.objects.bulk_create([Supplier(name = 'supplier %s'%i) for i in range(count)])
+
+    def test_bulk_create_logged(self):
+        #one INSERT for the suppliers, one for the log entries
+        with self.assertNumQueries(2):
+            suppliers = self.create_suppliers(5)
+        self.assertEqual(Supplier.audit_log.filter(action_type = 'I').count(), 5)
+        self.assertEqual(suppliers[0].audit_log.get().name, 'supplier 0')
+
+    def test_ignore_conflicts(self):
+        existing = self.create_suppliers(1)[0]
+        Supplier.objects.bulk_create([Supplier(pk = existing.pk, name = 'dup'), Supplier(pk = 1000, name = 'new')],
+                                     ignore_conflicts = True)
+        self.assertEqual(Supplier.objects.get(pk = existing.pk).name, 'supplier 0')
+        self.assertEqual(list(existing.audit_log.values_list('action_type', 'name')), [('I', 'supplier 0')])
+        self.assertEqual(list(Supplier.audit_log.filter(id = 1000).values_list('action_type', 'name')),
+                         [('I', 'new')])
+
+    def test_update_conflicts(self):
+        existing = self.create_suppliers(1)[0]
+        Supplier.objects.bulk_create([Supplier(pk = existing.pk, name = 'renamed', rating = 4),
+                                      Supplier(pk = 1000, name = 'new')],
+                                     update_conflicts = True, unique_fields = ['id'], update_fields = ['name'])
+        self.assertEqual(list(existing.audit_log.order_by('action_id').values_list('action_type', 'name', 'rating')),
+                         [('I', 'supplier 0', 0), ('U', 'renamed', 0)])
+        self.assertEqual(list(Supplier.audit_log.filter(id = 1000).values_list('action_type', 'name')),
+                         [('I', 'new')])
+
+    def test_bulk_update_logged(self):
+        suppliers = self.create_suppliers(3)
+        for supplier in suppliers:
+            supplier.rating = 5
+        Supplier.objects.bulk_update(suppliers, ['rating'])
+        updates = Supplier.audit_log.filter(action_type = 'U')
+        self.assertEqual(updates.count(), 3)
+        self.assertEqual(set(updates.values_list('rating', flat = True)), set([5]))
+
+    def test_stamps_from_context(self):
+        token = context.set_context(self.user, 'session')
+        try:
+            suppliers = self.create_suppliers(2)
+            suppliers[0].rating = 3
+            Supplier.objects.bulk_update(suppliers[:1], ['rating'])
+        finally:
+            context.reset_context(token)
+        supplier = Supplier.objects.get(pk = suppliers[0].pk)
+        self.assertEqual(supplier.created_by, self.user)
+        self.assertEqual(supplier.modified_by, self.user)
+        self.assertEqual(supplier.created_with_session_key, 'session')
+        self.assertEqual(Supplier.audit_log.filter(action_user = self.user).count(), 3)
+
+    def test_no_context_keeps_stamps(self):
+        token = context.set_context(self.user, 'session')
+        try:
+            suppliers = self.create_suppliers(1)
+        finally:
+            context.reset_context(token)
+        suppliers[0].rating = 1
+        Supplier.objects.bulk_update(suppliers, ['rating'])
+        self.assertEqual(Supplier.objects.get().modified_by, self.user)
+
+    def test_disabled_tracking(self):
+        suppliers = [Supplier(name = 'tracked'), Supplier(name = 'untracked')]
+        suppliers[1].audit_log.disable_tracking()
+        Supplier.objects.bulk_create(suppliers)
+        self.assertEqual(list(Supplier.audit_log.values_list('name', flat = True)), ['tracked'])
+
+    def test_buffered(self):
+        with buffered_atomic():
+            self.create_suppliers(2)
+            self.assertEqual(Supplier.audit_log.count(), 0)
+        self.assertEqual(Supplier.audit_log.count(), 2)
+
+
+class QuerySetOperationsTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('jane', 'jane@example.com', 'secret')
+        Supplier.objects.bulk_create([Supplier(name = 'supplier %s'%i, rating = i % 2) for i in range(6)])
+
+    def log_inserts(self, queries):
+        table = Supplier.audit_log.model._meta.db_table
+        return [q for q in queries if q['sql'].startswith('INSERT INTO "%s"'%table)]
+
+    def test_update_logged(self):
+        #one INSERT ... SELECT and the UPDATE
+        with self.assertNumQueries(2):
+            rows = Supplier.objects.filter(rating = 0).update(rating = 5)
+        self.assertEqual(rows, 3)
+        updates = Supplier.audit_log.filter(action_type = 'U')
+        self.assertEqual(updates.count(), 3)
+        self.assertEqual(set(updates.values_list('rating', flat = True)), set([5]))
+        self.assertEqual(set(updates.values_list('id', flat = True)),
+                         set(Supplier.objects.filter(rating = 5).values_list('id', flat = True)))
+
+    def test_rows_locked(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        #SQLite has no FOR UPDATE, a comment takes its place
+        with mock.patch.object(connection.features, 'has_select_for_update', True), \
+                mock.patch.object(connection.ops, 'for_update_sql', return_value = '/* FOR UPDATE */'), \
+                CaptureQueriesContext(connection) as queries:
+            Supplier.objects.filter(rating = 0).update(rating = 5)
+            Supplier.objects.filter(rating = 1).delete()
+        sqls = [query['sql'] for query in queries.captured_queries]
+        locks = [i for i, sql in enumerate(sqls) if '/* FOR UPDATE */' in sql]
+        inserts = [sqls.index(query['sql']) for query in self.log_inserts(queries.captured_queries)]
+        #the matched rows are locked before they are logged
+        self.assertEqual(len(locks), 2)
+        self.assertEqual(len(inserts), 2)
+        self.assertTrue(locks[0] < inserts[0] < locks[1] < inserts[1])
+        self.assertEqual(Supplier.audit_log.filter(action_type__in = ['U', 'D']).count(), 6)
+
+    def test_update_expression(self):
+        Supplier.objects.update(rating = F('rating') + 10)
+        for supplier in Supplier.objects.all():
+            entry = supplier.audit_log.all()[0]
+            self.assertEqual(entry.action_type, 'U')
+            self.assertEqual(entry.rating, supplier.rating)
+            self.assertEqual(entry.name, supplier.name)
+
+    def test_update_foreign_key(self):
+        Supplier.objects.filter(rating = 1).update(created_by = self.user)
+        self.assertEqual(Supplier.audit_log.filter(action_type = 'U', created_by = self.user).count(), 3)
+
+    def test_update_stamps_from_context(self):
+        token = context.set_context(self.user, 'session')
+        try:
+            Supplier.objects.filter(rating = 1).update(name = 'renamed')
+        finally:
+            context.reset_context(token)
+        self.assertEqual(Supplier.objects.filter(modified_by = self.user).count(), 3)
+        updates = Supplier.audit_log.filter(action_type = 'U')
+        self.assertEqual(updates.filter(action_user = self.user, modified_by = self.user,
+                                        modified_with_session_key = 'session').count(), 3)
+
+    def test_delete_single_insert(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as queries:
+            deleted, counts = Supplier.objects.filter(rating = 0).delete()
+        self.assertEqual(deleted, 3)
+        self.assertEqual(len(self.log_inserts(queries.captured_queries)), 1)
+        deletes = Supplier.audit_log.filter(action_type = 'D')
+        self.assertEqual(deletes.count(), 3)
+        self.assertEqual(set(deletes.values_list('name', flat = True)),
+                         set(['supplier 0', 'supplier 2', 'supplier 4']))
+
+    def test_instance_delete_logged(self):
+        Supplier.objects.filter(rating = 0).delete()
+        supplier = Supplier.objects.all()[0]
+        supplier.delete()
+        self.assertEqual(Supplier.audit_log.filter(action_type = 'D').count(), 4)
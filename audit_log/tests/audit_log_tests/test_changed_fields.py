@@ -0,0 +1,98 @@
+import copy
+
+from django.db import connection
+from django.db.migrations.state import ModelState, ProjectState
+from django.test import TestCase
+
+from audit_log.buffering import buffered_atomic
+from audit_log.models.managers import AuditLog, check_bit_order
+from .models import Offer, Product
+
+
+class ChangedFieldsTest(TestCase):
+
+    def setUp(self):
+        self.offer = Offer.objects.create(title = "Lamp", price = 10)
+
+    def get_masks(self):
+        return [(entry.action_type, entry.changed_fields)
+                for entry in Offer.audit_log.order_by('action_id')]
+
+    def test_masks(self):
+        offer = Offer.objects.get(pk = self.offer.pk)
+        offer.price = 12
+        offer.save()
+        offer.title = "Desk lamp"
+        offer.status = "closed"
+        offer.save()
+        offer.delete()
+        self.assertEqual(self.get_masks(), [('I', 0b1111), ('U', 0b0100), ('U', 0b1010), ('D', 0)])
+
+    def get_state(self, help_text):
+        model_state = ModelState.from_model(Offer.audit_log.model)
+        field = copy.copy(model_state.fields['changed_fields'])
+        field.help_text = help_text
+        model_state.fields['changed_fields'] = field
+        state = ProjectState()
+        state.add_model(model_state)
+        return state
+
+    def test_bit_order_recorded(self):
+        field = Offer.audit_log.model._meta.get_field('changed_fields')
+        self.assertEqual(field.help_text, 'Bits of the tracked fields: id, title, price, status')
+        #no migrations in the test app
+        self.assertEqual(check_bit_order(), [])
+
+    def test_bit_order_check(self):
+        audit_log = Offer.audit_log.audit_log
+        self.assertEqual(audit_log.check_bit_order(self.get_state(
+            'Bits of the tracked fields: id, title, price, status')), [])
+        #fields added after the recorded ones keep the old bits
+        self.assertEqual(audit_log.check_bit_order(self.get_state('Bits of the tracked fields: id, title')), [])
+        errors = audit_log.check_bit_order(self.get_state('Bits of the tracked fields: id, price, title, status'))
+        self.assertEqual([error.id for error in errors], ['audit_log.E001'])
+
+    def test_unknown_originals(self):
+        Offer(pk = self.offer.pk, title = "Lamp", price = 11).save()
+        self.assertEqual(self.get_masks()[-1], ('U', 0b1111))
+
+    def test_queryset_update(self):
+        Offer.objects.filter(pk = self.offer.pk).update(price = 20)
+        self.assertEqual(self.get_masks()[-1], ('U', 0b0100))
+
+    def test_coalesced(self):
+        offer = Offer.objects.get(pk = self.offer.pk)
+        with buffered_atomic(coalesce = True):
+            offer.price = 12
+            offer.save()
+            offer.status = "closed"
+            offer.save()
+        self.assertEqual(self.get_masks()[-1], ('U', 0b1100))
+
+    def test_changed(self):
+        offer = Offer.objects.get(pk = self.offer.pk)
+        offer.title = "Desk lamp"
+        offer.save()
+        offer.price = 12
+        offer.save()
+        self.assertEqual([entry.price for entry in Offer.audit_log.changed('price').order_by('action_id')],
+                         [10, 12])
+        self.assertEqual(Offer.audit_log.changed('title', 'status').count(), 2)
+        self.assertEqual(offer.audit_log.changed('price').filter(action_type = 'U').count(), 1)
+        self.assertEqual(offer.audit_log.with_changes()[0].changes, 0b0100)
+
+    def test_changed_needs_column(self):
+        self.assertRaises(ValueError, Product.audit_log.changed, 'price')
+        self.assertRaises(ValueError, AuditLog, capture = 'triggers', changed_fields = True)
+
+    def test_changed_index(self):
+        index = Offer.audit_log.model._meta.indexes[-1]
+        self.assertTrue(index.name.endswith('_chg'))
+        self.assertLessEqual(len(index.name), 30)
+        if connection.vendor != 'sqlite':
+            return
+        sql, params = Offer.audit_log.changed('price').values_list('action_id').query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertIn(index.name, plan)
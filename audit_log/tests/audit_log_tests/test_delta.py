@@ -0,0 +1,151 @@
+from django.db import DatabaseError, transaction
+from django.test import TestCase
+from django.utils import timezone
+
+from .models import Article, Tag
+
+
+class DeltaModeTest(TestCase):
+
+    def setUp(self):
+        self.article = Article.objects.create(title = "Title", body = "Long body", status = "draft")
+
+    def test_insert_is_full(self):
+        entry = self.article.audit_log.all()[0]
+        self.assertEqual(entry.action_type, 'I')
+        self.assertEqual(entry.title, "Title")
+        self.assertEqual(entry.body, "Long body")
+        self.assertEqual(entry.changed_fields, 0b1111)
+
+    def test_update_stores_changed_fields(self):
+        article = Article.objects.get(pk = self.article.pk)
+        article.status = "published"
+        article.save()
+        entry = article.audit_log.all()[0]
+        self.assertEqual(entry.action_type, 'U')
+        self.assertEqual(entry.id, article.pk)
+        self.assertEqual(entry.status, "published")
+        self.assertEqual(entry.title, None)
+        self.assertEqual(entry.body, None)
+        self.assertEqual(entry.changed_fields, 0b1000)
+
+    def test_rebuild_state(self):
+        article = Article.objects.get(pk = self.article.pk)
+        article.status = "published"
+        article.save()
+        article.title = "New title"
+        article.save()
+        first, second = article.audit_log.order_by('action_id')[1:3]
+        self.assertEqual(second.changed_fields, 0b0010)
+        state = second.object_state
+        self.assertEqual(state.title, "New title")
+        self.assertEqual(state.body, "Long body")
+        self.assertEqual(state.status, "published")
+        state = first.object_state
+        self.assertEqual(state.title, "Title")
+        self.assertEqual(state.status, "published")
+
+    def test_deferred_fields_not_loaded(self):
+        article = Article.objects.only('title').get(pk = self.article.pk)
+        article.title = "New title"
+        #UPDATE of the loaded field and INSERT of the entry
+        with self.assertNumQueries(2):
+            article.save()
+        entry = article.audit_log.all()[0]
+        self.assertEqual(entry.changed_fields, 0b0010)
+        self.assertEqual(entry.object_state.body, "Long body")
+
+    def test_unknown_originals_is_full(self):
+        article = Article(pk = self.article.pk, title = "Other", body = "Other body", status = "draft")
+        article.save()
+        entry = article.audit_log.all()[0]
+        self.assertEqual(entry.action_type, 'U')
+        self.assertEqual(entry.changed_fields, 0b1111)
+        self.assertEqual(entry.body, "Other body")
+
+    def test_delete_is_full(self):
+        article = Article.objects.get(pk = self.article.pk)
+        article.delete()
+        entry = Article.audit_log.all()[0]
+        self.assertEqual(entry.action_type, 'D')
+        self.assertEqual(entry.body, "Long body")
+        self.assertEqual(entry.object_state.title, "Title")
+
+
+    def test_record_object_state(self):
+        article = Article.objects.get(pk = self.article.pk)
+        article.status = 'published'
+        article.save()
+        record = next(article.audit_log.records())
+        self.assertEqual(record.body, None)
+        self.assertEqual(record.object_state.body, self.article.body)
+        self.assertEqual(record.object_state.status, 'published')
+
+    def test_rolled_back_save(self):
+        article = Article.objects.get(pk = self.article.pk)
+        article.status = 'published'
+        try:
+            with transaction.atomic():
+                article.save()
+                raise DatabaseError
+        except DatabaseError:
+            pass
+        article.title = "New title"
+        article.save()
+        entry = article.audit_log.all()[0]
+        self.assertEqual(entry.changed_fields, 0b1010)
+        self.assertEqual(entry.object_state.status, 'published')
+        self.assertEqual(article.audit_log.as_of(timezone.now()).status, 'published')
+
+
+class SkipUnchangedTest(TestCase):
+
+    def setUp(self):
+        self.tag = Tag.objects.create(name = "django", description = "web framework")
+
+    def test_skip_loaded_unchanged(self):
+        skipped = Tag.audit_log.skipped_writes()
+        tag = Tag.objects.get(pk = self.tag.pk)
+        #only the UPDATE, no log entry
+        with self.assertNumQueries(1):
+            tag.save()
+        self.assertEqual(tag.audit_log.all().count(), 1)
+        self.assertEqual(Tag.audit_log.skipped_writes(), skipped + 1)
+
+    def test_skip_after_logged_save(self):
+        self.tag.name = "python"
+        self.tag.save()
+        self.tag.save()
+        self.assertEqual(self.tag.audit_log.all().count(), 2)
+        self.assertEqual(self.tag.audit_log.all()[0].name, "python")
+
+    def test_changed_is_logged(self):
+        tag = Tag.objects.get(pk = self.tag.pk)
+        tag.description = "python web framework"
+        tag.save()
+        self.assertEqual(tag.audit_log.all().count(), 2)
+        self.assertEqual(tag.audit_log.all()[0].action_type, 'U')
+
+    def test_unknown_originals_logged(self):
+        tag = Tag(pk = self.tag.pk, name = "django", description = "web framework")
+        tag.save()
+        self.assertEqual(tag.audit_log.all().count(), 2)
+
+    def test_delete_logged(self):
+        tag = Tag.objects.get(pk = self.tag.pk)
+        tag.delete()
+        self.assertEqual(Tag.audit_log.filter(action_type = 'D').count(), 1)
+
+    def test_logged_after_rolled_back_save(self):
+        tag = Tag.objects.get(pk = self.tag.pk)
+        tag.name = "python"
+        try:
+            with transaction.atomic():
+                tag.save()
+                raise DatabaseError
+        except DatabaseError:
+            pass
+        #the row still holds the loaded values, saving again changes it
+        tag.save()
+        self.assertEqual(tag.audit_log.all().count(), 2)
+        self.assertEqual(tag.audit_log.all()[0].name, "python")
@@ -1,7 +1,12 @@
+import threading
+
 from django.test import TestCase
 from django.db import models
+from django.db.models import signals
+from audit_log import context
 from .models import (Product, WarehouseEntry, ProductCategory, ExtremeWidget,
-                        SaleInvoice, Employee, ProductRating, Property, PropertyOwner)
+                        SaleInvoice, Employee, ProductRating, Property, PropertyOwner,
+                        ProductReview)
 from .views import (index, rate_product, CategoryCreateView, ProductCreateView,
                     ProductDeleteView, ProductUpdateView, ExtremeWidgetCreateView,
                     PropertyOwnerCreateView, PropertyCreateView, PropertyUpdateView,
@@ -116,6 +121,87 @@ class TrackingAuthFieldsTest(TestCase):
         self.assertEqual(product.productrating_set.all().count(), 1)
         self.assertEqual(product.productrating_set.all()[0].user, None)
 
+    def test_receivers_not_connected_per_request(self):
+        pre_save_receivers = len(signals.pre_save.receivers)
+        post_save_receivers = len(signals.post_save.receivers)
+        c = Client()
+        c.post('/rate/1/', {'rating': 4})
+        self.assertEqual(len(signals.pre_save.receivers), pre_save_receivers)
+        self.assertEqual(len(signals.post_save.receivers), post_save_receivers)
+        self.assertIsNone(context.get_context())
+
+    def test_context_isolated_per_thread(self):
+        seen = []
+        token = context.set_context(None, 'main-session')
+        try:
+            thread = threading.Thread(target = lambda: seen.append(context.get_context()))
+            thread.start()
+            thread.join()
+            self.assertEqual(context.get_context().session, 'main-session')
+        finally:
+            context.reset_context(token)
+        self.assertEqual(seen, [None])
+
+
+class AuthStampedModelTest(TestCase):
+
+    def setUp(self):
+        _setup_admin()
+        category  = ProductCategory.objects.create(name = "gadgets", description = "gadgetry")
+        self.product = category.product_set.create(name = "new gadget", description = "best gadget eva", price = 100)
+        from django.contrib.auth import get_user_model
+        self.user = get_user_model().objects.all()[0]
+
+    def test_create_is_single_insert(self):
+        token = context.set_context(self.user, 'session-key')
+        try:
+            #one INSERT for the review and one for its audit log entry
+            with self.assertNumQueries(2):
+                review = ProductReview.objects.create(product = self.product, text = "great")
+        finally:
+            context.reset_context(token)
+        review = ProductReview.objects.get(pk = review.pk)
+        self.assertEqual(review.created_by, self.user)
+        self.assertEqual(review.created_with_session_key, 'session-key')
+        self.assertEqual(review.modified_by, self.user)
+        self.assertEqual(review.audit_log.all().count(), 1)
+        self.assertEqual(review.audit_log.all()[0].created_by, self.user)
+
+    def test_update_keeps_creation_stamps(self):
+        review = ProductReview.objects.create(product = self.product, text = "great")
+        token = context.set_context(self.user, 'session-key')
+        try:
+            with self.assertNumQueries(2):
+                review.save()
+        finally:
+            context.reset_context(token)
+        review = ProductReview.objects.get(pk = review.pk)
+        self.assertEqual(review.created_by, None)
+        self.assertEqual(review.modified_by, self.user)
+        self.assertEqual(review.modified_with_session_key, 'session-key')
+
+    def test_update_by_pk_keeps_creation_stamps(self):
+        from django.contrib.auth import get_user_model
+        other = get_user_model().objects.create_user('other', 'other@example.com', 'other')
+        token = context.set_context(self.user, 'session-key')
+        try:
+            review = ProductReview.objects.create(product = self.product, text = "great")
+        finally:
+            context.reset_context(token)
+        token = context.set_context(other, 'other-session')
+        try:
+            #saving a hand built instance with an existing pk is an UPDATE
+            ProductReview(pk = review.pk, product = self.product, text = "better",
+                          created_by = review.created_by,
+                          created_with_session_key = review.created_with_session_key).save()
+        finally:
+            context.reset_context(token)
+        review = ProductReview.objects.get(pk = review.pk)
+        self.assertEqual(review.text, "better")
+        self.assertEqual(review.created_by, self.user)
+        self.assertEqual(review.created_with_session_key, 'session-key')
+        self.assertEqual(review.modified_by, other)
+
 
 class TrackingChangesTest(TestCase):
     urls = __name__
@@ -1,7 +1,15 @@
+import datetime
+from unittest import mock
+
+import django
 from django.test import TestCase
-from django.db import models
+from django.utils import timezone
+from django.db import connection, models
+from audit_log import registration
+from audit_log.models.managers import disable_tracking, enable_tracking
 from .models import (Product, WarehouseEntry, ProductCategory, ExtremeWidget,
-                        SaleInvoice, Employee, ProductRating, Property, PropertyOwner)
+                        SaleInvoice, Employee, ProductRating, Property, PropertyOwner,
+                        ProductReview, Article)
 
 
 class DisablingTrackingTest(TestCase):
@@ -39,3 +47,279 @@ class DisablingTrackingTest(TestCase):
         c1.audit_log.disable_tracking()
         c1.delete()
         self.assertEquals(ProductCategory.audit_log.all().count(), 3)
+
+    def test_disable_enable_all_managers(self):
+        c1 = ProductCategory.objects.create(name = 'test category', description = 'test')
+        disable_tracking(c1)
+        self.assertFalse(c1.audit_log.is_tracking_enabled())
+        c1.description = 'best'
+        c1.save()
+        self.assertEqual(c1.audit_log.all().count(), 1)
+        enable_tracking(c1)
+        self.assertTrue(c1.audit_log.is_tracking_enabled())
+        c1.save()
+        self.assertEqual(c1.audit_log.all().count(), 2)
+
+    def test_disable_untracked_model(self):
+        owner = PropertyOwner.objects.create(name = 'John Dory')
+        disable_tracking(owner)
+        enable_tracking(owner)
+
+
+class AuditPlanTest(TestCase):
+
+    def test_stamp_fields(self):
+        plan = registration.get_plan(ProductReview)
+        self.assertEqual(plan.last_user, ('modified_by',))
+        self.assertEqual(plan.last_session, ('modified_with_session_key',))
+        self.assertEqual(plan.creating_user, ('created_by',))
+        self.assertEqual(plan.creating_session, ('created_with_session_key',))
+        self.assertEqual(registration.get_plan(ProductRating).last_user, ('user',))
+        self.assertIsNone(registration.get_plan(PropertyOwner))
+
+    def test_logs(self):
+        plan = registration.get_plan(SaleInvoice)
+        self.assertEqual(len(plan.logs), 1)
+        self.assertEqual(plan.logs[0].log_entry_model, SaleInvoice.audit_log.model)
+        self.assertEqual(plan.logs[0].attnames, ('id',))
+        self.assertEqual(registration.get_plan(Product).logs[0].attnames,
+                         ('id', 'name', 'description', 'price', 'category_id'))
+
+    def test_log_entry_plan(self):
+        plan = registration.get_plan(Product.audit_log.model)
+        self.assertEqual(plan.last_user, ('action_user',))
+        self.assertEqual(plan.logs, ())
+
+
+class RecordsTest(TestCase):
+
+    def setUp(self):
+        self.category = ProductCategory.objects.create(name = 'gadgets', description = 'gadgets')
+        self.product = Product.objects.create(name = 'widget', description = 'a widget',
+                                                price = 10, category = self.category)
+        self.product.price = 12
+        self.product.save()
+
+    def test_records_match_entries(self):
+        entries = list(self.product.audit_log.all())
+        records = list(self.product.audit_log.records())
+        self.assertEqual(len(records), 2)
+        for entry, record in zip(entries, records):
+            self.assertEqual(record.action_id, entry.action_id)
+            self.assertEqual(record.action_type, entry.action_type)
+            self.assertEqual(record.category_id, 'gadgets')
+        self.assertEqual(records[0].price, 12)
+
+    def test_records_are_slotted(self):
+        record = next(Product.audit_log.records())
+        self.assertFalse(hasattr(record, '__dict__'))
+        self.assertRaises(AttributeError, setattr, record, 'name', 'gadget')
+
+    def test_records_filtered(self):
+        records = list(Product.audit_log.filter(action_type = 'I').records(chunk_size = 1))
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0].action_type, 'I')
+
+    def test_object_state(self):
+        record = next(self.product.audit_log.records())
+        with self.assertNumQueries(0):
+            state = record.object_state
+        self.assertIsInstance(state, Product)
+        self.assertEqual(state.pk, self.product.pk)
+        self.assertEqual(state.price, 12)
+
+
+class IndexesTest(TestCase):
+
+    def get_index_fields(self, model):
+        return [tuple(index.fields) for index in model.audit_log.model._meta.indexes]
+
+    def test_history_index(self):
+        self.assertEqual(self.get_index_fields(Product), [('id', '-action_date')])
+        self.assertEqual(self.get_index_fields(ProductCategory), [('name', '-action_date')])
+        #covered by the history index
+        self.assertFalse(Product.audit_log.model._meta.get_field('id').db_index)
+
+    def test_extra_indexes(self):
+        self.assertEqual(self.get_index_fields(ProductReview),
+                         [('id', '-action_date'), ('action_user', 'action_date')])
+        names = [index.name for index in ProductReview.audit_log.model._meta.indexes]
+        self.assertTrue(all(names))
+        self.assertEqual(len(set(names)), 2)
+
+    def test_history_query_uses_index(self):
+        if connection.vendor != 'sqlite':
+            return
+        product = Product.objects.create(name = 'widget', description = 'widget', price = 1,
+                                         category = ProductCategory.objects.create(name = 'c', description = 'c'))
+        with connection.cursor() as cursor:
+            sql, params = product.audit_log.all()[:10].query.sql_with_params()
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertIn('USING INDEX', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+class HistoryTestCase(TestCase):
+
+    def setUp(self):
+        self.day = datetime.datetime(2024, 3, 1, tzinfo = datetime.timezone.utc)
+        self.category = ProductCategory.objects.create(name = 'gadgets', description = 'gadgets')
+
+    def date_latest(self, model, days):
+        #move the latest entry to a known date
+        log_model = model.audit_log.model
+        latest = log_model.objects.order_by('-action_id')[0]
+        log_model.objects.filter(action_id = latest.action_id).update(
+            action_date = self.day + datetime.timedelta(days = days))
+
+
+class AsOfTest(HistoryTestCase):
+
+    def test_full_mode(self):
+        product = Product.objects.create(name = 'widget', description = 'a widget',
+                                         price = 10, category = self.category)
+        self.date_latest(Product, 0)
+        product.price = 12
+        product.save()
+        self.date_latest(Product, 2)
+        self.assertIsNone(product.audit_log.as_of(self.day - datetime.timedelta(days = 1)))
+        with self.assertNumQueries(1):
+            state = product.audit_log.as_of(self.day + datetime.timedelta(days = 1))
+        self.assertIsInstance(state, Product)
+        self.assertEqual(state.pk, product.pk)
+        self.assertEqual(state.price, 10)
+        self.assertEqual(product.audit_log.as_of(self.day + datetime.timedelta(days = 2)).price, 12)
+        self.assertEqual(product.audit_log.as_of(timezone.now()).price, 12)
+
+    def test_deleted(self):
+        product = Product.objects.create(name = 'widget', description = 'a widget',
+                                         price = 10, category = self.category)
+        self.date_latest(Product, 0)
+        Product.objects.get(pk = product.pk).delete()
+        self.date_latest(Product, 2)
+        self.assertEqual(product.audit_log.as_of(self.day + datetime.timedelta(days = 1)).price, 10)
+        self.assertIsNone(product.audit_log.as_of(self.day + datetime.timedelta(days = 2)))
+
+    def test_delta_mode(self):
+        article = Article.objects.create(title = "Title", body = "Long body", status = "draft")
+        self.date_latest(Article, 0)
+        article = Article.objects.get(pk = article.pk)
+        article.status = "published"
+        article.save()
+        self.date_latest(Article, 1)
+        article.title = "New title"
+        article.save()
+        self.date_latest(Article, 2)
+        #the delta entries and the insert they build on are read with one query
+        with self.assertNumQueries(1):
+            state = article.audit_log.as_of(self.day + datetime.timedelta(days = 1))
+        self.assertEqual(state.pk, article.pk)
+        self.assertEqual(state.title, "Title")
+        self.assertEqual(state.body, "Long body")
+        self.assertEqual(state.status, "published")
+        state = article.audit_log.as_of(self.day + datetime.timedelta(days = 2))
+        self.assertEqual(state.title, "New title")
+        self.assertEqual(state.status, "published")
+
+    def test_class_manager(self):
+        self.assertRaises(ValueError, Product.audit_log.as_of, self.day)
+
+
+class SnapshotAsOfTest(HistoryTestCase):
+
+    def setUp(self):
+        super(SnapshotAsOfTest, self).setUp()
+        self.products = [Product.objects.create(name = 'widget %s'%i, description = 'a widget',
+                                                price = 10, category = self.category)
+                         for i in range(3)]
+        Product.audit_log.model.objects.update(action_date = self.day)
+        first, second, third = self.products
+        first.price = 12
+        first.save()
+        self.date_latest(Product, 2)
+        Product.objects.get(pk = second.pk).delete()
+        self.date_latest(Product, 2)
+        third.price = 15
+        third.save()
+        self.date_latest(Product, 4)
+
+    def get_snapshot(self, days):
+        entries = Product.audit_log.snapshot_as_of(self.day + datetime.timedelta(days = days))
+        return dict((entry.object_state.pk, entry.object_state.price)
+                    for entry in entries.iterator())
+
+    def check_snapshots(self):
+        first, second, third = [product.pk for product in self.products]
+        self.assertEqual(self.get_snapshot(-1), {})
+        self.assertEqual(self.get_snapshot(1), {first: 10, second: 10, third: 10})
+        self.assertEqual(self.get_snapshot(3), {first: 12, third: 10})
+        self.assertEqual(self.get_snapshot(4), {first: 12, third: 15})
+
+    def test_snapshot(self):
+        self.check_snapshots()
+
+    def test_snapshot_without_window_filtering(self):
+        with mock.patch.object(django, 'VERSION', (4, 1, 0, 'final', 0)):
+            self.check_snapshots()
+
+    def test_snapshot_is_lazy(self):
+        with self.assertNumQueries(0):
+            entries = Product.audit_log.snapshot_as_of(self.day)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(list(entries.records())), 3)
+
+
+class WithChangesTest(TestCase):
+
+    def setUp(self):
+        self.category = ProductCategory.objects.create(name = 'gadgets', description = 'gadgets')
+
+    def get_changes(self, manager):
+        return [(entry.action_type, manager.get_changed_attnames(entry.changes))
+                for entry in manager.with_changes().order_by('action_id')]
+
+    def test_changes(self):
+        product = Product.objects.create(name = 'widget', description = 'a widget',
+                                         price = 10, category = self.category)
+        other = Product.objects.create(name = 'other', description = 'other',
+                                       price = 5, category = self.category)
+        product.price = 12
+        product.save()
+        other.name = 'gadget'
+        other.save()
+        product.name = 'gizmo'
+        product.description = 'a gizmo'
+        product.save()
+        product.save()
+        Product.objects.get(pk = product.pk).delete()
+        self.assertEqual(self.get_changes(product.audit_log), [
+            ('I', ('id', 'name', 'description', 'price', 'category_id')),
+            ('U', ('price',)),
+            ('U', ('name', 'description')),
+            ('U', ()),
+            ('D', ()),
+        ])
+        self.assertEqual(self.get_changes(other.audit_log), [
+            ('I', ('id', 'name', 'description', 'price', 'category_id')),
+            ('U', ('name',)),
+        ])
+
+    def test_null_values(self):
+        review = ProductReview.objects.create(
+            product = Product.objects.create(name = 'widget', description = 'a widget',
+                                             price = 10, category = self.category),
+            text = 'fine')
+        review.text = 'great'
+        review.save()
+        entry = review.audit_log.with_changes().order_by('-action_id')[0]
+        self.assertIsNone(entry.modified_by_id)
+        self.assertEqual(ProductReview.audit_log.get_changed_attnames(entry.changes), ('text',))
+
+    def test_delta_mode(self):
+        article = Article.objects.create(title = "Title", body = "Long body", status = "draft")
+        article = Article.objects.get(pk = article.pk)
+        article.status = "published"
+        article.save()
+        changes = [entry.changes for entry in article.audit_log.with_changes().order_by('action_id')]
+        self.assertEqual(changes, [0b1111, 0b1000])
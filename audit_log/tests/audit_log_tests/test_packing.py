@@ -0,0 +1,91 @@
+import datetime
+import json
+import zlib
+
+from django.core.exceptions import FieldDoesNotExist
+from django.test import TestCase
+from django.utils import timezone
+
+from audit_log import archive
+from audit_log.models.managers import AuditLog
+from audit_log.storage import pack_snapshot, unpack_snapshot
+from .models import Document, Memo, ProductCategory
+
+
+class PackingTest(TestCase):
+
+    def setUp(self):
+        self.category = ProductCategory.objects.create(name = "Manuals")
+        self.published = datetime.datetime(2026, 3, 1, 12, 30, 15, 250, tzinfo = datetime.timezone.utc)
+        self.document = Document.objects.create(title = "Guide", category = self.category,
+                                                body = "Lorem ipsum " * 500, metadata = {'lang' : 'en'},
+                                                published = self.published)
+
+    def test_columns(self):
+        self.assertEqual(Document.audit_log.audit_log.packed_attnames,
+                         ('body', 'metadata', 'pages', 'published'))
+        log_meta = Document.audit_log.model._meta
+        self.assertEqual(set(field.attname for field in log_meta.concrete_fields),
+                         set(['id', 'title', 'category_id', 'action_id', 'action_date', 'action_user_id',
+                              'action_type', 'changed_fields', 'packed_fields']))
+        self.assertRaises(FieldDoesNotExist, Memo.audit_log.model._meta.get_field, 'body')
+        Memo.audit_log.model._meta.get_field('subject')
+
+    def test_stable(self):
+        self.assertEqual(pack_snapshot({'b' : 1, 'a' : [2]}), pack_snapshot({'a' : [2], 'b' : 1}))
+        self.assertEqual(zlib.decompress(pack_snapshot({'b' : 1, 'a' : None})), b'{"a":null,"b":1}')
+        self.assertEqual(unpack_snapshot(pack_snapshot({'a' : "x"})), {'a' : "x"})
+
+    def test_compressed(self):
+        entry = self.document.audit_log.get()
+        self.assertLess(len(entry.packed_fields), 200)
+        self.assertEqual(entry.title, "Guide")
+
+    def test_object_state(self):
+        self.document.pages = 3
+        self.document.save()
+        entry = self.document.audit_log.all()[0]
+        self.assertEqual(Document.audit_log.get_changed_attnames(entry.changed_fields), ('pages',))
+        state = entry.object_state
+        self.assertEqual((state.title, state.category_id, state.pages), ("Guide", self.category.pk, 3))
+        self.assertEqual(state.body, self.document.body)
+        self.assertEqual(state.metadata, {'lang' : 'en'})
+        self.assertEqual(state.published, self.published)
+        self.assertEqual(self.document.audit_log.as_of(timezone.now()).pages, 3)
+        self.assertEqual(self.document.audit_log.changed('pages').count(), 2)
+
+    def test_records(self):
+        record = next(self.document.audit_log.records())
+        self.assertFalse(hasattr(record, 'body'))
+        self.assertEqual(record.object_state.body, self.document.body)
+        self.assertEqual(record.object_state.published, self.published)
+
+    def test_queryset_update(self):
+        Document.objects.filter(pk = self.document.pk).update(pages = 7, body = "Short")
+        entry = self.document.audit_log.all()[0]
+        self.assertEqual((entry.action_type, entry.object_state.pages, entry.object_state.body),
+                         ('U', 7, "Short"))
+
+    def test_delete(self):
+        pk = self.document.pk
+        self.document.delete()
+        entry = Document.audit_log.filter(id = pk)[0]
+        self.assertEqual((entry.action_type, entry.object_state.body), ('D', self.document.body))
+
+    def test_listed_fields(self):
+        memo = Memo.objects.create(subject = "Hello", body = "World")
+        state = memo.audit_log.get().object_state
+        self.assertEqual((state.subject, state.body), ("Hello", "World"))
+        self.assertRaises(ValueError, memo.audit_log.with_changes)
+
+    def test_archive(self):
+        row = [self.document.audit_log.values_list('packed_fields', flat = True).get()]
+        encoded = json.loads(json.dumps(row, cls = archive.ArchiveJSONEncoder))[0]
+        self.assertEqual(Memo.audit_log.model._meta.get_field('packed_fields').to_python(encoded), bytes(row[0]))
+
+    def test_options(self):
+        self.assertRaises(ValueError, AuditLog, pack = True, mode = 'delta')
+        self.assertRaises(ValueError, AuditLog, pack = True, capture = 'triggers')
+        self.assertRaises(ValueError, AuditLog, pack = True, storage = 'unified')
+        audit_log = AuditLog(pack = ['id'])
+        self.assertRaises(ValueError, audit_log.get_packed_attnames, Memo)
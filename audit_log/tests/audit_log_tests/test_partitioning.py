@@ -0,0 +1,119 @@
+import datetime
+from io import StringIO
+from unittest import skipUnless
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from audit_log import partitioning, triggers
+from audit_log.models.managers import AuditLog
+from .models import Coupon, Payment
+
+
+UTC = datetime.timezone.utc
+
+
+class PeriodTest(TestCase):
+
+    def test_period_start(self):
+        value = datetime.datetime(2024, 5, 17, 13, 45, tzinfo = UTC)
+        self.assertEqual(partitioning.period_start(value, 'day'), datetime.datetime(2024, 5, 17, tzinfo = UTC))
+        self.assertEqual(partitioning.period_start(value, 'month'), datetime.datetime(2024, 5, 1, tzinfo = UTC))
+        self.assertEqual(partitioning.period_start(value, 'year'), datetime.datetime(2024, 1, 1, tzinfo = UTC))
+
+    def test_add_periods(self):
+        start = datetime.datetime(2024, 11, 1, tzinfo = UTC)
+        self.assertEqual(partitioning.add_periods(start, 'month', 3), datetime.datetime(2025, 2, 1, tzinfo = UTC))
+        self.assertEqual(partitioning.add_periods(start, 'month', -11), datetime.datetime(2023, 12, 1, tzinfo = UTC))
+        self.assertEqual(partitioning.add_periods(start, 'year', 1), datetime.datetime(2025, 11, 1, tzinfo = UTC))
+
+    def test_partition_name(self):
+        log_model = Payment.audit_log.model
+        start = datetime.datetime(2024, 5, 1, tzinfo = UTC)
+        name = partitioning.get_partition_name(log_model, start, 'month')
+        self.assertEqual(name, '%s_p2024_05'%log_model._meta.db_table)
+        self.assertEqual(partitioning.parse_partition_name(log_model, name, 'month'), start)
+        self.assertEqual(partitioning.parse_partition_name(log_model, name + 'x', 'month'), None)
+
+    def test_invalid_period(self):
+        self.assertRaises(ValueError, AuditLog, partition_by = 'week')
+        self.assertRaises(ValueError, AuditLog, partition_by = 'month', mode = 'delta')
+
+
+@skipUnless(connection.vendor == 'sqlite', "Table rotation is used on SQLite")
+class RotationTest(TransactionTestCase):
+
+    now = datetime.datetime(2024, 5, 10, tzinfo = UTC)
+
+    def tearDown(self):
+        log_model = Payment.audit_log.model
+        with connection.schema_editor() as schema_editor:
+            for name, start in partitioning.get_partitions(log_model, 'month'):
+                schema_editor.execute('DROP TABLE %s'%schema_editor.quote_name(name))
+
+    def create_payment(self, reference, action_date):
+        payment = Payment.objects.create(reference = reference)
+        Payment.audit_log.filter(id = payment.id).update(action_date = action_date)
+        return payment
+
+    def test_rotate(self):
+        log_model = Payment.audit_log.model
+        self.create_payment('march', datetime.datetime(2024, 3, 3, tzinfo = UTC))
+        self.create_payment('april', datetime.datetime(2024, 4, 20, tzinfo = UTC))
+        current = self.create_payment('may', datetime.datetime(2024, 5, 2, tzinfo = UTC))
+        created = partitioning.create_partitions(log_model, 'month', now = self.now)
+        table = log_model._meta.db_table
+        self.assertEqual(created, ['%s_p2024_03'%table, '%s_p2024_04'%table])
+        self.assertEqual(list(Payment.audit_log.values_list('reference', flat = True)), ['may'])
+        with connection.cursor() as cursor:
+            for archive, reference in zip(created, ['march', 'april']):
+                cursor.execute('SELECT reference FROM %s'%connection.ops.quote_name(archive))
+                self.assertEqual(cursor.fetchall(), [(reference,)])
+        #ids keep growing after the rotation
+        payment = Payment.objects.create(reference = 'june')
+        self.assertTrue(payment.audit_log.get().action_id > current.audit_log.get().action_id)
+        self.assertEqual(partitioning.create_partitions(log_model, 'month', now = self.now), [])
+
+    def test_late_entries(self):
+        log_model = Payment.audit_log.model
+        self.create_payment('march', datetime.datetime(2024, 3, 3, tzinfo = UTC))
+        partitioning.create_partitions(log_model, 'month', now = self.now)
+        self.create_payment('late', datetime.datetime(2024, 3, 30, tzinfo = UTC))
+        self.assertEqual(partitioning.create_partitions(log_model, 'month', now = self.now), [])
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reference FROM %s_p2024_03 ORDER BY action_id'%log_model._meta.db_table)
+            self.assertEqual(cursor.fetchall(), [('march',), ('late',)])
+
+    def test_triggers_kept(self):
+        log_model = Coupon.audit_log.model
+        triggers.install_triggers(Coupon)
+        try:
+            Coupon.objects.create(code = 'OLD')
+            Coupon.audit_log.update(action_date = datetime.datetime(2024, 4, 20, tzinfo = UTC))
+            partitioning.create_partitions(log_model, 'month', now = self.now)
+            #the triggers still write to the log table
+            Coupon.objects.create(code = 'NEW')
+            self.assertEqual(list(Coupon.audit_log.values_list('code', flat = True)), ['NEW'])
+        finally:
+            triggers.remove_triggers(Coupon)
+            with connection.schema_editor() as schema_editor:
+                for name, start in partitioning.get_partitions(log_model, 'month'):
+                    schema_editor.execute('DROP TABLE %s'%schema_editor.quote_name(name))
+
+    def test_drop_expired(self):
+        log_model = Payment.audit_log.model
+        self.create_payment('january', datetime.datetime(2024, 1, 3, tzinfo = UTC))
+        partitioning.create_partitions(log_model, 'month', now = datetime.datetime(2024, 2, 1, tzinfo = UTC))
+        self.create_payment('march', datetime.datetime(2024, 3, 3, tzinfo = UTC))
+        partitioning.create_partitions(log_model, 'month', now = self.now)
+        self.assertEqual(len(partitioning.get_partitions(log_model, 'month')), 2)
+        dropped = partitioning.drop_partitions(log_model, 'month', 3, now = self.now)
+        self.assertEqual(dropped, ['%s_p2024_01'%log_model._meta.db_table])
+        self.assertEqual([start.month for name, start in partitioning.get_partitions(log_model, 'month')], [3])
+
+    def test_command(self):
+        self.create_payment('march', datetime.datetime(2020, 3, 3, tzinfo = UTC))
+        out = StringIO()
+        call_command('audit_log_partitions', keep = 1, stdout = out)
+        table = Payment.audit_log.model._meta.db_table
+        self.assertEqual(out.getvalue().split('\n')[:2], ['Created %s_p2020_03'%table, 'Dropped %s_p2020_03'%table])
@@ -0,0 +1,106 @@
+import datetime
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils import timezone
+from audit_log import retention
+from .models import Article, Product, ProductCategory, ProductReview
+
+
+class PruneTest(TestCase):
+
+    def setUp(self):
+        self.category = ProductCategory.objects.create(name = 'gadgets', description = 'gadgets')
+        self.products = [Product.objects.create(name = 'product %s'%i, description = 'product',
+                                                price = 10, category = self.category)
+                         for i in range(5)]
+
+    def age_entries(self, model, ids, days):
+        model.audit_log.filter(id__in = ids).update(action_date = timezone.now() - datetime.timedelta(days = days))
+
+    def test_prune_chunks(self):
+        self.age_entries(Product, [p.pk for p in self.products[:3]], 100)
+        chunks = list(retention.delete_chunks(Product.audit_log.filter(
+            action_date__lt = timezone.now() - datetime.timedelta(days = 30)), chunk_size = 2))
+        self.assertEqual([deleted for deleted, last in chunks], [2, 1])
+        self.assertEqual(Product.audit_log.count(), 2)
+
+    def test_prune(self):
+        self.age_entries(Product, [self.products[0].pk], 100)
+        before = timezone.now() - datetime.timedelta(days = 30)
+        self.assertEqual(retention.prune(Product.audit_log.model, before), 1)
+        self.assertEqual(retention.prune(Product.audit_log.model, before), 0)
+        self.assertEqual(Product.audit_log.count(), 4)
+
+    def test_prune_delta(self):
+        article = Article.objects.create(title = "Title", body = "Body", status = "draft")
+        article = Article.objects.get(pk = article.pk)
+        article.status = "published"
+        article.save()
+        article.title = "New title"
+        article.save()
+        first, second, third = article.audit_log.order_by('action_id')
+        Article.audit_log.filter(action_id = first.action_id).update(
+            action_date = timezone.now() - datetime.timedelta(days = 100))
+        self.assertEqual(retention.prune(Article.audit_log.model, timezone.now() - datetime.timedelta(days = 30)), 1)
+        second, third = article.audit_log.order_by('action_id')
+        #the real change is kept for changed()
+        self.assertEqual(second.changed_fields, 0b1000)
+        self.assertTrue(second.full_state)
+        self.assertEqual(list(Article.audit_log.changed('title')), [third])
+        self.assertEqual((second.title, second.body, second.status), ("Title", "Body", "published"))
+        self.assertEqual(third.object_state.body, "Body")
+        state = article.audit_log.as_of(timezone.now())
+        self.assertEqual((state.title, state.body, state.status), ("New title", "Body", "published"))
+
+    def test_prune_delta_objects(self):
+        articles = [Article.objects.create(title = "Title %s"%i, body = "Body", status = "draft")
+                    for i in range(3)]
+        for article in articles:
+            article = Article.objects.get(pk = article.pk)
+            article.status = "published"
+            article.save()
+        Article.audit_log.filter(action_type = 'I').update(
+            action_date = timezone.now() - datetime.timedelta(days = 100))
+        before = timezone.now() - datetime.timedelta(days = 30)
+        #the chunk ids, its savepoint, one survivor lookup, a rebuild and an update per
+        #survivor, the DELETE, the savepoint release and the next chunk ids
+        with self.assertNumQueries(2 + 1 + 3 * 2 + 3):
+            self.assertEqual(retention.prune(Article.audit_log.model, before, chunk_size = 10), 3)
+        for article in articles:
+            entry = article.audit_log.get()
+            self.assertTrue(entry.full_state)
+            self.assertEqual((entry.title, entry.body, entry.status), (article.title, "Body", "published"))
+
+    def test_command_days(self):
+        self.age_entries(Product, [p.pk for p in self.products[:2]], 40)
+        out = StringIO()
+        call_command('prune_audit_log', '--model', Product._meta.label, '--days', '30',
+                     '--sleep', '0', stdout = out)
+        self.assertIn('deleted 2 entries', out.getvalue())
+        self.assertIn('rows/s', out.getvalue())
+        self.assertEqual(Product.audit_log.count(), 3)
+
+    def test_command_model_retention(self):
+        reviews = [ProductReview.objects.create(product = self.products[0], text = 'text %s'%i)
+                   for i in range(3)]
+        self.age_entries(ProductReview, [r.pk for r in reviews[:2]], 100)
+        self.age_entries(Product, [p.pk for p in self.products], 100)
+        call_command('prune_audit_log', '--sleep', '0', stdout = StringIO())
+        #only ProductReview sets a retention
+        self.assertEqual(ProductReview.audit_log.count(), 1)
+        self.assertEqual(Product.audit_log.count(), 5)
+
+    def test_dry_run(self):
+        self.age_entries(Product, [self.products[0].pk], 100)
+        out = StringIO()
+        call_command('prune_audit_log', '--model', Product._meta.label, '--days', '30',
+                     '--dry-run', stdout = out)
+        self.assertIn('1 entries older than', out.getvalue())
+        self.assertEqual(Product.audit_log.count(), 5)
+
+    def test_unknown_model(self):
+        self.assertRaises(CommandError, call_command, 'prune_audit_log', '--model', 'auth.Group',
+                          stdout = StringIO())
@@ -0,0 +1,92 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from audit_log import settings as local_settings
+from audit_log.buffering import buffered_atomic
+from audit_log.models.managers import CommitMarker
+from audit_log.routers import AuditLogRouter
+from .models import Offer, Product
+
+
+class AuditLogRouterTest(TestCase):
+
+    def setUp(self):
+        self.router = AuditLogRouter()
+        self.log_model = Offer.audit_log.model
+
+    def test_unconfigured(self):
+        self.assertIsNone(self.router.db_for_write(self.log_model))
+        self.assertIsNone(self.router.db_for_read(self.log_model))
+        self.assertIsNone(self.router.allow_migrate('default', 'audit_log', 'offerauditlogentry'))
+
+    @mock.patch.object(local_settings, 'DATABASE', 'audit')
+    def test_log_database(self):
+        self.assertEqual(self.router.db_for_write(self.log_model), 'audit')
+        self.assertEqual(self.router.db_for_read(self.log_model), 'audit')
+        self.assertIsNone(self.router.db_for_write(Offer))
+        self.assertIsNone(self.router.db_for_read(Offer))
+        self.assertTrue(self.router.allow_relation(self.log_model(), Product()))
+
+    @mock.patch.object(local_settings, 'DATABASE', 'audit')
+    @mock.patch.object(local_settings, 'READ_DATABASE', 'replica')
+    def test_read_database(self):
+        self.assertEqual(self.router.db_for_read(self.log_model), 'replica')
+        self.assertEqual(self.router.db_for_write(self.log_model), 'audit')
+        #referenced objects aren't read from the log database
+        self.assertEqual(self.router.db_for_read(Product, instance = Product.audit_log.model()), 'default')
+
+    @mock.patch.object(local_settings, 'DATABASE', 'audit')
+    def test_allow_migrate(self):
+        self.assertTrue(self.router.allow_migrate('audit', 'audit_log', 'offerauditlogentry'))
+        self.assertFalse(self.router.allow_migrate('default', 'audit_log', 'offerauditlogentry'))
+        self.assertIsNone(self.router.allow_migrate('default', 'audit_log', 'offer'))
+        self.assertIsNone(self.router.allow_migrate('default', 'audit_log'))
+
+
+@mock.patch.object(local_settings, 'DATABASE', 'audit')
+class LogDatabaseTest(TestCase):
+    databases = {'default', 'audit'}
+
+    def get_entries(self, using):
+        return list(Offer.audit_log.db_manager(using).order_by('action_id').values_list('action_type', 'price'))
+
+    def test_save(self):
+        offer = Offer.objects.create(title = "Lamp", price = 10)
+        offer.price = 12
+        offer.save()
+        self.assertEqual(self.get_entries('audit'), [('I', 10), ('U', 12)])
+        self.assertEqual(self.get_entries('default'), [])
+
+    def test_bulk(self):
+        Offer.objects.bulk_create([Offer(title = "Lamp", price = 10), Offer(title = "Desk", price = 20)])
+        Offer.objects.filter(price = 10).update(price = 11)
+        self.assertEqual(self.get_entries('audit'), [('I', 10), ('I', 20), ('U', 11)])
+        self.assertEqual(self.get_entries('default'), [])
+
+    def test_buffered(self):
+        with buffered_atomic():
+            Offer.objects.create(title = "Lamp", price = 10)
+        self.assertEqual(self.get_entries('audit'), [('I', 10)])
+        self.assertEqual(self.get_entries('default'), [])
+
+
+@mock.patch.object(local_settings, 'DEFER_WRITES', True)
+class DeferredWritesTest(TestCase):
+
+    def test_written_on_commit(self):
+        with self.captureOnCommitCallbacks(execute = True) as callbacks:
+            offer = Offer.objects.create(title = "Lamp", price = 10)
+            Offer.objects.bulk_update([Offer(pk = offer.pk, title = "Lamp", price = 12)], ['price'])
+            self.assertEqual(Offer.audit_log.count(), 0)
+        #one write per save, the other callbacks track the originals
+        self.assertEqual(len([callback for callback in callbacks if not isinstance(callback, CommitMarker)]), 2)
+        self.assertEqual(list(Offer.audit_log.order_by('action_id').values_list('action_type', 'price')),
+                         [('I', 10), ('U', 12)])
+
+    def test_queryset_update_on_same_database(self):
+        offer = Offer.objects.create(title = "Lamp", price = 10)
+        with self.captureOnCommitCallbacks(execute = True):
+            Offer.objects.filter(pk = offer.pk).update(price = 12)
+            #INSERT ... SELECT runs in the transaction of the update
+            self.assertEqual(Offer.audit_log.filter(action_type = 'U').count(), 1)
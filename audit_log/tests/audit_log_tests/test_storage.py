@@ -0,0 +1,151 @@
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, NotSupportedError, connection, transaction
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+from audit_log.buffering import buffered_atomic
+from audit_log.models.managers import AuditLog
+from audit_log.storage import SegmentFileStorage, fcntl, read_segment
+from .models import Click
+
+
+#the entries are written once the transaction commits
+class SegmentFileStorageTest(TransactionTestCase):
+
+    def setUp(self):
+        self.storage = Click.audit_log.audit_log.storage
+        self.storage.close()
+        self.directory = tempfile.mkdtemp()
+        self.storage.directory = self.directory
+
+    def tearDown(self):
+        self.storage.close()
+        self.storage.segment_size = 64 * 1024 * 1024
+        shutil.rmtree(self.directory)
+
+    def test_no_table(self):
+        self.assertFalse(Click.audit_log.model._meta.managed)
+        self.assertNotIn(Click.audit_log.model._meta.db_table, connection.introspection.table_names())
+
+    def test_queries_not_supported(self):
+        click = Click.objects.create(url = '/a')
+        self.assertRaises(NotSupportedError, Click.audit_log.all)
+        self.assertRaises(NotSupportedError, Click.audit_log.count)
+        self.assertRaises(NotSupportedError, click.audit_log.filter, url = '/a')
+        self.assertRaises(NotSupportedError, Click.audit_log.with_changes)
+        self.assertRaises(NotSupportedError, Click.audit_log.snapshot_as_of, timezone.now())
+        self.assertRaises(NotSupportedError, Click.audit_log.changed, 'url')
+
+    def test_records(self):
+        click = Click.objects.create(url = '/a')
+        click.count = 1
+        click.save()
+        other = Click.objects.create(url = '/b')
+        click.delete()
+        records = list(Click.audit_log.records())
+        self.assertEqual([(record.action_type, record.url, record.count) for record in records],
+                         [('D', '/a', 1), ('I', '/b', 0), ('U', '/a', 1), ('I', '/a', 0)])
+        self.assertEqual([record.action_id for record in records], [4, 3, 2, 1])
+        self.assertIsInstance(records[0].action_date, datetime.datetime)
+        self.assertEqual([record.action_type for record in other.audit_log.records()], ['I'])
+        self.assertEqual(records[2].object_state.count, 1)
+
+    def test_as_of(self):
+        click = Click.objects.create(url = '/a')
+        created = timezone.now()
+        click.count = 5
+        click.save()
+        self.assertIsNone(click.audit_log.as_of(created - datetime.timedelta(days = 1)))
+        self.assertEqual(click.audit_log.as_of(created).count, 0)
+        self.assertEqual(click.audit_log.as_of(timezone.now()).count, 5)
+
+    def test_bulk(self):
+        with buffered_atomic():
+            Click.objects.bulk_create([Click(url = '/a'), Click(url = '/b')])
+            Click.objects.update(count = 2)
+        self.assertEqual(sorted((record.action_type, record.url, record.count)
+                                for record in Click.audit_log.records()),
+                         [('I', '/a', 0), ('I', '/b', 0), ('U', '/a', 2), ('U', '/b', 2)])
+
+    def test_rotation(self):
+        self.storage.segment_size = 200
+        for i in range(10):
+            Click.objects.create(url = '/%s'%i)
+        segments = self.storage.get_segments()
+        self.assertGreater(len(segments), 2)
+        self.assertEqual([record.url for record in Click.audit_log.records()],
+                         ['/%s'%i for i in reversed(range(10))])
+
+    def test_restart_after_rotation(self):
+        self.storage.segment_size = 1
+        Click.objects.create(url = '/a')
+        Click.objects.create(url = '/b')
+        #the newest segment is empty after the rotation
+        self.assertEqual(os.path.getsize(self.storage.get_segments()[-1]), 0)
+        self.storage.close()
+        Click.objects.create(url = '/c')
+        self.assertEqual([(record.action_id, record.url) for record in Click.audit_log.records()],
+                         [(3, '/c'), (2, '/b'), (1, '/a')])
+
+    def test_torn_record(self):
+        Click.objects.create(url = '/a')
+        self.storage.close()
+        path = self.storage.get_segments()[-1]
+        with open(path, 'ab') as f:
+            f.write(b'\x00\x00\x01\x00partial')
+        self.assertEqual(len(read_segment(path)[0]), 1)
+        #the next write cuts the torn record off and continues the ids
+        Click.objects.create(url = '/b')
+        self.assertEqual([(record.action_id, record.url) for record in Click.audit_log.records()],
+                         [(2, '/b'), (1, '/a')])
+
+    def test_group_commit(self):
+        self.storage.fsync = True
+        threads = [threading.Thread(target = self.storage.save,
+                                    args = ([Click.audit_log.model(id = i, url = '/%s'%i, count = 0,
+                                                                   action_type = 'I')],))
+                   for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.storage._synced, self.storage._written)
+        self.assertEqual(sorted(record.action_id for record in Click.audit_log.records()),
+                         list(range(1, 21)))
+
+    def test_invalid_options(self):
+        storage = SegmentFileStorage(self.directory)
+        self.assertRaises(ValueError, AuditLog, storage = storage, mode = 'delta')
+        self.assertRaises(ValueError, AuditLog, storage = storage, background = True)
+
+    def test_rolled_back(self):
+        try:
+            with transaction.atomic():
+                Click.objects.create(url = '/a')
+                self.assertEqual(list(Click.audit_log.records()), [])
+                raise DatabaseError
+        except DatabaseError:
+            pass
+        Click.objects.create(url = '/b')
+        self.assertEqual([(record.action_id, record.url) for record in Click.audit_log.records()],
+                         [(1, '/b')])
+
+    @unittest.skipIf(fcntl is None, "fcntl not available")
+    def test_single_writer(self):
+        Click.objects.create(url = '/a')
+        other = SegmentFileStorage(self.directory)
+        other.bind(Click.audit_log.audit_log)
+        entry = Click.audit_log.model(id = 2, url = '/b', count = 0, action_type = 'I')
+        self.assertRaises(ImproperlyConfigured, other.save, [entry])
+        #released on close
+        self.storage.close()
+        other.save([entry])
+        other.close()
+        self.assertEqual([record.url for record in Click.audit_log.records()], ['/b', '/a'])
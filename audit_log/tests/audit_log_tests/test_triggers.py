@@ -0,0 +1,200 @@
+import sqlite3
+from unittest import skipUnless
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.db import DatabaseError, connection, transaction
+from django.db.backends.signals import connection_created
+from django.db.migrations.state import ProjectState
+from django.db.models import F, signals
+from django.test import TestCase, TransactionTestCase
+from audit_log import context, triggers
+from audit_log.models.managers import AuditLog
+from audit_log.operations import InstallAuditTriggers, RemoveAuditTriggers
+from .models import Coupon, ProductCategory
+
+
+@skipUnless(connection.vendor in ('sqlite', 'postgresql'), "Triggers need SQLite or PostgreSQL")
+class TriggerCaptureTest(TestCase):
+
+    def setUp(self):
+        triggers.install_triggers(Coupon)
+
+    def test_no_receivers(self):
+        self.assertFalse(signals.post_save.has_listeners(Coupon))
+        self.assertFalse(signals.post_delete.has_listeners(Coupon))
+
+    def test_connection_prepared(self):
+        #connected by the trigger AuditLog of Coupon
+        self.assertTrue(triggers._enabled)
+        self.assertTrue(connection_created.has_listeners())
+
+    def test_insert_update_delete(self):
+        coupon = Coupon.objects.create(code = 'SAVE10', discount = 10)
+        coupon.discount = 15
+        coupon.save()
+        coupon.delete()
+        entries = list(Coupon.audit_log.order_by('action_id'))
+        self.assertEqual([e.action_type for e in entries], ['I', 'U', 'D'])
+        self.assertEqual([e.discount for e in entries], [10, 15, 15])
+        self.assertEqual(entries[0].id, entries[2].id)
+        self.assertTrue(entries[0].action_date is not None)
+        self.assertEqual(entries[0].action_user, None)
+
+    def test_queryset_update_logged(self):
+        category = ProductCategory.objects.create(name = 'gadgets', description = 'gadgets')
+        Coupon.objects.create(code = 'A', discount = 1, category = category)
+        Coupon.objects.create(code = 'B', discount = 2)
+        Coupon.objects.update(discount = F('discount') + 1)
+        updates = Coupon.audit_log.filter(action_type = 'U')
+        self.assertEqual(sorted(updates.values_list('discount', flat = True)), [2, 3])
+        self.assertEqual(updates.get(code = 'A').category_id, 'gadgets')
+
+    def test_raw_sql_logged(self):
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO %s (code, discount) VALUES (%%s, %%s)"%Coupon._meta.db_table,
+                           ['RAW', 5])
+        self.assertEqual(Coupon.audit_log.get().code, 'RAW')
+
+    def test_user_from_context(self):
+        user = User.objects.create_user('jane', 'jane@example.com', 'secret')
+        token = context.set_context(user, 'session')
+        try:
+            Coupon.objects.create(code = 'USER', discount = 1)
+        finally:
+            context.reset_context(token)
+        Coupon.objects.create(code = 'ANON', discount = 1)
+        self.assertEqual(Coupon.audit_log.get(code = 'USER').action_user, user)
+        self.assertEqual(Coupon.audit_log.get(code = 'ANON').action_user, None)
+
+    @skipUnless(connection.vendor == 'sqlite', "Needs SQLite")
+    def test_foreign_connection(self):
+        tables = [Coupon._meta.db_table, Coupon.audit_log.model._meta.db_table]
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name IN (%s, %s)", tables)
+            statements = [row[0] for row in cursor.fetchall()]
+        statements += triggers.create_trigger_sql(connection, Coupon, Coupon.audit_log.model)
+        #a connection Django doesn't know about
+        db = sqlite3.connect(':memory:')
+        try:
+            for sql in statements:
+                db.execute(sql)
+            insert = "INSERT INTO %s (code, discount) VALUES ('RAW', 5)"%tables[0]
+            self.assertRaisesRegex(sqlite3.OperationalError, 'audit_log_user_id', db.execute, insert)
+            triggers.register_user_function(db)
+            db.execute(insert)
+            self.assertEqual(db.execute('SELECT code, action_user_id FROM %s'%tables[1]).fetchall(),
+                             [('RAW', None)])
+        finally:
+            db.close()
+
+    def test_operation_deconstruct(self):
+        self.assertEqual(InstallAuditTriggers('Coupon').deconstruct(),
+                         ('InstallAuditTriggers', ['Coupon'], {}))
+
+
+@skipUnless(connection.vendor in ('sqlite', 'postgresql'), "Triggers need SQLite or PostgreSQL")
+class TriggerOperationsTest(TransactionTestCase):
+
+    def tearDown(self):
+        triggers.remove_triggers(Coupon)
+
+    def test_operations(self):
+        state = ProjectState.from_apps(apps)
+        app_label = Coupon._meta.app_label
+        with connection.schema_editor() as editor:
+            RemoveAuditTriggers('Coupon').database_forwards(app_label, editor, state, state)
+        Coupon.objects.create(code = 'NONE', discount = 1)
+        self.assertEqual(Coupon.audit_log.count(), 0)
+        with connection.schema_editor() as editor:
+            InstallAuditTriggers('Coupon').database_forwards(app_label, editor, state, state)
+        Coupon.objects.create(code = 'LOGGED', discount = 1)
+        self.assertEqual(Coupon.audit_log.get().code, 'LOGGED')
+
+
+class FakeCursor(object):
+
+    def __init__(self):
+        self.cursor = self
+        self.executed = []
+
+    def execute(self, sql, params):
+        self.executed.append(params[1])
+
+
+class UserSettingWrapperTest(TestCase):
+
+    def setUp(self):
+        self.wrapper = triggers.UserSettingWrapper()
+        self.cursor = FakeCursor()
+        self.user = User.objects.create_user('jane', 'jane@example.com', 'secret')
+
+    def write(self):
+        context = {'connection' : connection, 'cursor' : self.cursor}
+        return self.wrapper(lambda *args: connection.in_atomic_block, 'INSERT INTO t VALUES (1)', [], False,
+                            context)
+
+    def test_once_per_transaction(self):
+        token = context.set_context(self.user, 'session')
+        try:
+            self.write()
+            self.write()
+            try:
+                with transaction.atomic():
+                    self.write()
+                    raise DatabaseError
+            except DatabaseError:
+                pass
+            self.write()
+            #the rolled back savepoint reverted nothing, the setting is from the outer block
+            self.assertEqual(self.cursor.executed, [str(self.user.pk)])
+        finally:
+            context.reset_context(token)
+        self.write()
+        self.assertEqual(self.cursor.executed, [str(self.user.pk), ''])
+
+    def test_rolled_back_savepoint(self):
+        token = context.set_context(self.user, 'session')
+        try:
+            try:
+                with transaction.atomic():
+                    self.write()
+                    raise DatabaseError
+            except DatabaseError:
+                pass
+            self.write()
+        finally:
+            context.reset_context(token)
+        self.assertEqual(self.cursor.executed, [str(self.user.pk)] * 2)
+
+    def test_no_user(self):
+        self.write()
+        self.assertEqual(self.cursor.executed, [])
+
+
+class AutocommitUserSettingTest(TransactionTestCase):
+
+    def test_own_transaction(self):
+        wrapper = triggers.UserSettingWrapper()
+        cursor = FakeCursor()
+        user = User.objects.create_user('jane', 'jane@example.com', 'secret')
+        context_dict = {'connection' : connection, 'cursor' : cursor}
+        token = context.set_context(user, 'session')
+        try:
+            for i in range(2):
+                in_transaction = wrapper(lambda *args: connection.in_atomic_block, 'UPDATE t SET a = 1', [],
+                                         False, context_dict)
+                self.assertTrue(in_transaction)
+        finally:
+            context.reset_context(token)
+        #the setting ended with each transaction
+        self.assertEqual(cursor.executed, [str(user.pk)] * 2)
+        self.assertFalse(connection.in_atomic_block)
+
+
+class TriggerOptionsTest(TestCase):
+
+    def test_invalid_options(self):
+        self.assertRaises(ValueError, AuditLog, capture = 'rules')
+        self.assertRaises(ValueError, AuditLog, capture = 'triggers', mode = 'delta')
+        self.assertRaises(ValueError, AuditLog, capture = 'triggers', background = True)
@@ -0,0 +1,102 @@
+import datetime
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ImproperlyConfigured
+from django.db import NotSupportedError, models
+from django.test import TestCase
+from django.utils import timezone
+
+from audit_log import context, settings as local_settings
+from audit_log.routers import AuditLogRouter
+from .models import LogEntry, Ticket, TicketComment
+
+
+class UnifiedStorageTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('admin', 'admin@example.com', 'admin')
+        token = context.set_context(self.user, 'session')
+        self.addCleanup(context.reset_context, token)
+        self.due = datetime.datetime(2026, 3, 1, 12, 30, 15, 250, tzinfo = datetime.timezone.utc)
+        self.ticket = Ticket.objects.create(title = "Broken lamp", due = self.due)
+        self.ticket.status = "closed"
+        self.ticket.save()
+        self.comment = TicketComment.objects.create(ticket = self.ticket, text = "Fixed")
+
+    def test_single_table(self):
+        self.assertFalse(Ticket.audit_log.model._meta.managed)
+        entries = LogEntry.objects.order_by('action_id')
+        self.assertEqual([(entry.content_type.model_class(), entry.object_id, entry.action_type)
+                          for entry in entries],
+                         [(Ticket, str(self.ticket.pk), 'I'), (Ticket, str(self.ticket.pk), 'U'),
+                          (TicketComment, str(self.comment.pk), 'I')])
+        self.assertEqual(entries[1].snapshot['status'], 'closed')
+        #everything a user touched, across models
+        self.assertEqual(LogEntry.objects.filter(action_user = self.user).count(), 3)
+
+    def test_manager(self):
+        self.assertEqual(Ticket.audit_log.count(), 2)
+        self.assertEqual(self.ticket.audit_log.count(), 2)
+        self.assertEqual(self.comment.audit_log.get().action_type, 'I')
+        self.assertEqual(Ticket.audit_log.filter(snapshot__status = 'closed').count(), 1)
+        self.assertEqual(self.ticket.audit_log.filter(snapshot__title__icontains = "lamp").count(), 2)
+        state = self.ticket.audit_log.all()[0].object_state
+        self.assertIsInstance(state, Ticket)
+        self.assertEqual(state.status, 'closed')
+        self.assertEqual(state.due, self.due)
+
+    def test_field_lookups(self):
+        self.assertEqual(Ticket.audit_log.filter(status = 'closed').count(), 1)
+        self.assertEqual(self.ticket.audit_log.exclude(status = 'closed').get().action_type, 'I')
+        self.assertEqual(Ticket.audit_log.filter(models.Q(title__icontains = 'lamp') | models.Q(status = 'x'),
+                                                 id = self.ticket.pk).count(), 2)
+        self.assertEqual(TicketComment.audit_log.filter(ticket = self.ticket).count(), 1)
+        self.assertEqual(Ticket.audit_log.filter(action_type = 'U', action_user = self.user).count(), 1)
+
+    def test_snapshot_as_of(self):
+        other = Ticket.objects.create(title = "Leak")
+        gone = Ticket.objects.create(title = "Noise")
+        gone.delete()
+        snapshot = Ticket.audit_log.snapshot_as_of(timezone.now())
+        self.assertEqual(sorted((entry.object_state.title, entry.object_state.status) for entry in snapshot),
+                         [("Broken lamp", "closed"), ("Leak", "open")])
+        self.assertEqual(Ticket.audit_log.snapshot_as_of(timezone.now()).filter(id = other.pk).count(), 1)
+
+    def test_column_methods(self):
+        self.assertRaises(NotSupportedError, Ticket.audit_log.with_changes)
+        self.assertRaises(NotSupportedError, self.ticket.audit_log.changed, 'status')
+
+    def test_records(self):
+        records = list(self.ticket.audit_log.records())
+        self.assertEqual([(record.action_type, record.status) for record in records],
+                         [('U', 'closed'), ('I', 'open')])
+        self.assertEqual(records[0].due, self.due)
+        self.assertEqual(records[0].action_user_id, self.user.pk)
+        self.assertEqual(records[0].object_state.pk, self.ticket.pk)
+        comment = next(self.comment.audit_log.records())
+        self.assertEqual(comment.ticket_id, self.ticket.pk)
+
+    def test_as_of(self):
+        self.assertEqual(self.ticket.audit_log.as_of(timezone.now()).status, 'closed')
+        self.assertIsNone(self.ticket.audit_log.as_of(timezone.now() - datetime.timedelta(days = 1)))
+        Ticket.objects.filter(pk = self.ticket.pk).delete()
+        self.assertIsNone(self.ticket.audit_log.as_of(timezone.now()))
+
+    def test_bulk(self):
+        Ticket.objects.filter(pk = self.ticket.pk).update(status = 'reopened')
+        self.assertEqual(self.ticket.audit_log.all()[0].snapshot['status'], 'reopened')
+        content_type = ContentType.objects.get_for_model(Ticket)
+        self.assertEqual(LogEntry.objects.filter(content_type = content_type).count(), 3)
+
+    def test_router(self):
+        self.assertTrue(AuditLogRouter().allow_relation(LogEntry(), self.user))
+
+    def test_missing_setting(self):
+        with mock.patch.object(local_settings, 'ENTRY_MODEL', None):
+            with self.assertRaises(ImproperlyConfigured):
+                Ticket.objects.create(title = "Flat tyre")
+        with mock.patch.object(local_settings, 'ENTRY_MODEL', 'audit_log.Missing'):
+            with self.assertRaises(ImproperlyConfigured):
+                list(self.ticket.audit_log.records())
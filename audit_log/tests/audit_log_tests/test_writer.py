@@ -0,0 +1,86 @@
+from django.test import TransactionTestCase
+from django.db import transaction
+
+from audit_log import writer
+from audit_log.writer import BackgroundWriter
+from .models import Product, ProductCategory, Shipment
+
+
+class BackgroundWriterTest(TransactionTestCase):
+    databases = {'default', 'audit'}
+
+    def setUp(self):
+        category = ProductCategory.objects.create(name = "gadgets", description = "gadgetry")
+        self.product = category.product_set.create(name = "new gadget", description = "best gadget eva", price = 100)
+
+    def make_entry(self):
+        return Shipment.audit_log.model(action_type = 'I', id = 1, product = self.product, quantity = 1)
+
+    def test_writes_in_background(self):
+        for quantity in range(3):
+            Shipment.objects.create(product = self.product, quantity = quantity)
+        writer.get_writer().flush()
+        self.assertEqual(Shipment.audit_log.all().count(), 3)
+        self.assertEqual(writer.get_writer().stats()['queue_depth'], 0)
+        self.assertIsNotNone(writer.get_writer().stats()['last_flush_latency'])
+
+    def test_rolled_back_not_written(self):
+        try:
+            with transaction.atomic():
+                Shipment.objects.create(product = self.product, quantity = 1)
+                raise ValueError
+        except ValueError:
+            pass
+        writer.get_writer().flush()
+        self.assertEqual(Shipment.audit_log.all().count(), 0)
+
+    def test_overflow_drop(self):
+        background = BackgroundWriter(max_queue_size = 1, overflow = 'drop')
+        background.put(self.make_entry())
+        background.put(self.make_entry())
+        self.assertEqual(background.stats()['queue_depth'], 1)
+        self.assertEqual(background.stats()['dropped'], 1)
+
+    def test_overflow_spill(self):
+        background = BackgroundWriter(max_queue_size = 1, overflow = 'spill')
+        background.put(self.make_entry())
+        background.put(self.make_entry())
+        self.assertEqual(background.stats()['spilled'], 1)
+        self.assertEqual(Shipment.audit_log.all().count(), 1)
+
+    def create_audit_product(self):
+        category = ProductCategory.objects.using('audit').create(name = "gadgets", description = "gadgetry")
+        return Product.objects.using('audit').create(name = "gadget", description = "gadget", price = 1,
+                                                     category = category)
+
+    def test_target_database(self):
+        product = self.create_audit_product()
+        background = BackgroundWriter(flush_interval = 60)
+        background.start()
+        background.put(Shipment.audit_log.model(action_type = 'I', id = 1, product = product, quantity = 1), 'audit')
+        background.put(self.make_entry(), 'default')
+        background.put(Shipment.audit_log.model(action_type = 'I', id = 1, product = product, quantity = 2), 'audit')
+        background.shutdown()
+        self.assertEqual(background.stats()['failed'], 0)
+        self.assertEqual(Shipment.audit_log.using('audit').count(), 2)
+        self.assertEqual(Shipment.audit_log.using('default').count(), 1)
+
+    def test_object_database(self):
+        product = self.create_audit_product()
+        Shipment.objects.using('audit').create(product = product, quantity = 1)
+        writer.get_writer().flush()
+        self.assertEqual(Shipment.audit_log.using('audit').count(), 1)
+        self.assertEqual(Shipment.audit_log.using('default').count(), 0)
+
+    def test_invalid_overflow(self):
+        self.assertRaises(ValueError, BackgroundWriter, overflow = 'explode')
+
+    def test_shutdown_drains_queue(self):
+        background = BackgroundWriter(flush_interval = 60)
+        background.start()
+        background.put(self.make_entry())
+        background.put(self.make_entry())
+        background.shutdown()
+        self.assertFalse(background.thread.is_alive())
+        self.assertEqual(background.stats()['written'], 2)
+        self.assertEqual(Shipment.audit_log.all().count(), 2)
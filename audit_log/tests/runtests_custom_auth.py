@@ -46,8 +46,13 @@ settings.configure(
     DATABASES={
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
-        }
+        },
+        #log database of the routing tests
+        'audit': {
+            'ENGINE': 'django.db.backends.sqlite3',
+        },
     },
+    AUDIT_LOG_ENTRY_MODEL='audit_log.LogEntry',
     LANGUAGE_CODE='en-us',
     TIME_ZONE='UTC',
     USE_I18N=True,
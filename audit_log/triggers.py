@@ -0,0 +1,295 @@
+"""
+Database trigger capture of audit log entries.
+
+Models tracked with ``AuditLog(capture = 'triggers')`` do not connect any
+signal receivers. Instead ``AFTER INSERT/UPDATE/DELETE`` triggers copy the
+rows into the ``[X]AuditLogEntry`` table, so ``QuerySet.update()``, bulk
+operations and raw SQL are logged as well. The triggers are installed with
+the ``audit_log.operations`` migration operations or ``install_triggers``.
+
+The acting user is read from the request context when the trigger runs:
+
+* on SQLite through the ``audit_log_user_id()`` SQL function that is
+  registered on every new connection once a model uses triggers. Other
+  connections to the database, opened without Django, need it too, see
+  ``register_user_function``,
+* on PostgreSQL through the ``audit_log.user_id`` setting, which is set
+  for the current transaction with ``set_config`` before the first write
+  of the transaction, or of the user if it changed.
+"""
+
+from django.conf import settings
+from django.db import NotSupportedError, connections, transaction, DEFAULT_DB_ALIAS
+from django.db.backends.signals import connection_created
+from django.db.backends.utils import truncate_name
+
+from audit_log import context
+
+
+USER_FUNCTION = 'audit_log_user_id'
+
+USER_SETTING = 'audit_log.user_id'
+
+ACTION_FIELDS = ('action_id', 'action_date', 'action_user', 'action_type')
+
+
+def current_user_id():
+    """
+    Returns the primary key of the acting user of the current request
+    context or ``None``.
+    """
+    current = context.get_context()
+    if current is None:
+        return None
+    return getattr(current.user, 'pk', None)
+
+
+def get_log_entry_model(model, apps = None):
+    """
+    Returns the log entry model of ``model``, looked up in ``apps`` if given
+    so it also works with historical models in migrations.
+    """
+    name = '%sAuditLogEntry'%model._meta.object_name
+    if apps is None:
+        from django.apps import apps
+    return apps.get_model(model._meta.app_label, name)
+
+
+def get_copied_columns(model, log_entry_model):
+    """
+    Returns ``(column, log_column)`` pairs for the fields of ``model`` that
+    are copied into ``log_entry_model``.
+    """
+    columns = dict((field.attname, field.column) for field in model._meta.concrete_fields)
+    return [(columns[field.attname], field.column)
+            for field in log_entry_model._meta.concrete_fields
+            if field.name not in ACTION_FIELDS and field.attname in columns]
+
+
+def get_trigger_name(connection, model, suffix = None):
+    name = 'audit_log_%s'%model._meta.db_table
+    if suffix:
+        name = '%s_%s'%(name, suffix)
+    return truncate_name(name, connection.ops.max_name_length())
+
+
+def _insert_sql(qn, model, log_entry_model, row, action_type, action_date, user_id):
+    pairs = get_copied_columns(model, log_entry_model)
+    log_columns = [qn(log_column) for column, log_column in pairs]
+    log_columns += [qn(log_entry_model._meta.get_field('action_date').column),
+                    qn(log_entry_model._meta.get_field('action_type').column),
+                    qn(log_entry_model._meta.get_field('action_user').column)]
+    values = ['%s.%s'%(row, qn(column)) for column, log_column in pairs]
+    values += [action_date, "'%s'"%action_type, user_id]
+    return 'INSERT INTO %s (%s) VALUES (%s);'%(
+        qn(log_entry_model._meta.db_table), ', '.join(log_columns), ', '.join(values))
+
+
+def _sqlite_create_sql(connection, model, log_entry_model):
+    qn = connection.ops.quote_name
+    #stored like the naive datetimes written by the sqlite backend
+    modifier = '' if settings.USE_TZ else ", 'localtime'"
+    action_date = "strftime('%%Y-%%m-%%d %%H:%%M:%%f', 'now'%s)"%modifier
+    user_id = '%s()'%USER_FUNCTION
+    statements = []
+    for event, row, action_type in (('INSERT', 'NEW', 'I'), ('UPDATE', 'NEW', 'U'), ('DELETE', 'OLD', 'D')):
+        statements.append('CREATE TRIGGER %s AFTER %s ON %s FOR EACH ROW BEGIN %s END;'%(
+            qn(get_trigger_name(connection, model, event.lower())), event, qn(model._meta.db_table),
+            _insert_sql(qn, model, log_entry_model, row, action_type, action_date, user_id)))
+    return statements
+
+
+def _sqlite_drop_sql(connection, model):
+    qn = connection.ops.quote_name
+    return ['DROP TRIGGER IF EXISTS %s;'%qn(get_trigger_name(connection, model, event))
+            for event in ('insert', 'update', 'delete')]
+
+
+def _postgresql_create_sql(connection, model, log_entry_model):
+    qn = connection.ops.quote_name
+    user_field = log_entry_model._meta.get_field('action_user')
+    user_id = "NULLIF(current_setting('%s', true), '')::%s"%(
+        USER_SETTING, user_field.target_field.rel_db_type(connection))
+    action_date = 'clock_timestamp()'
+    function = qn(get_trigger_name(connection, model))
+    body = ('BEGIN '
+            'IF TG_OP = \'DELETE\' THEN %s RETURN OLD; '
+            'ELSIF TG_OP = \'UPDATE\' THEN %s ELSE %s END IF; '
+            'RETURN NEW; END;')%(
+        _insert_sql(qn, model, log_entry_model, 'OLD', 'D', action_date, user_id),
+        _insert_sql(qn, model, log_entry_model, 'NEW', 'U', action_date, user_id),
+        _insert_sql(qn, model, log_entry_model, 'NEW', 'I', action_date, user_id))
+    return [
+        'CREATE OR REPLACE FUNCTION %s() RETURNS trigger AS $$ %s $$ LANGUAGE plpgsql;'%(function, body),
+        'CREATE TRIGGER %s AFTER INSERT OR UPDATE OR DELETE ON %s '
+        'FOR EACH ROW EXECUTE PROCEDURE %s();'%(function, qn(model._meta.db_table), function),
+    ]
+
+
+def _postgresql_drop_sql(connection, model):
+    qn = connection.ops.quote_name
+    function = qn(get_trigger_name(connection, model))
+    return [
+        'DROP TRIGGER IF EXISTS %s ON %s;'%(function, qn(model._meta.db_table)),
+        'DROP FUNCTION IF EXISTS %s();'%function,
+    ]
+
+
+_create_sql = {
+    'sqlite' : _sqlite_create_sql,
+    'postgresql' : _postgresql_create_sql,
+}
+
+_drop_sql = {
+    'sqlite' : _sqlite_drop_sql,
+    'postgresql' : _postgresql_drop_sql,
+}
+
+
+def create_trigger_sql(connection, model, log_entry_model):
+    """
+    Returns the statements creating the audit triggers of ``model``.
+    """
+    if connection.vendor not in _create_sql:
+        raise NotSupportedError("Audit log triggers are not supported on %s"%connection.vendor)
+    return _create_sql[connection.vendor](connection, model, log_entry_model)
+
+
+def drop_trigger_sql(connection, model):
+    """
+    Returns the statements dropping the audit triggers of ``model``.
+    """
+    if connection.vendor not in _drop_sql:
+        raise NotSupportedError("Audit log triggers are not supported on %s"%connection.vendor)
+    return _drop_sql[connection.vendor](connection, model)
+
+
+def install_triggers(model, using = DEFAULT_DB_ALIAS):
+    """
+    Installs the audit triggers of ``model``, for models that are not
+    managed by migrations.
+    """
+    connection = connections[using]
+    with transaction.atomic(using = using), connection.cursor() as cursor:
+        for sql in create_trigger_sql(connection, model, get_log_entry_model(model)):
+            cursor.execute(sql)
+
+
+def remove_triggers(model, using = DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    with transaction.atomic(using = using), connection.cursor() as cursor:
+        for sql in drop_trigger_sql(connection, model):
+            cursor.execute(sql)
+
+
+class _SettingMarker(object):
+    """
+    ``on_commit`` callback telling whether the transaction of a local
+    ``set_config`` call ended with a commit. Django drops the callbacks of
+    rolled back transactions and savepoints, which also revert the setting.
+    """
+
+    committed = False
+
+    def __call__(self):
+        self.committed = True
+
+
+class UserSettingWrapper(object):
+    """
+    Execute wrapper that keeps the ``audit_log.user_id`` setting of a
+    PostgreSQL connection in line with the request context. The setting is
+    local to the transaction, so it never outlives the request on a reused
+    or pooled connection. It is only sent before a write, once per
+    transaction and acting user. Writes in autocommit mode get a
+    transaction of their own with the setting.
+    """
+
+    WRITES = ('INSERT', 'UPDATE', 'DELETE')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.value = ''
+        self.marker = None
+
+    def get_current(self, connection):
+        """
+        Returns the value of the setting in the current transaction, empty
+        once the transaction that set it has ended.
+        """
+        marker = self.marker
+        if marker is None or marker.committed or not any(item[1] is marker for item in connection.run_on_commit):
+            return ''
+        return self.value
+
+    def set_user(self, cursor, value):
+        cursor.execute('SELECT set_config(%s, %s, true)', [USER_SETTING, value])
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip()[:6].upper() in self.WRITES:
+            connection = context['connection']
+            user_id = current_user_id()
+            value = '' if user_id is None else str(user_id)
+            if value != self.get_current(connection):
+                cursor = context['cursor'].cursor
+                if connection.in_atomic_block:
+                    self.set_user(cursor, value)
+                    self.value = value
+                    self.marker = _SettingMarker()
+                    transaction.on_commit(self.marker, using = connection.alias)
+                elif connection.get_autocommit():
+                    #the setting and the write share a transaction
+                    with transaction.atomic(using = connection.alias):
+                        self.set_user(cursor, value)
+                        return execute(sql, params, many, context)
+                else:
+                    #manual transactions can't be followed, the setting is sent before every write
+                    self.set_user(cursor, value)
+        return execute(sql, params, many, context)
+
+
+def register_user_function(sqlite_connection):
+    """
+    Registers the ``audit_log_user_id()`` SQL function the SQLite triggers
+    call on a ``sqlite3`` connection. Connections opened without Django
+    must register it before writing to a table with audit triggers, or
+    the write fails with "no such function".
+    """
+    sqlite_connection.create_function(USER_FUNCTION, 0, current_user_id)
+
+
+def prepare_connection(sender, connection, **kwargs):
+    """
+    Makes the acting user available to the triggers of a new connection.
+    """
+    if connection.vendor == 'sqlite':
+        register_user_function(connection.connection)
+    elif connection.vendor == 'postgresql':
+        wrapper = getattr(connection, 'audit_log_user_setting', None)
+        if wrapper is None:
+            wrapper = connection.audit_log_user_setting = UserSettingWrapper()
+            connection.execute_wrappers.append(wrapper)
+        wrapper.reset()
+
+
+#whether prepare_connection is connected
+_enabled = False
+
+
+def enable():
+    """
+    Prepares new and open connections for the triggers. Called once a model
+    with ``AuditLog(capture = 'triggers')`` is prepared, so projects without
+    one don't pay for the execute wrapper on every query.
+    """
+    global _enabled
+    if _enabled:
+        return
+    _enabled = True
+    connection_created.connect(prepare_connection, dispatch_uid = 'audit_log.triggers.prepare_connection')
+    for connection in connections.all():
+        if connection.connection is not None:
+            prepare_connection(None, connection)
+
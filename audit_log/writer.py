@@ -0,0 +1,183 @@
+"""
+Background write-behind writer for audit log entries.
+
+Models tracked with ``AuditLog(background = True)`` hand their log entries
+to a writer thread once the source transaction commits. The thread drains a
+bounded queue and inserts the entries in batches, taking the INSERTs off the
+request's critical path.
+"""
+
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.db import close_old_connections, connections
+
+from audit_log import settings as local_settings
+
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ('block', 'drop', 'spill')
+
+_STOP = object()
+
+
+class BackgroundWriter(object):
+    """
+    Writes log entries from a bounded queue in a daemon thread.
+
+    ``overflow`` decides what happens when the queue is full: ``'block'``
+    waits for free space, ``'drop'`` discards the entry and ``'spill'``
+    writes it synchronously in the calling thread.
+    """
+
+    def __init__(self, batch_size = 100, flush_interval = 1.0, max_queue_size = 10000,
+                 overflow = 'block'):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("overflow must be one of %s, not %r"%(', '.join(OVERFLOW_POLICIES), overflow))
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.queue = queue.Queue(max_queue_size)
+        self.thread = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_flush_latency = None
+        self.max_flush_latency = None
+        self.last_flush_duration = None
+
+    def start(self):
+        with self._lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target = self.run, name = 'audit-log-writer',
+                                               daemon = True)
+                self.thread.start()
+
+    def put(self, entry, using = None):
+        """
+        Queues an unsaved log entry for writing to the database ``using``,
+        the one chosen by the routers if ``None``.
+        """
+        item = (time.monotonic(), using, entry)
+        if self.overflow == 'block':
+            self.queue.put(item)
+            return
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            if self.overflow == 'drop':
+                with self._stats_lock:
+                    self.dropped += 1
+                logger.warning("Audit log writer queue is full, dropping a %s entry",
+                               entry.__class__.__name__)
+            else:
+                with self._stats_lock:
+                    self.spilled += 1
+                entry.save(force_insert = True, using = using)
+
+    def run(self):
+        try:
+            stop = False
+            while not stop:
+                item = self.queue.get()
+                if item is _STOP:
+                    self.queue.task_done()
+                    break
+                batch = [item]
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = self.queue.get(timeout = timeout)
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stop = True
+                        self.queue.task_done()
+                        break
+                    batch.append(item)
+                self.write(batch)
+        finally:
+            connections.close_all()
+
+    def write(self, batch):
+        close_old_connections()
+        started = time.monotonic()
+        by_target = {}
+        for queued_at, using, entry in batch:
+            by_target.setdefault((entry.__class__, using), []).append(entry)
+        try:
+            for (model, using), entries in by_target.items():
+                model._default_manager.db_manager(using).bulk_create(entries)
+                self.written += len(entries)
+        except Exception:
+            self.failed += len(batch)
+            logger.exception("Audit log writer failed to write %s entries", len(batch))
+        finally:
+            finished = time.monotonic()
+            self.batches += 1
+            self.last_flush_duration = finished - started
+            self.last_flush_latency = finished - batch[0][0]
+            self.max_flush_latency = max(self.max_flush_latency or 0, self.last_flush_latency)
+            for _ in batch:
+                self.queue.task_done()
+
+    def flush(self):
+        """
+        Blocks until every queued entry has been written.
+        """
+        self.queue.join()
+
+    def shutdown(self, timeout = None):
+        """
+        Writes the queued entries and stops the writer thread.
+        """
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(_STOP)
+            self.thread.join(timeout)
+
+    def stats(self):
+        return {
+            'queue_depth': self.queue.qsize(),
+            'written': self.written,
+            'dropped': self.dropped,
+            'spilled': self.spilled,
+            'failed': self.failed,
+            'batches': self.batches,
+            'last_flush_latency': self.last_flush_latency,
+            'max_flush_latency': self.max_flush_latency,
+            'last_flush_duration': self.last_flush_duration,
+        }
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """
+    Returns the shared, started ``BackgroundWriter`` configured by the
+    ``AUDIT_LOG_BACKGROUND_WRITER`` setting. The writer drains its queue
+    when the interpreter exits.
+    """
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                options = dict((key.lower(), value)
+                               for key, value in local_settings.BACKGROUND_WRITER.items())
+                writer = BackgroundWriter(**options)
+                writer.start()
+                atexit.register(writer.shutdown)
+                _writer = writer
+    return _writer
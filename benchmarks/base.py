@@ -0,0 +1,71 @@
+"""
+Shared setup for the benchmark scripts.
+
+Each script configures Django with an in-memory SQLite database, declares
+its models at runtime in the unmigrated ``audit_log`` app, so the
+benchmarks run straight from a checkout::
+
+    python benchmarks/save.py
+"""
+
+import os
+import sys
+import time
+
+import django
+from django.conf import settings
+
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+def setup(**options):
+    """
+    Configures and sets up Django for a benchmark run.
+    """
+    config = dict(
+        SECRET_KEY='django_benchmarks_secret_key',
+        INSTALLED_APPS=(
+            'django.contrib.auth',
+            'django.contrib.contenttypes',
+            'django.contrib.sessions',
+            'audit_log',
+        ),
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': ':memory:',
+            }
+        },
+        DEFAULT_AUTO_FIELD='django.db.models.AutoField',
+        USE_TZ=True,
+    )
+    config.update(options)
+    settings.configure(**config)
+    django.setup()
+
+
+def create_tables():
+    """
+    Creates the tables of the contrib apps and of the models declared by
+    the benchmark, which all live in the unmigrated ``audit_log`` app.
+    """
+    from django.core.management import call_command
+
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+
+def report(label, func, number, repeat=5):
+    """
+    Runs ``func`` ``number`` times per round and prints the best time
+    per call in microseconds.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print('%-40s %10.2f us' % (label, best / number * 1e6))
+    return best / number
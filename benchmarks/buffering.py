@@ -0,0 +1,55 @@
+"""
+Compares writing audit log entries one INSERT per save with the buffered
+mode, where they are written with one ``bulk_create`` before commit.
+
+Each round saves 500 tracked instances inside a single transaction.
+"""
+
+import base
+
+
+base.setup()
+
+from django.db import models, transaction
+
+from audit_log.buffering import buffered_atomic
+from audit_log.models.managers import AuditLog
+
+
+class Item(models.Model):
+    name = models.CharField(max_length=100)
+    description = models.TextField()
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.IntegerField(default=0)
+
+    audit_log = AuditLog()
+
+    class Meta:
+        app_label = 'audit_log'
+
+
+def main(rows=500):
+    base.create_tables()
+    items = [Item.objects.create(name='item %d' % i, description='description', price=10)
+             for i in range(rows)]
+
+    def save_all():
+        for item in items:
+            item.quantity += 1
+            item.save()
+
+    def per_row():
+        with transaction.atomic():
+            save_all()
+
+    def buffered():
+        with buffered_atomic():
+            save_all()
+
+    per_row_time = base.report('per row (%d saves)' % rows, per_row, 5)
+    buffered_time = base.report('buffered (%d saves)' % rows, buffered, 5)
+    print('speedup %.2fx' % (per_row_time / buffered_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""
+Compares importing tracked rows one ``save()`` at a time with the logged
+``bulk_create`` of ``AuditedManager``.
+
+Each round inserts 1000 rows inside a single transaction.
+"""
+
+import base
+
+
+base.setup()
+
+from django.db import models, transaction
+
+from audit_log.models.managers import AuditLog, AuditedManager
+
+
+class Item(models.Model):
+    name = models.CharField(max_length=100)
+    description = models.TextField()
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.IntegerField(default=0)
+
+    objects = AuditedManager()
+    audit_log = AuditLog()
+
+    class Meta:
+        app_label = 'audit_log'
+
+
+def main(rows=1000):
+    base.create_tables()
+
+    def build():
+        return [Item(name='item %d' % i, description='description', price=10) for i in range(rows)]
+
+    def per_row():
+        with transaction.atomic():
+            for item in build():
+                item.save()
+
+    def bulk():
+        with transaction.atomic():
+            Item.objects.bulk_create(build())
+
+    per_row_time = base.report('save() (%d rows)' % rows, per_row, 1)
+    bulk_time = base.report('bulk_create (%d rows)' % rows, bulk, 1)
+    print('speedup %.2fx' % (per_row_time / bulk_time))
+
+
+if __name__ == '__main__':
+    main()
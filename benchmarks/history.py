@@ -0,0 +1,63 @@
+"""
+Compares reading a long history as log entry model instances with reading
+it as the lightweight records returned by ``records()``.
+
+Reports the time and the peak memory used to walk 20000 log entries.
+"""
+
+import tracemalloc
+
+import base
+
+
+base.setup()
+
+from django.db import models
+
+from audit_log.models.managers import AuditLog
+
+
+class Item(models.Model):
+    name = models.CharField(max_length=100)
+    description = models.TextField()
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.IntegerField(default=0)
+
+    audit_log = AuditLog()
+
+    class Meta:
+        app_label = 'audit_log'
+
+
+def peak_memory(func):
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main(rows=20000):
+    base.create_tables()
+    Item.audit_log.model.objects.bulk_create([
+        Item.audit_log.model(id=i, name='item %d' % i, description='description ' * 10,
+                             price=10, quantity=i, action_type='U')
+        for i in range(rows)
+    ])
+
+    def entries():
+        for entry in Item.audit_log.all():
+            entry.quantity
+
+    def records():
+        for record in Item.audit_log.records():
+            record.quantity
+
+    base.report('entries (%d rows)' % rows, entries, 1, repeat=3)
+    base.report('records (%d rows)' % rows, records, 1, repeat=3)
+    print('%-40s %10.1f KiB' % ('entries peak memory', peak_memory(entries) / 1024.0))
+    print('%-40s %10.1f KiB' % ('records peak memory', peak_memory(records) / 1024.0))
+
+
+if __name__ == '__main__':
+    main()
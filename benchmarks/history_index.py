@@ -0,0 +1,92 @@
+"""
+Measures reading the latest entries of one object from a large log table
+with the ``(original pk, -action_date)`` history index, and with the
+single column index on the original pk that was used before.
+
+Usage::
+
+    python benchmarks/history_index.py [rows] [objects]
+
+The defaults fill the log table with 2000000 entries for 100000 objects.
+"""
+
+import datetime
+import random
+import sys
+import time
+
+import base
+
+
+base.setup()
+
+from django.db import connection, models
+
+from audit_log.models.managers import AuditLog
+
+
+class Item(models.Model):
+    name = models.CharField(max_length=100)
+    quantity = models.IntegerField(default=0)
+
+    audit_log = AuditLog()
+
+    class Meta:
+        app_label = 'audit_log'
+
+
+def fill(rows, objects, chunk=50000):
+    table = Item.audit_log.model._meta.db_table
+    start = datetime.datetime(2020, 1, 1)
+    sql = ('INSERT INTO %s (id, name, quantity, action_date, action_type) VALUES (%%s, %%s, %%s, %%s, %%s)'
+           % connection.ops.quote_name(table))
+    with connection.cursor() as cursor:
+        for offset in range(0, rows, chunk):
+            params = []
+            for i in range(offset, min(offset + chunk, rows)):
+                action_date = start + datetime.timedelta(seconds=i)
+                params.append((i % objects, 'item', i, action_date.isoformat(' '), 'U'))
+            cursor.executemany(sql, params)
+
+
+def latest_entries(objects, number=2000):
+    ids = [random.randrange(objects) for _ in range(number)]
+    start = time.perf_counter()
+    for id in ids:
+        list(Item.audit_log.filter(id=id).values_list('action_id', 'quantity')[:10])
+    return (time.perf_counter() - start) / number
+
+
+def plan():
+    sql, params = Item.audit_log.filter(id=1).values_list('action_id')[:10].query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return '; '.join(row[-1] for row in cursor.fetchall())
+
+
+def main(rows=2000000, objects=100000):
+    base.create_tables()
+    started = time.perf_counter()
+    fill(rows, objects)
+    print('filled %d entries in %.1fs' % (rows, time.perf_counter() - started))
+    meta = Item.audit_log.model._meta
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+    print('history index: %s' % plan())
+    indexed = latest_entries(objects)
+    print('%-40s %10.2f us' % ('latest 10, history index', indexed * 1e6))
+
+    with connection.cursor() as cursor:
+        cursor.execute('DROP INDEX %s' % qn(meta.indexes[0].name))
+        cursor.execute('CREATE INDEX item_log_id ON %s (id)' % qn(meta.db_table))
+        cursor.execute('ANALYZE')
+    print('pk index: %s' % plan())
+    single = latest_entries(objects)
+    print('%-40s %10.2f us' % ('latest 10, pk index', single * 1e6))
+    print('speedup %.2fx' % (single / indexed))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,78 @@
+"""
+Compares the size of the log table of a model with large text fields when
+every field has a column of its own and when they are packed into the
+compressed ``packed_fields`` column with ``AuditLog(pack = True)``, and
+the cost per logged save of both.
+"""
+
+import sys
+import time
+
+import base
+
+base.setup()
+
+from django.db import connection, models
+
+from audit_log.models.managers import AuditLog
+
+
+PARAGRAPH = ('Audit logs keep every version of a row, so the text of a document '
+             'is stored again each time any of its fields changes. ')
+
+
+class PlainDocument(models.Model):
+    title = models.CharField(max_length=100, db_index=True)
+    body = models.TextField()
+    notes = models.TextField()
+    pages = models.IntegerField(default=1)
+
+    audit_log = AuditLog()
+
+    class Meta:
+        app_label = 'audit_log'
+
+
+class PackedDocument(models.Model):
+    title = models.CharField(max_length=100, db_index=True)
+    body = models.TextField()
+    notes = models.TextField()
+    pages = models.IntegerField(default=1)
+
+    audit_log = AuditLog(pack=True)
+
+    class Meta:
+        app_label = 'audit_log'
+
+
+def table_size(model):
+    """
+    Returns the bytes stored in the columns of the table of ``model``.
+    """
+    qn = connection.ops.quote_name
+    lengths = ' + '.join('COALESCE(LENGTH(%s), 0)' % qn(field.column) for field in model._meta.concrete_fields)
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT SUM(%s) FROM %s' % (lengths, qn(model._meta.db_table)))
+        return cursor.fetchone()[0]
+
+
+def run(model, saves):
+    document = model.objects.create(title='Manual', body=PARAGRAPH * 40, notes=PARAGRAPH * 10)
+    start = time.perf_counter()
+    for i in range(saves):
+        document.pages = i
+        document.save()
+    elapsed = time.perf_counter() - start
+    log_model = model.audit_log.model
+    print('%-16s %10.2f us/save %10.1f KiB source %10.1f KiB log' % (
+        model.__name__, elapsed / saves * 1e6, table_size(model) / 1024.0, table_size(log_model) / 1024.0))
+
+
+def main(saves=2000):
+    base.create_tables()
+    run(PlainDocument, saves)
+    run(PackedDocument, saves)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
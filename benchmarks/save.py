@@ -0,0 +1,69 @@
+"""
+Measures the cost of saving a tracked model.
+
+Reports the time per INSERT and per UPDATE of a model that has the four
+``AuthStampedModel`` fields and an ``AuditLog``, and the time spent in the
+``pre_save``/``post_save`` handlers alone.
+"""
+
+import base
+
+
+base.setup()
+
+from django.contrib.auth.models import User
+from django.db import models
+from django.db.models import signals
+
+from audit_log import context
+from audit_log.models import AuthStampedModel
+from audit_log.models.managers import AuditLog
+import audit_log.middleware
+
+
+class Item(AuthStampedModel):
+    name = models.CharField(max_length=100)
+    sku = models.CharField(max_length=20, unique=True)
+    description = models.TextField()
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.IntegerField(default=0)
+    active = models.BooleanField(default=True)
+
+    audit_log = AuditLog()
+
+    class Meta:
+        app_label = 'audit_log'
+
+
+def main(number=2000):
+    base.create_tables()
+    user = User.objects.create(username='bench')
+    context.set_context(user, 'bench-session-key')
+
+    counter = iter(range(10 ** 9))
+
+    def insert():
+        Item.objects.create(name='item', sku='sku-%d' % next(counter),
+                            description='description', price=10)
+
+    item = Item.objects.create(name='item', sku='sku', description='description', price=10)
+
+    def update():
+        item.quantity += 1
+        item.save()
+
+    entry = Item.audit_log.model(action_type='U')
+
+    def handlers():
+        signals.pre_save.send(sender=Item, instance=item, raw=False,
+                              using='default', update_fields=None)
+        signals.pre_save.send(sender=Item.audit_log.model, instance=entry,
+                              raw=False, using='default', update_fields=None)
+
+    base.report('insert (with audit log entry)', insert, number)
+    base.report('update (with audit log entry)', update, number)
+    base.report('pre_save handlers (item + entry)', handlers, number * 10)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Compares writing log entries to the log table with appending them to
+segment files, one entry per write as for single saves. The SQLite
+database is a file here, so both sides wait for the disk on commit.
+
+The segment file storage is measured with and without ``fsync`` and with
+several threads writing at once, which share their ``fsync`` calls.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import base
+
+directory = tempfile.mkdtemp()
+
+base.setup(DATABASES={
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(directory, 'db.sqlite3'),
+    }
+})
+
+from django.db import connections, models
+
+from audit_log.models.managers import AuditLog
+from audit_log.storage import SegmentFileStorage
+
+
+class TableItem(models.Model):
+    name = models.CharField(max_length=100)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.IntegerField(default=0)
+
+    audit_log = AuditLog()
+
+    class Meta:
+        app_label = 'audit_log'
+
+
+class FileItem(models.Model):
+    name = models.CharField(max_length=100)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.IntegerField(default=0)
+
+    audit_log = AuditLog(storage=SegmentFileStorage(directory))
+
+    class Meta:
+        app_label = 'audit_log'
+
+
+def write(audit_log, writes):
+    item = audit_log.model(pk=1, name='item', price=10, quantity=1)
+    for _ in range(writes):
+        audit_log.save_entries([audit_log.build_log_entry(item, 'U')], 'default')
+
+
+def run(label, audit_log, writes, threads=1):
+    workers = [threading.Thread(target=write, args=(audit_log, writes // threads)) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    print('%-40s %10.2f us %10.0f entries/s' % (label, elapsed / writes * 1e6, writes / elapsed))
+    connections.close_all()
+    return elapsed
+
+
+def main(writes=2000):
+    base.create_tables()
+    table_log = TableItem.audit_log.audit_log
+    file_log = FileItem.audit_log.audit_log
+    storage = file_log.storage
+    try:
+        run('log table', table_log, writes)
+        run('segment files, fsync', file_log, writes)
+        run('segment files, fsync, 8 threads', file_log, writes, threads=8)
+        storage.fsync = False
+        run('segment files, no fsync', file_log, writes)
+    finally:
+        storage.close()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])